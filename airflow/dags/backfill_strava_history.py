@@ -0,0 +1,78 @@
+import os
+from airflow import DAG
+from airflow.operators.python_operator import PythonOperator
+from airflow.utils.dates import days_ago
+from datetime import timedelta, datetime
+
+os.chdir('/Users/Jack/Documents/projects/StravaDataPipeline/')
+
+default_args = {"owner": "airflow", "depends_on_past": False, "retries": 2}
+
+
+def import_backfill():
+    # imported at run time so DAG parsing stays cheap
+    import sys
+    sys.path.insert(0, os.getcwd())
+    import src.backfill_strava_history as backfill
+    return backfill
+
+
+def plan_backfill_windows(**context):
+    backfill = import_backfill()
+    from src.utilities.pipeline_context import get_pipeline_context
+    from src.utilities.strava_api_utils import load_strava_athletes
+    conf = context['dag_run'].conf or {}
+    start = datetime.fromisoformat(conf.get('start', backfill.BACKFILL_START_DATE.isoformat()))
+    end = datetime.fromisoformat(conf.get('end', datetime.utcnow().isoformat()))
+    window_days = int(conf.get('window_days', backfill.DEFAULT_WINDOW_DAYS))
+    athlete_ids = [a.athlete_id for a in load_strava_athletes(get_pipeline_context().config)]
+    windows = backfill.plan_backfill_windows(start, end, timedelta(days=window_days), athlete_ids)
+    # one list of op_args per mapped backfill_window task
+    return [[w.athlete_id, w.after.isoformat(), w.before.isoformat()] for w in windows]
+
+
+def backfill_window(athlete_id, after, before):
+    return import_backfill().run_backfill_window_task(athlete_id, after, before)
+
+
+def load_backfill_partitions(task_results):
+    import_backfill().load_backfill_task_results(list(task_results))
+
+
+with DAG(
+    dag_id='backfill_strava_history',
+    description ='Reload Strava history in parallel time windows',
+    schedule_interval=None,
+    default_args=default_args,
+    start_date=days_ago(1),
+    catchup=False,
+    # every run stages into its own tables, so backfills of different ranges can overlap
+    max_active_runs=4,
+    tags=['StravaELT'],
+) as dag:
+
+    plan_task = PythonOperator(
+        task_id = 'plan_backfill_windows',
+        python_callable = plan_backfill_windows,
+        dag = dag,
+    )
+    plan_task.doc_md = 'Split the date range in the run conf (start, end, window_days) into windows for every athlete.'
+
+    # dynamic task mapping needs Airflow 2.3+, a failed window is retried on its own
+    backfill_tasks = PythonOperator.partial(
+        task_id = 'backfill_window',
+        python_callable = backfill_window,
+        max_active_tis_per_dag = 8,
+        dag = dag,
+    ).expand(op_args = plan_task.output)
+    backfill_tasks.doc_md = 'Extract one window and export it to s3 as its own partition with a COPY manifest.'
+
+    load_task = PythonOperator(
+        task_id = 'load_backfill_partitions',
+        python_callable = load_backfill_partitions,
+        op_kwargs = {'task_results': backfill_tasks.output},
+        dag = dag,
+    )
+    load_task.doc_md = 'Stage, validate and promote every partition, rebuild the data model and tiles, then move the watermarks up.'
+
+    plan_task >> backfill_tasks >> load_task
@@ -0,0 +1,134 @@
+"""
+Benchmark the compiled ActivityParser against the original parse_api_output.
+
+Parses N synthetic /athlete/activities payloads (cycling through a pool of
+distinct payloads so the inputs fit in memory) and reports throughput and
+the peak memory of holding every parsed activity.
+
+    python -m benchmarks.bench_parser --payloads 1000000
+"""
+
+import argparse
+import gc
+import re
+import time
+import tracemalloc
+
+from itertools import islice
+from typing import Callable, List
+
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.utilities.strava_api_utils import ActivityParser, convert_strava_start_date
+
+
+def legacy_parse_api_output(response_json: dict) -> list:
+    """The original parser, kept verbatim for comparison."""
+    activity = []
+    cols_to_extract = [
+        "id",
+        "name",
+        "distance",
+        "moving_time",
+        "elapsed_time",
+        "total_elevation_gain",
+        "type",
+        "workout_type",
+        "location_country",
+        "achievement_count",
+        "kudos_count",
+        "comment_count",
+        "athlete_count",
+        "average_speed",
+        "max_speed",
+        "average_cadence",
+        "average_temp",
+        "average_heartrate",
+        "max_heartrate",
+        "suffer_score",
+    ]
+    for col in cols_to_extract:
+        try:
+            activity.append(response_json[col])
+        except KeyError:
+            activity.append(None)
+    try:
+        start_date = convert_strava_start_date(response_json["start_date"])
+        activity.append(start_date)
+    except KeyError:
+        activity.append(None)
+    try:
+        timezone = response_json["timezone"]
+        timezone = re.sub(r"[\(\[].*?[\)\]]", "", timezone)
+        activity.append(timezone[1:])
+    except KeyError:
+        activity.append(None)
+    try:
+        start_latlng = response_json["start_latlng"]
+        if len(start_latlng) == 2:
+            activity.append(start_latlng[0])
+            activity.append(start_latlng[1])
+        else:
+            activity.append(None)
+            activity.append(None)
+    except KeyError:
+        activity.append(None)
+        activity.append(None)
+    return activity
+
+
+def pages(pool: List[dict], n_payloads: int, page_size: int = 200):
+    """Yield n_payloads payloads from the pool in API sized pages."""
+    for start in range(0, n_payloads, page_size):
+        yield [
+            pool[i % len(pool)]
+            for i in range(start, min(start + page_size, n_payloads))
+        ]
+
+
+def run_strategy(parse_page: Callable, pool: List[dict], n_payloads: int):
+    """Parse every page, returning (seconds, peak bytes of the retained output)."""
+    gc.collect()
+    start = time.perf_counter()
+    for page in pages(pool, n_payloads):
+        parse_page(page)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    retained = [parse_page(page) for page in pages(pool, n_payloads)]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retained
+    return elapsed, peak
+
+
+def run_benchmark(n_payloads: int, pool_size: int) -> None:
+    pool = list(islice(generate_activity_payloads(pool_size), pool_size))
+    parser = ActivityParser()
+    strategies = [
+        ("legacy parse_api_output", lambda p: [legacy_parse_api_output(r) for r in p]),
+        ("ActivityParser.parse_list", lambda p: [parser.parse_list(r) for r in p]),
+        ("ActivityParser.parse", lambda p: [parser.parse(r) for r in p]),
+        ("ActivityParser.parse_page", parser.parse_page),
+    ]
+    # the legacy parser predates the content_hash, summary_polyline and
+    # athlete_id columns
+    assert [legacy_parse_api_output(r) for r in pool] == [
+        parser.parse_list(r)[:-3] for r in pool
+    ], "compiled parser output differs from the legacy parser"
+
+    print(f"{'strategy':<28}{'rows/s':>12}{'seconds':>10}{'peak MiB':>10}")
+    for name, parse_page in strategies:
+        elapsed, peak = run_strategy(parse_page, pool, n_payloads)
+        print(
+            f"{name:<28}{n_payloads / elapsed:>12,.0f}{elapsed:>10.2f}"
+            f"{peak / 2**20:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--payloads", type=int, default=1_000_000)
+    parser.add_argument("--pool-size", type=int, default=10_000)
+    args = parser.parse_args()
+    run_benchmark(args.payloads, args.pool_size)
@@ -0,0 +1,259 @@
+"""
+Benchmark every pipeline stage on synthetic load, fully offline.
+
+Activities are generated to the production schema and pushed through the
+real pipeline code: extraction against the mock Strava API (rate limit
+sleeps run on a virtual clock), parsing, the streamed gzip export to a local
+s3 stand-in, and the COPY, merge and validation suite against a DuckDB
+stand-in for Redshift. Extraction is capped at --api-rows, as the daily API
+budget never allows more than 200k activities a day anyway.
+
+Throughput and p50/p95 latencies are printed per stage. Save a baseline on
+the CI runner with --save-baseline and later runs with --baseline exit
+non-zero when a stage's throughput regresses by more than --tolerance.
+
+    python -m benchmarks.bench_pipeline --rows 10000,100000,1000000
+    python -m benchmarks.bench_pipeline --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from datetime import timedelta
+from itertools import islice
+from typing import Dict, List, NamedTuple, Optional
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.local_warehouse import copy_export_to_staging, create_local_warehouse
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.extract_strava_data import iter_strava_activities, stream_activities_to_s3
+from src.redshift_staging_to_production import redshift_staging_to_production
+from src.utilities.strava_api_utils import (
+    STRAVA_MAX_PER_PAGE,
+    StravaRateLimiter,
+    convert_strava_start_date,
+    parse_api_output,
+)
+from src.validator import VALIDATION_SUITE_PATH, run_validation_suite
+
+TABLE_NAME = "public.strava_activity_data"
+
+
+class StageResult(NamedTuple):
+    stage: str
+    rows: int
+    seconds: float
+    p50_ms: Optional[float] = None
+    p95_ms: Optional[float] = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float("inf")
+
+
+def percentile_ms(latencies: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of latencies in seconds, in milliseconds."""
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+
+def stage_result(stage: str, rows: int, latencies: List[float]) -> StageResult:
+    return StageResult(
+        stage,
+        rows,
+        sum(latencies),
+        percentile_ms(latencies, 0.5),
+        percentile_ms(latencies, 0.95),
+    )
+
+
+def bench_extract(n_rows: int) -> StageResult:
+    """Extract n_rows new activities from the mock API, latency per page."""
+    payloads = list(generate_activity_payloads(n_rows + STRAVA_MAX_PER_PAGE))
+    oldest_new = convert_strava_start_date(payloads[n_rows - 1]["start_date"])
+    last_updated_warehouse = oldest_new - timedelta(seconds=1)
+    header = {"Authorization": "Bearer mock-access-token"}
+    clock = VirtualClock()
+    # a daily budget large enough for the biggest extraction benchmarked
+    with MockStravaAPI(payloads, 600, 30000, clock.time) as api:
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+        activities = iter_strava_activities(
+            last_updated_warehouse, header, rate_limiter, api.activities_url
+        )
+        latencies, n_extracted = [], 0
+        start = time.perf_counter()
+        for n_extracted, _ in enumerate(activities, 1):
+            if n_extracted % STRAVA_MAX_PER_PAGE == 0:
+                latencies.append(time.perf_counter() - start)
+                start = time.perf_counter()
+        latencies.append(time.perf_counter() - start)
+    return stage_result("extract", n_extracted, latencies)
+
+
+def bench_parse_and_export(n_rows: int, export_file_path: str) -> List[StageResult]:
+    """
+    Parse n_rows generated payloads a page at a time and stream them through
+    the gzip multipart export, then save the exported object for loading.
+    Payload generation is excluded from both stages.
+    """
+    parse_latencies = []
+    producer_seconds = 0.0
+
+    def parsed_activities():
+        nonlocal producer_seconds
+        payloads = generate_activity_payloads(n_rows)
+        while True:
+            start = time.perf_counter()
+            page = list(islice(payloads, STRAVA_MAX_PER_PAGE))
+            if not page:
+                return
+            parse_start = time.perf_counter()
+            activities = [parse_api_output(response_json) for response_json in page]
+            end = time.perf_counter()
+            parse_latencies.append(end - parse_start)
+            producer_seconds += end - start
+            yield from activities
+
+    s3 = LocalS3Client()
+    start = time.perf_counter()
+    n_exported = stream_activities_to_s3(
+        parsed_activities(), s3, "bench", "export_file.csv.gz"
+    )
+    export_seconds = time.perf_counter() - start - producer_seconds
+    with open(export_file_path, "wb") as fp:
+        fp.write(s3.objects[("bench", "export_file.csv.gz")])
+    return [
+        stage_result("parse", n_exported, parse_latencies),
+        StageResult("export", n_exported, export_seconds),
+    ]
+
+
+def bench_warehouse(export_file_path: str) -> List[StageResult]:
+    """
+    COPY the export into an empty warehouse and merge it, then stage the same
+    export again to validate it against that history and merge it unchanged.
+    """
+    conn = create_local_warehouse()
+    start = time.perf_counter()
+    n_staged = copy_export_to_staging(conn, TABLE_NAME, export_file_path)
+    load = StageResult("load", n_staged, time.perf_counter() - start)
+    start = time.perf_counter()
+    redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    promote = StageResult("promote", n_staged, time.perf_counter() - start)
+
+    copy_export_to_staging(conn, TABLE_NAME, export_file_path)
+    start = time.perf_counter()
+    check_results = run_validation_suite(conn.cursor, VALIDATION_SUITE_PATH)
+    check_seconds = [result.seconds for result in check_results]
+    validate = StageResult(
+        "validate",
+        n_staged,
+        time.perf_counter() - start,
+        percentile_ms(check_seconds, 0.5),
+        percentile_ms(check_seconds, 0.95),
+    )
+    start = time.perf_counter()
+    redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    remerge = StageResult("remerge", n_staged, time.perf_counter() - start)
+    conn.close()
+    return [load, promote, validate, remerge]
+
+
+def run_benchmark(
+    n_rows: int, api_rows: int, repeat: int = 1
+) -> Dict[str, StageResult]:
+    """
+    Run every stage for n_rows activities, returning results by stage.
+    With repeat > 1 each stage keeps its fastest run, to damp noisy runners.
+    """
+    best = {}
+    for _ in range(repeat):
+        results = [bench_extract(min(n_rows, api_rows))]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            export_file_path = os.path.join(tmp_dir, "export_file.csv.gz")
+            results.extend(bench_parse_and_export(n_rows, export_file_path))
+            results.extend(bench_warehouse(export_file_path))
+        for result in results:
+            if result.stage not in best or result.seconds < best[result.stage].seconds:
+                best[result.stage] = result
+    return best
+
+
+def results_to_json(results: Dict[int, Dict[str, StageResult]]) -> dict:
+    return {
+        str(n_rows): {
+            stage: dict(result._asdict(), rows_per_second=result.rows_per_second)
+            for stage, result in stage_results.items()
+        }
+        for n_rows, stage_results in results.items()
+    }
+
+
+def find_regressions(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Stages whose throughput fell more than tolerance below the baseline."""
+    regressions = []
+    for n_rows, stage_results in current.items():
+        for stage, result in stage_results.items():
+            expected = baseline.get(n_rows, {}).get(stage)
+            if expected is None:
+                continue
+            floor = expected["rows_per_second"] * (1 - tolerance)
+            if result["rows_per_second"] < floor:
+                regressions.append(
+                    f"{stage} @ {n_rows} rows: {result['rows_per_second']:,.0f} rows/s "
+                    f"< {floor:,.0f} rows/s ({expected['rows_per_second']:,.0f} baseline)"
+                )
+    return regressions
+
+
+def format_results(n_rows: int, stage_results: Dict[str, StageResult]) -> str:
+    lines = [
+        f"{n_rows:,} rows",
+        f"{'stage':<10}{'rows':>10}{'seconds':>10}{'rows/s':>12}"
+        f"{'p50 ms':>10}{'p95 ms':>10}",
+    ]
+    for result in stage_results.values():
+        p50 = "-" if result.p50_ms is None else f"{result.p50_ms:.2f}"
+        p95 = "-" if result.p95_ms is None else f"{result.p95_ms:.2f}"
+        lines.append(
+            f"{result.stage:<10}{result.rows:>10,}{result.seconds:>10.3f}"
+            f"{result.rows_per_second:>12,.0f}{p50:>10}{p95:>10}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--rows", default="10000", help="comma separated row counts, e.g. 10000,1e7"
+    )
+    parser.add_argument("--api-rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--save-baseline", help="write the results as a baseline")
+    parser.add_argument("--baseline", help="fail on regressions against this file")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = {}
+    for n_rows in (int(float(n)) for n in args.rows.split(",")):
+        results[n_rows] = run_benchmark(n_rows, args.api_rows, args.repeat)
+        print(format_results(n_rows, results[n_rows]) + "\n")
+    current = results_to_json(results)
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as fp:
+                json.dump(current, fp, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            regressions = find_regressions(current, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
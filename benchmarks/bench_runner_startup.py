@@ -0,0 +1,76 @@
+"""
+Benchmark the interpreter startup and import cost of running the pipeline
+as one process per Airflow task versus in-process with src.run_pipeline.
+
+Connection setup (MySQL, Redshift, TLS to S3/Strava) is not measured as it
+needs live services, so the in-process savings reported are a lower bound.
+
+    python -m benchmarks.bench_runner_startup --repeat 5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# modules and SDKs each BashOperator task imported before the runner existed
+LEGACY_TASK_IMPORTS = {
+    "extract_strava_data": ["requests", "pymysql", "boto3", "src.extract_strava_data"],
+    "copy_to_redshift_staging": ["psycopg2", "src.copy_to_redshift_staging"],
+    "validate_staging_data_dup": ["requests", "psycopg2", "src.validator"],
+    "validate_staging_data_weekly_activity_count": [
+        "requests",
+        "psycopg2",
+        "src.validator",
+    ],
+    "validate_staging_data_weekly_kudos_avg": ["requests", "psycopg2", "src.validator"],
+    "redshift_staging_to_production": [
+        "psycopg2",
+        "src.redshift_staging_to_production",
+    ],
+    "build_data_model": ["psycopg2", "src.build_data_model"],
+}
+# the same modules imported once by the in-process runner
+RUNNER_IMPORTS = [
+    "src.run_pipeline",
+    "requests",
+    "pymysql",
+    "boto3",
+    "psycopg2",
+    "src.extract_strava_data",
+    "src.copy_to_redshift_staging",
+    "src.validator",
+    "src.redshift_staging_to_production",
+    "src.build_data_model",
+]
+
+
+def time_interpreter(modules) -> float:
+    """Start a fresh interpreter that imports modules, returning wall seconds."""
+    code = "; ".join(f"import {module}" for module in modules)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+def run_benchmark(repeat: int) -> None:
+    legacy = [
+        sum(time_interpreter(modules) for modules in LEGACY_TASK_IMPORTS.values())
+        for _ in range(repeat)
+    ]
+    runner = [time_interpreter(RUNNER_IMPORTS) for _ in range(repeat)]
+    legacy_s, runner_s = statistics.median(legacy), statistics.median(runner)
+    print(f"{'strategy':<34}{'interpreters':>14}{'seconds':>10}")
+    print(
+        f"{'one interpreter per task':<34}{len(LEGACY_TASK_IMPORTS):>14}{legacy_s:>10.2f}"
+    )
+    print(f"{'in-process run_pipeline':<34}{1:>14}{runner_s:>10.2f}")
+    print(f"saved per run: {legacy_s - runner_s:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(args.repeat)
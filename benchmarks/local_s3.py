@@ -0,0 +1,77 @@
+import io
+import itertools
+import threading
+
+from typing import Dict, Tuple
+
+from src.utilities.s3_utils import MIN_PART_SIZE
+
+
+class LocalS3Client:
+    """
+    In-memory stand-in for the subset of the boto3 s3 client the pipeline
+    uses. Multipart uploads enforce S3's minimum part size so streaming code
+    is exercised under the same constraints as the real service.
+    """
+
+    def __init__(self, min_part_size: int = MIN_PART_SIZE) -> None:
+        self.min_part_size = min_part_size
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+        self.uploaded_parts = 0
+        self._uploads: Dict[str, dict] = {}
+        self._upload_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body) -> dict:
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode()
+        self.objects[(Bucket, Key)] = bytes(Body)
+        return {"ETag": f'"{hash(Body)}"'}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str) -> None:
+        with open(Filename, "rb") as fp:
+            self.put_object(Bucket=Bucket, Key=Key, Body=fp.read())
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        body = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "") -> dict:
+        contents = [
+            {"Key": key, "Size": len(body)}
+            for (bucket, key), body in sorted(self.objects.items())
+            if bucket == Bucket and key.startswith(Prefix)
+        ]
+        return {"Contents": contents, "KeyCount": len(contents)}
+
+    def create_multipart_upload(self, Bucket: str, Key: str) -> dict:
+        upload_id = str(next(self._upload_ids))
+        self._uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "Parts": {}}
+        return {"UploadId": upload_id}
+
+    def upload_part(
+        self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes
+    ) -> dict:
+        with self._lock:
+            self._uploads[UploadId]["Parts"][PartNumber] = bytes(Body)
+            self.uploaded_parts += 1
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(
+        self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict
+    ) -> dict:
+        upload = self._uploads.pop(UploadId)
+        part_numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        if part_numbers != sorted(upload["Parts"]):
+            raise ValueError("InvalidPartOrder: parts missing or out of order")
+        parts = [upload["Parts"][n] for n in part_numbers]
+        if any(len(part) < self.min_part_size for part in parts[:-1]):
+            raise ValueError("EntityTooSmall: only the last part may be small")
+        self.objects[(Bucket, Key)] = b"".join(parts)
+        return {"Bucket": Bucket, "Key": Key}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        self._uploads.pop(UploadId, None)
+        return {}
@@ -0,0 +1,46 @@
+import re
+
+from src.copy_to_redshift_staging import STAGING_TABLE
+from src.local_analytics import connect_duckdb, export_relation
+from src.utilities.schema_utils import load_table_schema
+
+WAREHOUSE_TABLE_SCRIPTS = (
+    "sql/tables/create_redshift_table.sql",
+    "sql/tables/create_weekly_stats_table.sql",
+    "sql/tables/create_activity_rollup_table.sql",
+    "sql/tables/create_pending_model_months_table.sql",
+    "sql/tables/create_activity_routes_table.sql",
+    "sql/tables/create_route_cells_table.sql",
+    "sql/tables/create_heatmap_tiles_table.sql",
+)
+
+
+def create_local_warehouse(database: str = ":memory:"):
+    """
+    Local stand-in for the Redshift warehouse: a DuckDB database with the
+    production tables, which runs the load, merge and validation SQL as is.
+    """
+    conn = connect_duckdb(database)
+    conn.execute("CREATE SCHEMA IF NOT EXISTS public;")
+    for script in WAREHOUSE_TABLE_SCRIPTS:
+        with open(script, "r") as sql_file:
+            # DuckDB primary keys are implicitly NOT NULL
+            conn.execute(
+                re.sub(r"(?<!NOT) NULL PRIMARY KEY", " PRIMARY KEY", sql_file.read())
+            )
+    return conn
+
+
+def copy_export_to_staging(
+    conn, table_name: str, export_file_path: str, staging_table: str = STAGING_TABLE
+) -> int:
+    """
+    Stand-in for copy_to_redshift_staging, loading a local export file into
+    the staging table instead of COPYing one from s3.
+    :return: number of rows staged
+    """
+    relation = export_relation(export_file_path, load_table_schema())
+    conn.execute(f"CREATE TABLE {staging_table} AS SELECT * FROM {table_name} LIMIT 0;")
+    if relation is not None:
+        conn.execute(f"INSERT INTO {staging_table} BY NAME SELECT * FROM {relation};")
+    return conn.execute(f"SELECT COUNT(*) FROM {staging_table};").fetchone()[0]
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import re
+import threading
+import time
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic_activities import (
+    make_activity_detail_payload,
+    make_activity_streams_payload,
+)
+
+SHORT_WINDOW_SECONDS = 15 * 60
+DAILY_WINDOW_SECONDS = 24 * 60 * 60
+
+
+class MockStravaAPI:
+    """
+    Local stand-in for the Strava API serving /oauth/token, /athlete/activities,
+    /activities/{id} and /activities/{id}/streams from an in-memory list of
+    activity payloads. Other athletes' activities can be served through
+    athlete_activities, keyed by the access token the athlete calls with.
+    Like Strava, their details and streams are forbidden (403) to any other
+    access token.
+
+    It counts requests and enforces Strava style rate limits, returning
+    X-RateLimit-* headers and 429s. Windows are computed from `clock` so
+    benchmarks can run against a virtual clock instead of really sleeping.
+    """
+
+    def __init__(
+        self,
+        activities: List[Dict],
+        short_limit: int = 100,
+        daily_limit: int = 1000,
+        clock=time.time,
+        athlete_activities: Optional[Dict[str, List[Dict]]] = None,
+    ) -> None:
+        self._feeds = {None: self._make_feed(activities)}
+        for access_token, feed in (athlete_activities or {}).items():
+            self._feeds[access_token] = self._make_feed(feed)
+        self.activities = [a for _, a in self._feeds[None]]
+        self._by_id = {a["id"]: a for feed in self._feeds.values() for _, a in feed}
+        self._owners = {
+            a["id"]: access_token
+            for access_token, feed in self._feeds.items()
+            if access_token is not None
+            for _, a in feed
+        }
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.clock = clock
+        self.request_count = 0
+        self.auth_request_count = 0
+        self.rate_limited_count = 0
+        self.forbidden_count = 0
+        self._usage = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def _make_feed(activities: List[Dict]) -> List[tuple]:
+        """(start epoch, activity) pairs, newest first like Strava returns them."""
+        feed = [
+            (
+                (
+                    datetime.strptime(a["start_date"], "%Y-%m-%dT%H:%M:%SZ")
+                    - datetime(1970, 1, 1)
+                ).total_seconds(),
+                a,
+            )
+            for a in activities
+        ]
+        feed.sort(key=lambda pair: pair[0], reverse=True)
+        return feed
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def activities_url(self) -> str:
+        return f"{self.base_url}/athlete/activities"
+
+    @property
+    def auth_url(self) -> str:
+        return f"{self.base_url}/oauth/token"
+
+    def _consume_budget(self):
+        """Count a request against the current windows, returning (allowed, headers)."""
+        now = self.clock()
+        short_key = ("short", int(now // SHORT_WINDOW_SECONDS))
+        daily_key = ("daily", int(now // DAILY_WINDOW_SECONDS))
+        with self._lock:
+            self.request_count += 1
+            short_usage = self._usage.get(short_key, 0)
+            daily_usage = self._usage.get(daily_key, 0)
+            allowed = short_usage < self.short_limit and daily_usage < self.daily_limit
+            if allowed:
+                short_usage = self._usage[short_key] = short_usage + 1
+                daily_usage = self._usage[daily_key] = daily_usage + 1
+            else:
+                self.rate_limited_count += 1
+        headers = {
+            "X-RateLimit-Limit": f"{self.short_limit},{self.daily_limit}",
+            "X-RateLimit-Usage": f"{short_usage},{daily_usage}",
+        }
+        return allowed, headers
+
+    def list_activities(
+        self, params: Dict[str, str], access_token: Optional[str] = None
+    ) -> List[Dict]:
+        """Emulate the paging and after/before filters of /athlete/activities."""
+        per_page = min(int(params.get("per_page", 30)), 200)
+        page = int(params.get("page", 1))
+        selected = list(self._feeds.get(access_token, self._feeds[None]))
+        if "before" in params:
+            selected = [(e, a) for e, a in selected if e < float(params["before"])]
+        if "after" in params:
+            # when filtering with after Strava returns the oldest activities first
+            selected = [(e, a) for e, a in selected if e > float(params["after"])]
+            selected.reverse()
+        start = (page - 1) * per_page
+        return [a for _, a in selected[start : start + per_page]]
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        params: Dict[str, str],
+        access_token: Optional[str] = None,
+    ):
+        """Route a request, returning (status, headers, body)."""
+        if method == "POST" and path == "/oauth/token":
+            self.auth_request_count += 1
+            body = {
+                "token_type": "Bearer",
+                "access_token": "mock-access-token",
+                "refresh_token": "mock-refresh-token",
+                "expires_at": int(self.clock()) + 6 * 60 * 60,
+            }
+            return 200, {}, body
+        allowed, headers = self._consume_budget()
+        if not allowed:
+            body = {"message": "Rate Limit Exceeded", "errors": []}
+            return 429, headers, body
+        if method == "GET" and path == "/athlete/activities":
+            return 200, headers, self.list_activities(params, access_token)
+        activity_match = re.match(r"/activities/(\d+)", path)
+        if activity_match:
+            owner = self._owners.get(int(activity_match.group(1)), access_token)
+            if owner != access_token:
+                with self._lock:
+                    self.forbidden_count += 1
+                return 403, headers, {"message": "Authorization Error", "errors": []}
+        detail_match = re.fullmatch(r"/activities/(\d+)", path)
+        if method == "GET" and detail_match:
+            activity_id = int(detail_match.group(1))
+            if activity_id in self._by_id:
+                return (
+                    200,
+                    headers,
+                    make_activity_detail_payload(self._by_id[activity_id]),
+                )
+        streams_match = re.fullmatch(r"/activities/(\d+)/streams", path)
+        if method == "GET" and streams_match:
+            activity_id = int(streams_match.group(1))
+            if activity_id in self._by_id:
+                summary = self._by_id[activity_id]
+                return 200, headers, make_activity_streams_payload(summary)
+        return 404, headers, {"message": "Record Not Found", "errors": []}
+
+    def start(self) -> "MockStravaAPI":
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _respond(self, method):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length", 0))
+                if length:
+                    self.rfile.read(length)
+                authorization = self.headers.get("Authorization", "")
+                access_token = authorization[len("Bearer ") :] or None
+                status, headers, body = api.handle(
+                    method, url.path, params, access_token
+                )
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockStravaAPI":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class VirtualClock:
+    """Clock whose sleep() advances time instantly, for simulating rate limit waits."""
+
+    def __init__(self, start: float = None) -> None:
+        self.now = time.time() if start is None else start
+        self.slept = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept += seconds
+        self.now += seconds
+
+    async def async_sleep(self, seconds: float) -> None:
+        self.sleep(seconds)
+        await asyncio.sleep(0)
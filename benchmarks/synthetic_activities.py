@@ -0,0 +1,183 @@
+import math
+import random
+
+import numpy as np
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterator
+
+from src.utilities.geo_utils import encode_polyline
+
+WORKOUT_NAMES = [
+    "Morning Run",
+    "Lunch Run",
+    "Evening Run",
+    "Track Tuesdays",
+    "Long Run",
+    "Easy miles",
+]
+TIMEZONES = ["(GMT+00:00) Europe/London", "(GMT-05:00) America/New_York"]
+# span of history that generated activities are spread over
+MAX_HISTORY = timedelta(days=20 * 365)
+N_ROUTES = 16
+
+
+def make_route_tail(seed: int, n_points: int = 40) -> str:
+    """
+    Encode a random ~8km loop as polyline deltas from its start, so a route can
+    be placed anywhere by prefixing its encoded start point.
+    """
+    rng = random.Random(seed)
+    lat = lng = heading = 0.0
+    points = [(0.0, 0.0)]
+    for _ in range(n_points):
+        heading += rng.uniform(-0.6, 0.6) + 2 * 3.14159 / n_points
+        lat += 0.0018 * math.cos(heading)
+        lng += 0.0028 * math.sin(heading)
+        points.append((lat, lng))
+    # the leading point encodes as "??", leaving only the deltas
+    return encode_polyline(points)[2:]
+
+
+ROUTE_TAILS = [make_route_tail(seed) for seed in range(N_ROUTES)]
+
+
+def make_activity_payload(
+    activity_id: int,
+    start_date: datetime,
+    rng: random.Random,
+    athlete_id: int = 5028644,
+) -> Dict:
+    """Build a synthetic /athlete/activities payload for one activity."""
+    distance = round(rng.uniform(3000, 30000), 1)
+    moving_time = int(distance / rng.uniform(2.8, 5.5))
+    lat, lng = 50.84 + rng.uniform(-0.05, 0.05), -0.39 + rng.uniform(-0.05, 0.05)
+    return {
+        "resource_state": 2,
+        "athlete": {"id": athlete_id, "resource_state": 1},
+        "id": activity_id,
+        "name": rng.choice(WORKOUT_NAMES),
+        "distance": distance,
+        "moving_time": moving_time,
+        "elapsed_time": moving_time + rng.randint(0, 900),
+        "total_elevation_gain": round(rng.uniform(0, 400), 1),
+        "type": "Run" if rng.random() < 0.9 else "Ride",
+        "workout_type": rng.choice([0, 0, 0, 1, 2, 3]),
+        "start_date": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "start_date_local": start_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "timezone": rng.choice(TIMEZONES),
+        "location_country": "United Kingdom",
+        "achievement_count": rng.randint(0, 10),
+        "kudos_count": rng.randint(0, 60),
+        "comment_count": rng.randint(0, 5),
+        "athlete_count": rng.randint(1, 6),
+        "map": {
+            "id": f"a{activity_id}",
+            "summary_polyline": encode_polyline([(lat, lng)])
+            + ROUTE_TAILS[activity_id % N_ROUTES],
+            "resource_state": 2,
+        },
+        "start_latlng": [lat, lng],
+        "end_latlng": [lat, lng],
+        "average_speed": round(distance / moving_time, 3),
+        "max_speed": round(rng.uniform(4.5, 8.5), 3),
+        "average_cadence": round(rng.uniform(80, 92), 1),
+        "average_temp": rng.randint(0, 30),
+        "has_heartrate": True,
+        "average_heartrate": round(rng.uniform(130, 170), 1),
+        "max_heartrate": float(rng.randint(165, 195)),
+        "suffer_score": float(rng.randint(10, 250)),
+    }
+
+
+def make_activity_detail_payload(summary: Dict) -> Dict:
+    """Extend a summary payload with the fields only /activities/{id} returns."""
+    n_km = max(int(summary["distance"] // 1000), 1)
+    split_time = summary["moving_time"] // n_km
+    splits = [
+        {
+            "distance": 1000.0,
+            "elapsed_time": split_time,
+            "moving_time": split_time,
+            "split": split + 1,
+            "average_speed": round(1000 / split_time, 2),
+        }
+        for split in range(n_km)
+    ]
+    laps = [
+        {
+            "id": summary["id"] * 10,
+            "name": "Lap 1",
+            "distance": summary["distance"],
+            "moving_time": summary["moving_time"],
+            "lap_index": 1,
+        }
+    ]
+    return dict(
+        summary,
+        resource_state=3,
+        calories=round(summary["distance"] * 0.065, 1),
+        device_name="Garmin Forerunner 945",
+        gear_id="g1234567",
+        gear={"id": "g1234567", "name": "Nike Pegasus 38", "distance": 512000.0},
+        splits_metric=splits,
+        laps=laps,
+    )
+
+
+def make_activity_streams_payload(summary: Dict) -> Dict:
+    """
+    Build a 1 Hz /activities/{id}/streams?key_by_type=true payload consistent
+    with a summary payload: rolling hills, a drifting pace and heart rate.
+    """
+    rng = np.random.default_rng(summary["id"])
+    n = max(int(summary["moving_time"]), 2)
+    time = np.arange(n)
+    speed = summary["distance"] / n * (1 + 0.1 * np.sin(time / 300))
+    speed *= rng.uniform(0.9, 1.1, n)
+    distance = np.concatenate(([0.0], np.cumsum(speed[:-1])))
+    altitude = 50 + 20 * np.sin(distance / 800) + rng.normal(0, 0.2, n)
+    heading = np.cumsum(rng.normal(0, 0.05, n))
+    lat0, lng0 = summary["start_latlng"]
+    lat = lat0 + np.cumsum(speed * np.cos(heading)) / 111_320
+    lng = lng0 + np.cumsum(speed * np.sin(heading)) / 70_000
+    heartrate = 120 + 50 * (1 - np.exp(-time / 600)) + rng.normal(0, 2, n)
+    cadence = rng.normal(86, 2, n)
+
+    def stream(data, series_type="distance"):
+        return {
+            "data": data,
+            "series_type": series_type,
+            "original_size": n,
+            "resolution": "high",
+        }
+
+    return {
+        "time": stream(time.tolist()),
+        "distance": stream(np.round(distance, 1).tolist()),
+        "latlng": stream(np.round(np.column_stack((lat, lng)), 6).tolist()),
+        "altitude": stream(np.round(altitude, 1).tolist()),
+        "velocity_smooth": stream(np.round(speed, 3).tolist()),
+        "heartrate": stream(np.rint(heartrate).astype(int).tolist()),
+        "cadence": stream(np.rint(cadence).astype(int).tolist()),
+    }
+
+
+def generate_activity_payloads(
+    n_activities: int,
+    end_date: datetime = datetime(2022, 6, 18),
+    seed: int = 0,
+    athlete_id: int = 5028644,
+    first_id: int = 7_300_000_000,
+) -> Iterator[Dict]:
+    """
+    Yield n_activities synthetic payloads, newest first, roughly one a day.
+    Large runs are packed closer together so they all fit in MAX_HISTORY,
+    e.g. 10M activities come about a minute apart.
+    """
+    rng = random.Random(seed)
+    gap_scale = min(1.0, MAX_HISTORY / (n_activities * timedelta(days=1)))
+    start_date = end_date
+    for i in range(n_activities):
+        start_date -= timedelta(hours=rng.uniform(8, 40) * gap_scale)
+        yield make_activity_payload(first_id - i, start_date, rng, athlete_id)
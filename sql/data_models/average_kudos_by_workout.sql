@@ -1,5 +1,7 @@
-SELECT workout_type, AVG(kudos_count) AS average_kudos, AVG(average_speed) AS average_speed
-FROM public.strava_activity_data
+SELECT workout_type,
+    SUM(kudos_sum)::DOUBLE PRECISION/NULLIF(SUM(kudos_n), 0) AS average_kudos,
+    SUM(average_speed_sum)/NULLIF(SUM(average_speed_n), 0) AS average_speed
+FROM public.strava_activity_rollup_daily
 WHERE type = 'Run'
 GROUP BY workout_type
 ORDER BY average_kudos DESC;
\ No newline at end of file
@@ -1,5 +1,5 @@
 CREATE TABLE IF NOT EXISTS activity_summary_monthly (
-  activity_month numeric,
+  activity_month timestamp,
   total_miles_ran int,
   total_running_time_hours int,
   total_elevation_gain_meters int,
@@ -11,16 +11,22 @@ CREATE TABLE IF NOT EXISTS activity_summary_monthly (
 
 TRUNCATE activity_summary_monthly;
 
+-- a full rebuild covers every month waiting for an incremental refresh
+TRUNCATE public.pending_model_months;
+
 INSERT INTO activity_summary_monthly
-SELECT DATE_TRUNC('month', start_date::date) AS activity_month, 
-    ROUND(SUM(distance)/1609) AS total_miles_ran,
-    ROUND(SUM(moving_time)/(60*60)) AS total_running_time_hours,
-    ROUND(SUM(total_elevation_gain)) AS total_elevation_gain_meters,
-    ROUND(SUM(athlete_count)) AS total_people_ran_with,
-    ROUND(AVG(athlete_count)) AS avg_people_ran_with,
-    ROUND(AVG(kudos_count), 1) AS avg_kudos,
-    ROUND(STDDEV(kudos_count), 1) AS std_kudos
-FROM public.strava_activity_data
+SELECT DATE_TRUNC('month', activity_date) AS activity_month, 
+    ROUND(SUM(distance_sum)/1609) AS total_miles_ran,
+    ROUND(SUM(moving_time_sum)/(60*60)) AS total_running_time_hours,
+    ROUND(SUM(elevation_gain_sum)) AS total_elevation_gain_meters,
+    ROUND(SUM(athlete_count_sum)) AS total_people_ran_with,
+    ROUND(SUM(athlete_count_sum)::DOUBLE PRECISION/NULLIF(SUM(athlete_count_n), 0)) AS avg_people_ran_with,
+    ROUND(SUM(kudos_sum)::DOUBLE PRECISION/NULLIF(SUM(kudos_n), 0), 1) AS avg_kudos,
+    -- sample standard deviation from the additive sums of squares
+    ROUND(CASE WHEN SUM(kudos_n) > 1 THEN SQRT(GREATEST(
+        (SUM(kudos_sum_sq) - SUM(kudos_sum)::DOUBLE PRECISION*SUM(kudos_sum)/SUM(kudos_n))
+        /(SUM(kudos_n) - 1), 0)) END, 1) AS std_kudos
+FROM public.strava_activity_rollup_daily
 WHERE type='Run'
 GROUP BY activity_month
 ORDER BY activity_month;
@@ -0,0 +1,44 @@
+CREATE TABLE IF NOT EXISTS activity_summary_monthly (
+  activity_month timestamp,
+  total_miles_ran int,
+  total_running_time_hours int,
+  total_elevation_gain_meters int,
+  total_people_ran_with int,
+  avg_people_ran_with int, 
+  avg_kudos real, 
+  std_kudos real
+);
+
+-- months touched by loads since the last build, queued by redshift_staging_to_production
+CREATE TEMP TABLE refresh_months AS
+SELECT DISTINCT activity_month
+FROM public.pending_model_months;
+
+DELETE FROM activity_summary_monthly
+USING refresh_months
+WHERE activity_summary_monthly.activity_month = refresh_months.activity_month;
+
+INSERT INTO activity_summary_monthly
+SELECT DATE_TRUNC('month', activity_date) AS activity_month, 
+    ROUND(SUM(distance_sum)/1609) AS total_miles_ran,
+    ROUND(SUM(moving_time_sum)/(60*60)) AS total_running_time_hours,
+    ROUND(SUM(elevation_gain_sum)) AS total_elevation_gain_meters,
+    ROUND(SUM(athlete_count_sum)) AS total_people_ran_with,
+    ROUND(SUM(athlete_count_sum)::DOUBLE PRECISION/NULLIF(SUM(athlete_count_n), 0)) AS avg_people_ran_with,
+    ROUND(SUM(kudos_sum)::DOUBLE PRECISION/NULLIF(SUM(kudos_n), 0), 1) AS avg_kudos,
+    -- sample standard deviation from the additive sums of squares
+    ROUND(CASE WHEN SUM(kudos_n) > 1 THEN SQRT(GREATEST(
+        (SUM(kudos_sum_sq) - SUM(kudos_sum)::DOUBLE PRECISION*SUM(kudos_sum)/SUM(kudos_n))
+        /(SUM(kudos_n) - 1), 0)) END, 1) AS std_kudos
+FROM public.strava_activity_rollup_daily
+WHERE type='Run'
+    AND activity_date >= (SELECT MIN(activity_month) FROM refresh_months)
+    AND DATE_TRUNC('month', activity_date) IN (SELECT activity_month FROM refresh_months)
+GROUP BY activity_month
+ORDER BY activity_month;
+
+DELETE FROM public.pending_model_months
+USING refresh_months
+WHERE public.pending_model_months.activity_month = refresh_months.activity_month;
+
+DROP TABLE refresh_months;
\ No newline at end of file
@@ -1,9 +1,9 @@
 WITH weekly_kudos_count AS (
-  SELECT DATE_PART('week', start_date) AS week_of_year, 
+  SELECT DATE_PART('week', activity_date) AS week_of_year, 
     workout_type, 
-    SUM(kudos_count) AS total_kudos
-  FROM public.strava_activity_data
-  WHERE type = 'Run' AND DATE_PART('year', start_date) = '2022'
+    SUM(kudos_sum) AS total_kudos
+  FROM public.strava_activity_rollup_daily
+  WHERE type = 'Run' AND DATE_PART('year', activity_date) = '2022'
   GROUP BY week_of_year, workout_type
 ),
 
@@ -1,10 +1,10 @@
-SELECT EXTRACT(YEAR FROM start_date) AS activity_year,
-    ROUND(SUM(distance)/1609) AS total_miles_ran,
-    ROUND(SUM(moving_time)/(60*60)) AS total_running_time_hours,
-    ROUND(SUM(total_elevation_gain)) AS total_elevation_gain_meters,
-    ROUND(SUM(athlete_count)) AS total_people_ran_with,
-    ROUND(AVG(athlete_count)) AS average_people_ran_with
-FROM public.strava_activity_data
+SELECT EXTRACT(YEAR FROM activity_date) AS activity_year,
+    ROUND(SUM(distance_sum)/1609) AS total_miles_ran,
+    ROUND(SUM(moving_time_sum)/(60*60)) AS total_running_time_hours,
+    ROUND(SUM(elevation_gain_sum)) AS total_elevation_gain_meters,
+    ROUND(SUM(athlete_count_sum)) AS total_people_ran_with,
+    ROUND(SUM(athlete_count_sum)::DOUBLE PRECISION/NULLIF(SUM(athlete_count_n), 0)) AS average_people_ran_with
+FROM public.strava_activity_rollup_daily
 WHERE type='Run'
 GROUP BY activity_year
 ORDER BY activity_year;
\ No newline at end of file
@@ -0,0 +1,3 @@
+-- one-off migration for tables created before athlete_id was added, rows
+-- loaded before it are filled in when they are next extracted
+ALTER TABLE public.strava_activity_data ADD COLUMN "athlete_id" VARCHAR(32) NULL;
\ No newline at end of file
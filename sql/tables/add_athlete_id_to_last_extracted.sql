@@ -0,0 +1,3 @@
+-- one-off migration for last_extracted tables created before multi-athlete
+-- support, their rows stay the watermark of the [strava_api_config] athlete
+ALTER TABLE last_extracted ADD COLUMN athlete_id VARCHAR(32) NULL;
\ No newline at end of file
@@ -0,0 +1,3 @@
+-- one-off migration for tables created before content_hash was added, rows
+-- loaded before it have a NULL hash and are rewritten once on their next load
+ALTER TABLE public.strava_activity_data ADD COLUMN "content_hash" VARCHAR(32) NULL;
\ No newline at end of file
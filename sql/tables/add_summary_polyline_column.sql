@@ -0,0 +1,3 @@
+-- one-off migration for tables created before summary_polyline was added,
+-- routes of earlier activities are filled in when they are next extracted
+ALTER TABLE public.strava_activity_data ADD COLUMN "summary_polyline" VARCHAR(65535) NULL;
\ No newline at end of file
@@ -0,0 +1,15 @@
+-- one-off migration for activity_summary_monthly tables created while
+-- activity_month was numeric. Redshift can't change a column to timestamp in
+-- place, and the table is derived, so it is recreated and then refilled with
+-- python -m src.build_data_model --full-rebuild
+DROP TABLE IF EXISTS activity_summary_monthly;
+CREATE TABLE activity_summary_monthly (
+  activity_month timestamp,
+  total_miles_ran int,
+  total_running_time_hours int,
+  total_elevation_gain_meters int,
+  total_people_ran_with int,
+  avg_people_ran_with int, 
+  avg_kudos real, 
+  std_kudos real
+);
\ No newline at end of file
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS public.strava_activity_best_efforts (
+    "id" VARCHAR NOT NULL,
+    "name" VARCHAR(16) NOT NULL,
+    "distance" FLOAT NULL,
+    "elapsed_time" FLOAT NULL,
+    PRIMARY KEY ("id", "name"));
\ No newline at end of file
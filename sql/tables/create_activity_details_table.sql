@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS public.strava_activity_details (
+    "id" VARCHAR NULL PRIMARY KEY,
+    "calories" FLOAT NULL,
+    "device_name" VARCHAR NULL,
+    "gear_id" VARCHAR NULL,
+    "gear_name" VARCHAR NULL,
+    "splits_metric" VARCHAR(65535) NULL,
+    "laps" VARCHAR(65535) NULL);
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS public.strava_activity_rollup_daily (
+    "activity_date" DATE NOT NULL,
+    "type" VARCHAR NULL,
+    "workout_type" VARCHAR NULL,
+    "activity_count" BIGINT NOT NULL,
+    "distance_sum" DOUBLE PRECISION NULL,
+    "moving_time_sum" DOUBLE PRECISION NULL,
+    "elevation_gain_sum" DECIMAL(38, 3) NULL,
+    "athlete_count_n" BIGINT NOT NULL,
+    "athlete_count_sum" BIGINT NULL,
+    "kudos_n" BIGINT NOT NULL,
+    "kudos_sum" BIGINT NULL,
+    "kudos_sum_sq" BIGINT NULL,
+    "average_speed_n" BIGINT NOT NULL,
+    "average_speed_sum" DOUBLE PRECISION NULL);
\ No newline at end of file
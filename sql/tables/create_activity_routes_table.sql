@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS public.strava_activity_routes (
+    "id" VARCHAR NULL PRIMARY KEY,
+    "content_hash" VARCHAR(32) NULL,
+    "points" INTEGER NULL,
+    "min_lat" FLOAT NULL,
+    "min_lng" FLOAT NULL,
+    "max_lat" FLOAT NULL,
+    "max_lng" FLOAT NULL);
\ No newline at end of file
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS public.strava_activity_splits (
+    "id" VARCHAR NOT NULL,
+    "split" INTEGER NOT NULL,
+    "distance" FLOAT NULL,
+    "elapsed_time" FLOAT NULL,
+    "average_speed" FLOAT NULL,
+    "elevation_difference" FLOAT NULL,
+    "average_heartrate" FLOAT NULL,
+    PRIMARY KEY ("id", "split"));
\ No newline at end of file
@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS public.strava_activity_stream_metrics (
+    "id" VARCHAR NULL PRIMARY KEY,
+    "samples" INTEGER NULL,
+    "moving_time" FLOAT NULL,
+    "grade_adjusted_distance" FLOAT NULL,
+    "grade_adjusted_pace" FLOAT NULL,
+    "hr_zone_1_seconds" FLOAT NULL,
+    "hr_zone_2_seconds" FLOAT NULL,
+    "hr_zone_3_seconds" FLOAT NULL,
+    "hr_zone_4_seconds" FLOAT NULL,
+    "hr_zone_5_seconds" FLOAT NULL);
\ No newline at end of file
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS public.strava_heatmap_tiles (
+    "zoom" SMALLINT NOT NULL,
+    "tile_x" INTEGER NOT NULL,
+    "tile_y" INTEGER NOT NULL,
+    "bin_x" INTEGER NOT NULL,
+    "bin_y" INTEGER NOT NULL,
+    "lat" FLOAT NULL,
+    "lng" FLOAT NULL,
+    "activities" INTEGER NOT NULL,
+    PRIMARY KEY ("zoom", "bin_x", "bin_y"));
\ No newline at end of file
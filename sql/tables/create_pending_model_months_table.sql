@@ -0,0 +1,2 @@
+CREATE TABLE IF NOT EXISTS public.pending_model_months (
+    "activity_month" TIMESTAMP NOT NULL);
\ No newline at end of file
@@ -22,4 +22,7 @@ CREATE TABLE IF NOT EXISTS public.strava_activity_data (
     "start_date" TIMESTAMP NULL,
     "timezone" VARCHAR NULL,
     "lat" FLOAT NULL,
-    "lng" FLOAT NULL);
\ No newline at end of file
+    "lng" FLOAT NULL,
+    "content_hash" VARCHAR(32) NULL,
+    "summary_polyline" VARCHAR(65535) NULL,
+    "athlete_id" VARCHAR(32) NULL);
\ No newline at end of file
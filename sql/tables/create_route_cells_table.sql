@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS public.strava_route_cells (
+    "id" VARCHAR NOT NULL,
+    "zoom" SMALLINT NOT NULL,
+    "bin_x" INTEGER NOT NULL,
+    "bin_y" INTEGER NOT NULL);
\ No newline at end of file
@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS public.strava_weekly_stats (
+    "activity_week" TIMESTAMP NOT NULL PRIMARY KEY,
+    "activity_count" BIGINT NOT NULL,
+    "kudos_n" BIGINT NOT NULL,
+    "kudos_sum" BIGINT NOT NULL);
\ No newline at end of file
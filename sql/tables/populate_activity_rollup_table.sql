@@ -0,0 +1,20 @@
+TRUNCATE public.strava_activity_rollup_daily;
+
+INSERT INTO public.strava_activity_rollup_daily
+SELECT start_date::date AS activity_date,
+    type,
+    workout_type,
+    COUNT(*) AS activity_count,
+    SUM(distance) AS distance_sum,
+    SUM(moving_time) AS moving_time_sum,
+    SUM(total_elevation_gain) AS elevation_gain_sum,
+    COUNT(athlete_count) AS athlete_count_n,
+    SUM(athlete_count) AS athlete_count_sum,
+    COUNT(kudos_count) AS kudos_n,
+    SUM(kudos_count) AS kudos_sum,
+    SUM(kudos_count * kudos_count) AS kudos_sum_sq,
+    COUNT(average_speed) AS average_speed_n,
+    SUM(average_speed) AS average_speed_sum
+FROM public.strava_activity_data
+WHERE start_date IS NOT NULL
+GROUP BY activity_date, type, workout_type;
\ No newline at end of file
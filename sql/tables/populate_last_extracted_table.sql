@@ -1,6 +1,7 @@
 CREATE TABLE last_extracted (
-	LastUpdated timestamp
+	LastUpdated timestamp,
+	athlete_id VARCHAR(32) NULL
 );
 
-INSERT INTO last_extracted
+INSERT INTO last_extracted (LastUpdated)
 	VALUES('2016-01-01 00:00:00');
\ No newline at end of file
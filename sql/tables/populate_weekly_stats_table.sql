@@ -0,0 +1,9 @@
+TRUNCATE public.strava_weekly_stats;
+
+INSERT INTO public.strava_weekly_stats
+SELECT DATE_TRUNC('week', start_date::date) AS activity_week,
+    COUNT(*) AS activity_count,
+    COUNT(kudos_count) AS kudos_n,
+    COALESCE(SUM(kudos_count), 0) AS kudos_sum
+FROM public.strava_activity_data
+GROUP BY activity_week;
\ No newline at end of file
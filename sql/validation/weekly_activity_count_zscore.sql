@@ -1,22 +1,13 @@
-with activities_by_week AS (
-  SELECT 
-  	date_trunc('week', start_date::date) AS activity_week,
-  	COUNT(*) AS activity_count           
-  FROM public.strava_activity_data
-  GROUP BY activity_week
-  ORDER BY activity_week
-),
-
-activities_by_week_statistics AS (
+with activities_by_week_statistics AS (
   SELECT 
   	AVG(activity_count) AS avg_activities_per_week,
   	STDDEV(activity_count) AS std_activities_per_week
-  FROM activities_by_week
+  FROM public.strava_weekly_stats
 ),
 
 staging_table_weekly_count AS (
   SELECT COUNT(*) AS staging_weekly_count
-  FROM staging_table
+  FROM {staging_table}
 ),
 
 activity_count_zscore AS (
@@ -1,10 +1,9 @@
 with kudos_by_week AS (
+  --weekly aggregates are maintained by redshift_staging_to_production
   SELECT 
-  	date_trunc('week', start_date::date) AS activity_week,
-  	AVG(kudos_count) AS avg_weekly_kudos           
-  FROM public.strava_activity_data
-  GROUP BY activity_week
-  ORDER BY activity_week
+  	activity_week,
+  	kudos_sum / NULLIF(kudos_n, 0) AS avg_weekly_kudos
+  FROM public.strava_weekly_stats
 ),
 
 kudos_by_week_statistics AS (
@@ -16,7 +15,7 @@ kudos_by_week_statistics AS (
 
 staging_table_avg_kudos AS (
   SELECT AVG(kudos_count) AS staging_avg_kudos
-  FROM staging_table
+  FROM {staging_table}
 ),
 
 weekly_avg_kudos_zscore AS (
@@ -0,0 +1,368 @@
+import argparse
+import calendar
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from src.extract_strava_data import (
+    export_activities_to_s3,
+    load_athlete_limits,
+    make_strava_api_request,
+    save_extraction_date_to_database,
+)
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import PipelineContext, get_pipeline_context
+from src.utilities.raw_cache_utils import RawResponseCache, load_raw_cache
+from src.utilities.strava_api_utils import (
+    STRAVA_ACTIVITIES_URL,
+    STRAVA_MAX_PER_PAGE,
+    StravaRateLimiter,
+    load_activity_parser,
+    load_strava_athletes,
+)
+
+# the oldest date populate_last_extracted_table.sql ever pointed back to
+BACKFILL_START_DATE = datetime(2016, 1, 1)
+DEFAULT_WINDOW_DAYS = 90
+# steps that load each backfilled partition, and run once after all of them
+LOAD_STEPS = ("stage", "validate", "promote")
+FINAL_STEPS = ("model", "tiles")
+
+
+class BackfillWindow(NamedTuple):
+    """One shard of a backfill: an athlete's activities started in [after, before)."""
+
+    athlete_id: Optional[str]
+    after: datetime
+    before: datetime
+
+    @property
+    def name(self) -> str:
+        athlete = self.athlete_id or "default"
+        return f"backfill_{athlete}_{self.after:%Y%m%d}_{self.before:%Y%m%d}"
+
+
+class BackfillResult(NamedTuple):
+    """Export partition of one backfilled window."""
+
+    window: BackfillWindow
+    manifest_path: Optional[str]
+    n_activities: int
+    max_start_date: Optional[str]
+
+
+def plan_backfill_windows(
+    start: datetime,
+    end: datetime,
+    window: timedelta = timedelta(days=DEFAULT_WINDOW_DAYS),
+    athlete_ids: Sequence[Optional[str]] = (None,),
+) -> List[BackfillWindow]:
+    """Split [start, end) into consecutive windows, for every athlete."""
+    windows = []
+    for athlete_id in athlete_ids:
+        after = start
+        while after < end:
+            before = min(after + window, end)
+            windows.append(BackfillWindow(athlete_id, after, before))
+            after = before
+    return windows
+
+
+def fetch_window_activities(
+    window: BackfillWindow,
+    header: Dict[str, str],
+    rate_limiter: StravaRateLimiter,
+    url: str = STRAVA_ACTIVITIES_URL,
+    per_page: int = STRAVA_MAX_PER_PAGE,
+    raw_cache: Optional[RawResponseCache] = None,
+) -> List[List]:
+    """
+    Page through the activities of one window with after and before filters.
+    :param raw_cache: cache the raw pages here
+    """
+    # Strava's after and before filters are both exclusive
+    after = calendar.timegm(window.after.timetuple()) - 1
+    before = calendar.timegm(window.before.timetuple())
+    parser = load_activity_parser()
+    activities, page = [], 1
+    requests_made = rate_limiter.requests_made
+    with requests.Session() as session:
+        while True:
+            page_activities = make_strava_api_request(
+                header, page, per_page, after, rate_limiter, session, url, before
+            )
+            if raw_cache is not None and page_activities:
+                raw_cache.put_page(page_activities)
+            activities.extend(parser.parse_list(r) for r in page_activities)
+            # a short page means the window has been read to the end
+            if len(page_activities) < per_page:
+                break
+            page += 1
+    metrics = get_run_metrics()
+    metrics.incr("backfill", "rows", len(activities))
+    metrics.incr(
+        "backfill", "http_requests", rate_limiter.requests_made - requests_made
+    )
+    return activities
+
+
+def backfill_window(
+    window: BackfillWindow,
+    header: Dict[str, str],
+    rate_limiter: StravaRateLimiter,
+    s3=None,
+    bucket_name: Optional[str] = None,
+    output_format: str = "csv",
+    n_parts: int = 4,
+    url: str = STRAVA_ACTIVITIES_URL,
+    raw_cache: Optional[RawResponseCache] = None,
+) -> BackfillResult:
+    """
+    Extract one window and export it as its own partition, named after the
+    window, so a failed window can be retried without touching the others.
+    """
+    activities = fetch_window_activities(
+        window, header, rate_limiter, url, raw_cache=raw_cache
+    )
+    manifest_path = export_activities_to_s3(
+        activities, s3, bucket_name, output_format, n_parts, run_id=window.name
+    )
+    date_position = load_activity_parser().columns.index("start_date")
+    max_start_date = max((a[date_position] for a in activities), default=None)
+    if max_start_date is not None:
+        max_start_date = max_start_date.strftime("%Y-%m-%d %H:%M:%S")
+    return BackfillResult(window, manifest_path, len(activities), max_start_date)
+
+
+@instrumented("backfill")
+def backfill_strava_history(
+    windows: Sequence[BackfillWindow],
+    headers: Dict[Optional[str], Dict[str, str]],
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    athlete_limits: Tuple[int, int] = (100, 1000),
+    max_workers: int = 8,
+    s3=None,
+    bucket_name: Optional[str] = None,
+    output_format: str = "csv",
+    n_parts: int = 4,
+    url: str = STRAVA_ACTIVITIES_URL,
+    raw_cache: Optional[RawResponseCache] = None,
+) -> List[BackfillResult]:
+    """
+    Extract many windows in parallel. Every request draws on its athlete's
+    budget and on the shared application budget of rate_limiter, so a
+    multi-year reload runs as fast as the API quota allows.
+    :return: the export partition of every window, in window order
+    """
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    athlete_limiters = {
+        athlete_id: StravaRateLimiter(
+            *athlete_limits,
+            clock=rate_limiter.clock,
+            sleep=rate_limiter.sleep,
+            async_sleep=rate_limiter.async_sleep,
+            parent=rate_limiter,
+        )
+        for athlete_id in {window.athlete_id for window in windows}
+    }
+
+    def run_window(window: BackfillWindow) -> BackfillResult:
+        return backfill_window(
+            window,
+            headers[window.athlete_id],
+            athlete_limiters[window.athlete_id],
+            s3,
+            bucket_name,
+            output_format,
+            n_parts,
+            url,
+            raw_cache,
+        )
+
+    with ThreadPoolExecutor(max(1, min(max_workers, len(windows)))) as pool:
+        results = list(pool.map(run_window, windows))
+    print(
+        f"Backfilled {sum(r.n_activities for r in results)} activities in "
+        f"{len(windows)} windows using {rate_limiter.requests_made} API requests."
+    )
+    return results
+
+
+def load_backfill_partitions(
+    results: Sequence[BackfillResult],
+    ctx: Optional[PipelineContext] = None,
+    output_format: str = "csv",
+    max_workers: Optional[int] = None,
+) -> int:
+    """
+    Stage, validate and promote every backfilled partition through its
+    manifest, then rebuild the data model and tiles once. Partitions load
+    concurrently, each through its own staging table and connections, and
+    their promotes queue on the production table locks. Watermarks are
+    only moved up after everything is loaded, so a failed window never
+    leaves a gap behind the watermark.
+    :param max_workers: partitions loaded at once, load_workers in pipeline.conf
+    :return: number of partitions loaded
+    """
+    from src.copy_to_redshift_staging import staging_table_name
+    from src.run_pipeline import PIPELINE_STEPS
+
+    if ctx is None:
+        ctx = get_pipeline_context()
+    if max_workers is None:
+        max_workers = ctx.config.getint(
+            "strava_backfill_config", "load_workers", fallback=1
+        )
+    state = {
+        "export_format": output_format,
+        "full_rebuild": True,
+        "table_name": ctx.config.get("aws_redshift_creds", "table_name"),
+    }
+    run_id = get_run_metrics().run_id
+    loaded = [r for r in results if r.manifest_path is not None]
+
+    def load_partition(result: BackfillResult) -> None:
+        partition_ctx = ctx.fork()
+        partition_state = dict(
+            state,
+            manifest_path=result.manifest_path,
+            staging_table=staging_table_name(f"{run_id}_{result.window.name}"),
+        )
+        try:
+            for name in LOAD_STEPS:
+                PIPELINE_STEPS[name][0](partition_ctx, partition_state)
+        finally:
+            partition_ctx.close()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        list(executor.map(load_partition, loaded))
+    if loaded:
+        for name in FINAL_STEPS:
+            PIPELINE_STEPS[name][0](ctx, state)
+    watermarks = {}
+    for result in loaded:
+        athlete_id = result.window.athlete_id
+        watermarks[athlete_id] = max(
+            watermarks.get(athlete_id, result.max_start_date), result.max_start_date
+        )
+    # last_extracted keeps the MAX, so an older backfill never moves it back
+    for athlete_id, max_start_date in watermarks.items():
+        save_extraction_date_to_database(max_start_date, ctx.mysql(), athlete_id)
+    return len(loaded)
+
+
+def run_backfill_window_task(
+    athlete_id: Optional[str],
+    after: str,
+    before: str,
+    output_format: str = "csv",
+    ctx: Optional[PipelineContext] = None,
+) -> list:
+    """
+    Backfill one window in its own process, e.g. as a mapped Airflow task.
+    Processes can't share a limiter, but every limiter syncs the application
+    wide usage Strava reports in its rate limit headers, so they still back
+    off together once the shared quota is spent.
+    :return: the BackfillResult as a JSON serialisable list
+    """
+    if ctx is None:
+        ctx = get_pipeline_context()
+    athlete = next(
+        a for a in load_strava_athletes(ctx.config) if a.athlete_id == athlete_id
+    )
+    window = BackfillWindow(
+        athlete_id, datetime.fromisoformat(after), datetime.fromisoformat(before)
+    )
+    athlete_limiter = StravaRateLimiter(
+        *load_athlete_limits(ctx.config), parent=StravaRateLimiter()
+    )
+    raw_cache = load_raw_cache(ctx.config, ctx.s3())
+    result = backfill_window(
+        window,
+        ctx.strava_header(athlete),
+        athlete_limiter,
+        ctx.s3(),
+        ctx.config.get("aws_boto_credentials", "bucket_name"),
+        output_format,
+        ctx.config.getint("aws_redshift_creds", "export_parts", fallback=4),
+        raw_cache=raw_cache,
+    )
+    if raw_cache is not None:
+        raw_cache.flush(window.name)
+    return [athlete_id, after, before, *result[1:]]
+
+
+def load_backfill_task_results(
+    task_results: Sequence[list],
+    output_format: str = "csv",
+    ctx: Optional[PipelineContext] = None,
+) -> int:
+    """Load the partitions of run_backfill_window_task results."""
+    results = [
+        BackfillResult(
+            BackfillWindow(
+                athlete_id,
+                datetime.fromisoformat(after),
+                datetime.fromisoformat(before),
+            ),
+            *rest,
+        )
+        for athlete_id, after, before, *rest in task_results
+    ]
+    return load_backfill_partitions(results, ctx, output_format)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Reload Strava history in parallel, one partition per window."
+    )
+    arg_parser.add_argument(
+        "--start",
+        type=datetime.fromisoformat,
+        default=BACKFILL_START_DATE,
+        help="start of the date range to reload (default: 2016-01-01)",
+    )
+    arg_parser.add_argument(
+        "--end",
+        type=datetime.fromisoformat,
+        default=None,
+        help="end of the date range to reload (default: now)",
+    )
+    arg_parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS)
+    arg_parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    arg_parser.add_argument(
+        "--athletes", nargs="+", help="athlete ids to reload (default: all)"
+    )
+    args = arg_parser.parse_args()
+
+    ctx = get_pipeline_context()
+    athletes = load_strava_athletes(ctx.config)
+    if args.athletes:
+        athletes = [a for a in athletes if a.athlete_id in args.athletes]
+    windows = plan_backfill_windows(
+        args.start,
+        args.end or datetime.utcnow(),
+        timedelta(days=args.window_days),
+        [a.athlete_id for a in athletes],
+    )
+    raw_cache = load_raw_cache(ctx.config, ctx.s3())
+    results = backfill_strava_history(
+        windows,
+        {a.athlete_id: ctx.strava_header(a) for a in athletes},
+        athlete_limits=load_athlete_limits(ctx.config),
+        max_workers=ctx.config.getint(
+            "strava_backfill_config", "max_workers", fallback=8
+        ),
+        s3=ctx.s3(),
+        bucket_name=ctx.config.get("aws_boto_credentials", "bucket_name"),
+        output_format=args.format,
+        n_parts=ctx.config.getint("aws_redshift_creds", "export_parts", fallback=4),
+        raw_cache=raw_cache,
+    )
+    if raw_cache is not None:
+        raw_cache.flush(f"backfill_{get_run_metrics().run_id}")
+    n_loaded = load_backfill_partitions(results, ctx, args.format)
+    print(f"Loaded {n_loaded} backfilled partitions into Redshift!")
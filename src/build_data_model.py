@@ -1,15 +1,58 @@
-from src.utilities.redshift_utils import connect_redshift
+import argparse
 
+from src.redshift_staging_to_production import ACTIVITY_ROLLUP_TABLE
+from src.utilities.metrics_utils import instrumented
+from src.utilities.pipeline_context import get_pipeline_context
 
-def build_data_model(sql_script_path: str) -> None:
+ACTIVITY_ROLLUP_SCRIPT = "sql/tables/populate_activity_rollup_table.sql"
+MONTHLY_DATA_MODEL_SCRIPT = "sql/data_models/build_monthly_data_model.sql"
+MONTHLY_DATA_MODEL_INCREMENTAL_SCRIPT = (
+    "sql/data_models/build_monthly_data_model_incremental.sql"
+)
+
+
+@instrumented("model")
+def build_data_model(sql_script_path: str, rs_conn=None) -> None:
     """Execute sql query to build data model."""
-    rs_conn = connect_redshift()
+    if rs_conn is None:
+        rs_conn = get_pipeline_context().redshift()
     cursor = rs_conn.cursor()
     sql_file = open(sql_script_path, "r")
     cursor.execute(sql_file.read())
+    rs_conn.commit()
     cursor.close()
 
 
+def build_monthly_data_model(rs_conn=None, full_rebuild: bool = False) -> None:
+    """
+    Build the monthly data model. By default only the months queued by
+    redshift_staging_to_production are recomputed, in one transaction. An
+    empty daily rollup, e.g. on a deployment that predates it, is rebuilt in
+    full first.
+    :param full_rebuild: rebuild the daily rollup from the full fact table,
+        then recompute every month from it
+    """
+    if rs_conn is None:
+        rs_conn = get_pipeline_context().redshift()
+    cursor = rs_conn.cursor()
+    cursor.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM {ACTIVITY_ROLLUP_TABLE} LIMIT 1) AS r;"
+    )
+    if cursor.fetchone()[0] == 0:
+        full_rebuild = True
+    if full_rebuild:
+        build_data_model(ACTIVITY_ROLLUP_SCRIPT, rs_conn)
+        build_data_model(MONTHLY_DATA_MODEL_SCRIPT, rs_conn)
+    else:
+        build_data_model(MONTHLY_DATA_MODEL_INCREMENTAL_SCRIPT, rs_conn)
+
+
 if __name__ == "__main__":
-    sql_script_path = "sql/data_models/build_monthly_data_model.sql"
-    build_data_model(sql_script_path)
+    arg_parser = argparse.ArgumentParser(description="Build the monthly data model.")
+    arg_parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        help="rebuild the rollup and every month, not only months touched by loads",
+    )
+    args = arg_parser.parse_args()
+    build_monthly_data_model(full_rebuild=args.full_rebuild)
@@ -0,0 +1,258 @@
+import csv
+import sys
+
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.utilities.geo_utils import (
+    BINS_PER_TILE,
+    HEATMAP_ZOOM_LEVELS,
+    bbox_to_bin_range,
+    decode_polylines,
+    route_cells,
+)
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import PipelineContext, get_pipeline_context
+
+ROUTES_TABLE = "public.strava_activity_routes"
+ROUTE_CELLS_TABLE = "public.strava_route_cells"
+HEATMAP_TILES_TABLE = "public.strava_heatmap_tiles"
+
+
+def find_unindexed_routes(table_name: str, rs_conn) -> List[tuple]:
+    """
+    Activities whose route is not in the route index yet, or has changed
+    since it was indexed.
+    :return: (id, content_hash, summary_polyline) rows
+    """
+    select_unindexed = f"""
+        SELECT p.id, p.content_hash, p.summary_polyline
+        FROM {table_name} p LEFT JOIN {ROUTES_TABLE} r ON r.id = p.id
+        WHERE r.id IS NULL
+            OR COALESCE(r.content_hash, '') <> COALESCE(p.content_hash, '');"""
+    cur = rs_conn.cursor()
+    cur.execute(select_unindexed)
+    return cur.fetchall()
+
+
+@instrumented("tiles")
+def index_routes(
+    routes: Sequence[tuple], zoom_levels: Sequence[int] = HEATMAP_ZOOM_LEVELS
+) -> Tuple[List[list], List[list]]:
+    """
+    Decode the routes and bin them for the heatmap.
+    :param routes: (id, content_hash, summary_polyline) rows
+    :return: rows of the route index (id, content_hash, points and bounding
+        box) and of the route cells (id, zoom, bin_x, bin_y)
+    """
+    if not routes:
+        return [], []
+    activity_ids, content_hashes, polylines = zip(*routes)
+    offsets, lat, lng = decode_polylines(polylines)
+    route, zoom, bin_x, bin_y = route_cells(offsets, lat, lng, zoom_levels)
+    points = np.diff(offsets)
+    bounds = np.full((len(routes), 4), np.nan)
+    has_points = np.flatnonzero(points > 0)
+    if len(has_points):
+        starts = offsets[has_points]
+        bounds[has_points] = np.column_stack(
+            (
+                np.minimum.reduceat(lat, starts),
+                np.minimum.reduceat(lng, starts),
+                np.maximum.reduceat(lat, starts),
+                np.maximum.reduceat(lng, starts),
+            )
+        )
+    route_rows = [
+        [activity_ids[i], content_hashes[i], int(points[i])]
+        + [None if np.isnan(b) else float(b) for b in bounds[i]]
+        for i in range(len(routes))
+    ]
+    cell_rows = [
+        [activity_ids[r], z, x, y]
+        for r, z, x, y in zip(
+            route.tolist(), zoom.tolist(), bin_x.tolist(), bin_y.tolist()
+        )
+    ]
+    metrics = get_run_metrics()
+    metrics.incr("tiles", "rows", len(routes))
+    metrics.incr("tiles", "cells", len(cell_rows))
+    return route_rows, cell_rows
+
+
+def create_route_staging_tables(rs_conn) -> None:
+    """Create empty staging tables for route index and route cell rows."""
+    cur = rs_conn.cursor()
+    cur.execute(f"CREATE TABLE route_staging AS SELECT * FROM {ROUTES_TABLE} LIMIT 0;")
+    cur.execute(
+        "CREATE TABLE route_cells_staging AS "
+        f"SELECT * FROM {ROUTE_CELLS_TABLE} LIMIT 0;"
+    )
+
+
+def copy_route_index_to_staging(
+    rs_conn, routes_s3_path: str, cells_s3_path: str, role_string: str
+) -> None:
+    """COPY route index and route cell files from s3 into the staging tables."""
+    create_route_staging_tables(rs_conn)
+    cur = rs_conn.cursor()
+    cur.execute(f"COPY route_staging FROM '{routes_s3_path}' iam_role '{role_string}';")
+    cur.execute(
+        f"COPY route_cells_staging FROM '{cells_s3_path}' iam_role '{role_string}';"
+    )
+
+
+def merge_route_index(rs_conn, bins_per_tile: int = BINS_PER_TILE) -> int:
+    """
+    Replace the staged routes in the route index and update the heatmap
+    tiles incrementally: only bins touched by a staged route, before or after
+    this update, are recounted, so adding a week of activities never rescans
+    years of routes.
+    :return: number of routes indexed
+    """
+    create_touched_bins = f"""
+        CREATE TEMP TABLE touched_bins AS
+        SELECT c.zoom, c.bin_x, c.bin_y
+        FROM {ROUTE_CELLS_TABLE} c JOIN route_staging s ON s.id = c.id
+        UNION
+        SELECT zoom, bin_x, bin_y FROM route_cells_staging;"""
+    replace_cells = [
+        f"""DELETE FROM {ROUTE_CELLS_TABLE} USING route_staging
+        WHERE {ROUTE_CELLS_TABLE}.id = route_staging.id;""",
+        f"INSERT INTO {ROUTE_CELLS_TABLE} SELECT * FROM route_cells_staging;",
+        f"""DELETE FROM {ROUTES_TABLE} USING route_staging
+        WHERE {ROUTES_TABLE}.id = route_staging.id;""",
+        f"INSERT INTO {ROUTES_TABLE} SELECT * FROM route_staging;",
+    ]
+    delete_touched_tiles = f"""
+        DELETE FROM {HEATMAP_TILES_TABLE} USING touched_bins t
+        WHERE {HEATMAP_TILES_TABLE}.zoom = t.zoom
+            AND {HEATMAP_TILES_TABLE}.bin_x = t.bin_x
+            AND {HEATMAP_TILES_TABLE}.bin_y = t.bin_y;"""
+    # bin centres are converted back to lat/lng so the dashboard can plot them
+    insert_touched_tiles = f"""
+        INSERT INTO {HEATMAP_TILES_TABLE}
+        SELECT zoom,
+            FLOOR(bin_x / {bins_per_tile}.0)::INTEGER AS tile_x,
+            FLOOR(bin_y / {bins_per_tile}.0)::INTEGER AS tile_y,
+            bin_x,
+            bin_y,
+            DEGREES(ATAN((EXP(k) - EXP(-k)) / 2)) AS lat,
+            (bin_x + 0.5) / n * 360 - 180 AS lng,
+            activities
+        FROM (
+            SELECT c.zoom, c.bin_x, c.bin_y, COUNT(*) AS activities,
+                POWER(2, c.zoom) * {bins_per_tile} AS n,
+                PI() * (1 - 2 * (c.bin_y + 0.5) / (POWER(2, c.zoom) * {bins_per_tile}))
+                    AS k
+            FROM {ROUTE_CELLS_TABLE} c JOIN touched_bins t
+                ON t.zoom = c.zoom AND t.bin_x = c.bin_x AND t.bin_y = c.bin_y
+            GROUP BY c.zoom, c.bin_x, c.bin_y
+        ) binned;"""
+    drop_temp_tables = """
+        DROP TABLE touched_bins;
+        DROP TABLE route_cells_staging;
+        DROP TABLE route_staging;"""
+    # execute queries
+    cur = rs_conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM route_staging;")
+    n_routes = cur.fetchone()[0]
+    cur.execute(create_touched_bins)
+    for query in replace_cells:
+        cur.execute(query)
+    cur.execute(delete_touched_tiles)
+    cur.execute(insert_touched_tiles)
+    cur.execute(drop_temp_tables)
+    rs_conn.commit()
+    return n_routes
+
+
+def save_rows_to_csv(rows: List[list], name: str) -> str:
+    """Save rows to a pipe delimited .csv file."""
+    todays_date = datetime.today().strftime("%Y_%m_%d")
+    file_path = f"strava_data/{todays_date}_{name}.csv"
+    with open(file_path, "w") as fp:
+        csvw = csv.writer(fp, delimiter="|")
+        csvw.writerows(rows)
+    return file_path
+
+
+def update_heatmap_tiles(table_name: str, ctx: Optional[PipelineContext] = None) -> int:
+    """
+    Index the routes of new and changed activities and update the heatmap
+    tiles they touch.
+    :return: number of routes indexed
+    """
+    if ctx is None:
+        ctx = get_pipeline_context()
+    rs_conn = ctx.redshift()
+    route_rows, cell_rows = index_routes(find_unindexed_routes(table_name, rs_conn))
+    if not route_rows:
+        return 0
+    bucket_name = ctx.config.get("aws_boto_credentials", "bucket_name")
+    _, role_string = ctx.s3_and_iam_details()
+    s3_file_paths = []
+    for rows, name in ((route_rows, "routes"), (cell_rows, "route_cells")):
+        file_path = save_rows_to_csv(rows, name)
+        ctx.s3().upload_file(file_path, bucket_name, file_path)
+        s3_file_paths.append(f"s3://{bucket_name}/{file_path}")
+    copy_route_index_to_staging(rs_conn, *s3_file_paths, role_string)
+    return merge_route_index(rs_conn)
+
+
+def query_heatmap(
+    rs_conn,
+    zoom: int,
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+) -> List[tuple]:
+    """
+    Heatmap bins inside a bounding box, read from the pre-aggregated tiles.
+    :return: (lat, lng, activities) of every bin with activity
+    """
+    min_x, min_y, max_x, max_y = bbox_to_bin_range(
+        min_lat, min_lng, max_lat, max_lng, zoom
+    )
+    cur = rs_conn.cursor()
+    cur.execute(f"""
+        SELECT lat, lng, activities FROM {HEATMAP_TILES_TABLE}
+        WHERE zoom = {int(zoom)}
+            AND bin_x BETWEEN {min_x} AND {max_x}
+            AND bin_y BETWEEN {min_y} AND {max_y}
+        ORDER BY bin_y, bin_x;""")
+    return cur.fetchall()
+
+
+def find_activities_in_area(
+    rs_conn,
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    zoom: int = max(HEATMAP_ZOOM_LEVELS),
+) -> List[str]:
+    """Ids of activities whose route passes through a bounding box."""
+    min_x, min_y, max_x, max_y = bbox_to_bin_range(
+        min_lat, min_lng, max_lat, max_lng, zoom
+    )
+    cur = rs_conn.cursor()
+    cur.execute(f"""
+        SELECT DISTINCT id FROM {ROUTE_CELLS_TABLE}
+        WHERE zoom = {int(zoom)}
+            AND bin_x BETWEEN {min_x} AND {max_x}
+            AND bin_y BETWEEN {min_y} AND {max_y}
+        ORDER BY id;""")
+    return [row[0] for row in cur.fetchall()]
+
+
+if __name__ == "__main__":
+    ctx = get_pipeline_context()
+    table_name = ctx.config.get("aws_redshift_creds", "table_name")
+    if len(sys.argv) > 1:
+        table_name = sys.argv[1]
+    n_routes = update_heatmap_tiles(table_name, ctx)
+    print(f"Indexed {n_routes} routes into the heatmap tiles.")
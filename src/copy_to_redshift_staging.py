@@ -1,29 +1,137 @@
-import configparser
+import argparse
+import re
 
-from src.utilities.redshift_utils import connect_redshift, get_s3_and_iam_details
+from datetime import datetime, timedelta
+from typing import List, Optional
 
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import get_pipeline_context
 
+# COPY options needed to load each export file format. The pipe-delimited
+# exports are loaded as CSV, because only then does COPY honour the quotes
+# csv.writer puts around values containing a pipe, such as route polylines
+COPY_OPTIONS = {
+    "csv": "CSV DELIMITER '|'",
+    "csv.gz": "CSV DELIMITER '|' GZIP",
+    "parquet": "FORMAT AS PARQUET",
+}
+# staging table of loads run outside the pipeline, e.g. from the command line
+STAGING_TABLE = "staging_table"
+STAGING_SCHEMA = "public"
+# per-run staging tables are named staging_strava_<created at>_<run id>
+STAGING_TABLE_PREFIX = "staging_strava_"
+STAGING_TABLE_NAME = re.compile(rf"^{STAGING_TABLE_PREFIX}(\d{{14}})_")
+STALE_STAGING_AGE = timedelta(hours=24)
+
+
+def staging_table_name(run_id: str, created_at: Optional[datetime] = None) -> str:
+    """
+    Name of a run's own staging table, so loads of several runs, partitions
+    or athletes can be staged and validated side by side.
+    """
+    if created_at is None:
+        created_at = datetime.utcnow()
+    suffix = re.sub(r"[^a-z0-9_]", "_", run_id.lower())
+    return f"{STAGING_SCHEMA}.{STAGING_TABLE_PREFIX}{created_at:%Y%m%d%H%M%S}_{suffix}"
+
+
+def drop_stale_staging_tables(
+    rs_conn, max_age: timedelta = STALE_STAGING_AGE, now: Optional[datetime] = None
+) -> List[str]:
+    """
+    Drop the per-run staging tables left behind more than max_age ago by
+    runs that crashed or were halted by validation. Redshift doesn't record
+    when a table was created, so the time is read from the table name.
+    :return: names of the dropped tables
+    """
+    if now is None:
+        now = datetime.utcnow()
+    cur = rs_conn.cursor()
+    cur.execute(f"""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = '{STAGING_SCHEMA}'
+            AND table_name LIKE '{STAGING_TABLE_PREFIX}%';""")
+    dropped = []
+    for (name,) in cur.fetchall():
+        match = STAGING_TABLE_NAME.match(name)
+        if match is None:
+            continue
+        created_at = datetime.strptime(match.group(1), "%Y%m%d%H%M%S")
+        if now - created_at > max_age:
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_SCHEMA}.{name};")
+            dropped.append(f"{STAGING_SCHEMA}.{name}")
+    rs_conn.commit()
+    return dropped
+
+
+@instrumented("copy")
 def copy_to_redshift_staging(
-    table_name: str, rs_conn, s3_file_path: str, role_string: str
+    table_name: str,
+    rs_conn,
+    s3_file_path: str,
+    role_string: str,
+    copy_options: str = "",
+    manifest: bool = False,
+    staging_table: str = STAGING_TABLE,
 ) -> None:
-    """Copy data from s3 into Redshift staging table."""
+    """
+    Copy data from s3 into Redshift staging table.
+    :param copy_options: extra COPY options for the export format, see COPY_OPTIONS
+    :param manifest: s3_file_path is a COPY manifest listing the export's parts,
+        which are then loaded in parallel across the cluster's slices
+    :param staging_table: staging table to create, see staging_table_name. It's
+        a regular table rather than TEMP because the validation suite queries it
+        from its own sessions, the promote or drop_stale_staging_tables drops it
+    """
+    if manifest:
+        copy_options = f"MANIFEST {copy_options}"
     # write queries to execute on redshift
-    create_temp_table = f"CREATE TABLE staging_table (LIKE {table_name});"
-    sql_copy_to_temp = f"COPY staging_table FROM {s3_file_path} iam_role {role_string};"
+    create_temp_table = f"CREATE TABLE {staging_table} (LIKE {table_name});"
+    sql_copy_to_temp = f"COPY {staging_table} FROM '{s3_file_path}' iam_role '{role_string}' {copy_options};"
 
     # execute queries
     cur = rs_conn.cursor()
     cur.execute(create_temp_table)
     cur.execute(sql_copy_to_temp)
+    # rows loaded by the COPY that just ran in this session
+    cur.execute("SELECT pg_last_copy_count();")
+    get_run_metrics().incr("copy", "rows", cur.fetchone()[0])
     rs_conn.commit()
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Copy s3 export to staging.")
+    arg_parser.add_argument(
+        "--format",
+        choices=list(COPY_OPTIONS),
+        default="csv",
+        help="format of the export file (csv.gz is written by extract --stream)",
+    )
+    arg_parser.add_argument(
+        "--staging-table",
+        default=STAGING_TABLE,
+        help="name of the staging table to create and load",
+    )
+    arg_parser.add_argument(
+        "--manifest",
+        help="s3 path of the COPY manifest of a split export, instead of the "
+        "single file export of today",
+    )
+    args = arg_parser.parse_args()
     # get redshift table name
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
-    table_name = parser.get("aws_redshift_creds", "table_name")
+    ctx = get_pipeline_context()
+    table_name = ctx.config.get("aws_redshift_creds", "table_name")
     # copy s3 data to redshift staging table
-    rs_conn = connect_redshift()
-    s3_file_path, role_string = get_s3_and_iam_details()
-    copy_to_redshift_staging(table_name, rs_conn, s3_file_path, role_string)
+    rs_conn = ctx.redshift()
+    s3_file_path, role_string = ctx.s3_and_iam_details(file_extension=args.format)
+    if args.manifest is not None:
+        s3_file_path = args.manifest
+    copy_to_redshift_staging(
+        table_name,
+        rs_conn,
+        s3_file_path,
+        role_string,
+        COPY_OPTIONS[args.format],
+        args.manifest is not None,
+        args.staging_table,
+    )
@@ -0,0 +1,221 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import sys
+import aiohttp
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from datetime import datetime
+
+from src.copy_to_redshift_staging import COPY_OPTIONS
+from src.utilities.pipeline_context import get_pipeline_context
+from src.utilities.strava_api_utils import (
+    STRAVA_ACTIVITY_DETAIL_URL,
+    StravaRateLimiter,
+    load_activity_parser,
+)
+
+DETAILS_TABLE_NAME = "public.strava_activity_details"
+
+
+def read_export_columns(
+    manifest_path: str, columns: Sequence[str], s3=None
+) -> List[tuple]:
+    """
+    Read some columns of every activity in the parts of a split export, as
+    str or None. Columns an older part was exported without read as None.
+    :param manifest_path: s3 path of the export's COPY manifest, as printed by
+        extract_strava_data
+    """
+    if s3 is None:
+        s3 = get_pipeline_context().s3()
+    schema_columns = load_activity_parser().columns
+    positions = [schema_columns.index(col) for col in columns]
+
+    def read_object(s3_path: str) -> bytes:
+        bucket_name, _, key = s3_path[len("s3://") :].partition("/")
+        return s3.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+
+    rows = []
+    for entry in json.loads(read_object(manifest_path))["entries"]:
+        body = read_object(entry["url"])
+        if entry["url"].endswith(".parquet"):
+            # pyarrow is only needed for parquet exports
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(io.BytesIO(body), columns=list(columns))
+            part_rows = zip(*(table.column(col).to_pylist() for col in columns))
+        else:
+            with io.StringIO(gzip.decompress(body).decode(), newline="") as fp:
+                part_rows = [
+                    [row[i] if i < len(row) else None for i in positions]
+                    for row in csv.reader(fp, delimiter="|")
+                    if row
+                ]
+        rows.extend(
+            tuple(None if value in (None, "") else str(value) for value in row)
+            for row in part_rows
+        )
+    return rows
+
+
+def read_activity_ids(manifest_path: str, s3=None) -> List[str]:
+    """Read the activity ids from the parts of a split export."""
+    return [row[0] for row in read_export_columns(manifest_path, ("id",), s3)]
+
+
+def parse_activity_details(response_json: dict) -> list:
+    """Parse the detail-only fields of a /activities/{id} response."""
+    gear = response_json.get("gear") or {}
+    return [
+        response_json["id"],
+        response_json.get("calories"),
+        response_json.get("device_name"),
+        response_json.get("gear_id"),
+        gear.get("name"),
+        json.dumps(response_json.get("splits_metric") or []),
+        json.dumps(response_json.get("laps") or []),
+    ]
+
+
+async def fetch_strava_json(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: StravaRateLimiter,
+    header: Dict[str, str],
+    url: str,
+    params: Optional[Dict[str, str]] = None,
+) -> Optional[Any]:
+    """GET a Strava API resource, waiting on the shared rate limit budget first."""
+    async with semaphore:
+        while True:
+            await rate_limiter.wait_async()
+            async with session.get(url, headers=header, params=params) as response:
+                rate_limiter.update(response.headers)
+                # rate limit has been exceeded, wait for the window to reset and retry
+                if response.status == 429:
+                    rate_limiter.exhaust()
+                    continue
+                # activity has been deleted or made private since extraction
+                if response.status == 404:
+                    return None
+                response.raise_for_status()
+                return await response.json()
+
+
+async def fetch_activity_details(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: StravaRateLimiter,
+    header: Dict[str, str],
+    activity_id: str,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> Optional[dict]:
+    """Fetch one activity, waiting on the shared rate limit budget first."""
+    return await fetch_strava_json(
+        session, semaphore, rate_limiter, header, f"{url}/{activity_id}"
+    )
+
+
+async def enrich_strava_activities_async(
+    activity_ids: Iterable[str],
+    header: Dict[str, str],
+    rate_limiter: StravaRateLimiter,
+    max_concurrency: int = 10,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> List[list]:
+    """Fetch and parse the details of many activities concurrently."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # one pooled connector for all coroutines so TLS connections are reused
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        responses = await asyncio.gather(
+            *(
+                fetch_activity_details(
+                    session, semaphore, rate_limiter, header, activity_id, url
+                )
+                for activity_id in activity_ids
+            )
+        )
+    return [parse_activity_details(r) for r in responses if r is not None]
+
+
+def enrich_strava_activities(
+    activity_ids: Iterable[str],
+    header: Optional[Dict[str, str]] = None,
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    max_concurrency: int = 10,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> List[list]:
+    """Get detailed activity data (calories, splits, laps, device, gear) for activity ids."""
+    if header is None:
+        header = get_pipeline_context().strava_header()
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    activity_details = asyncio.run(
+        enrich_strava_activities_async(
+            activity_ids, header, rate_limiter, max_concurrency, url
+        )
+    )
+    print(
+        f"Enriched {len(activity_details)} activities "
+        f"using {rate_limiter.requests_made} API requests."
+    )
+    return activity_details
+
+
+def save_details_to_csv(activity_details: List[list]) -> str:
+    """Save activity details to .csv file."""
+    todays_date = datetime.today().strftime("%Y_%m_%d")
+    details_file_path = f"strava_data/{todays_date}_details_file.csv"
+    with open(details_file_path, "w", newline="") as fp:
+        csvw = csv.writer(fp, delimiter="|")
+        csvw.writerows(activity_details)
+    return details_file_path
+
+
+def load_details_to_redshift(
+    rs_conn, s3_file_path: str, role_string: str, table_name: str = DETAILS_TABLE_NAME
+) -> None:
+    """Copy activity rows from s3 into Redshift, replacing rows of existing ids."""
+    create_temp_table = f"CREATE TEMP TABLE details_staging (LIKE {table_name});"
+    # loaded as CSV, so the quotes csv.writer puts around json values are honoured
+    sql_copy_to_temp = (
+        f"COPY details_staging FROM '{s3_file_path}' iam_role '{role_string}' "
+        f"{COPY_OPTIONS['csv']};"
+    )
+    delete_from_table = f"DELETE FROM {table_name} USING details_staging WHERE {table_name}.id = details_staging.id;"
+    insert_into_table = f"INSERT INTO {table_name} SELECT * FROM details_staging;"
+    drop_temp_table = "DROP TABLE details_staging;"
+    # execute queries
+    cur = rs_conn.cursor()
+    cur.execute(create_temp_table)
+    cur.execute(sql_copy_to_temp)
+    cur.execute(delete_from_table)
+    cur.execute(insert_into_table)
+    cur.execute(drop_temp_table)
+    rs_conn.commit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python enrich_strava_activities.py s3://.../manifest.json")
+        exit(-1)
+    ctx = get_pipeline_context()
+    max_concurrency = ctx.config.getint(
+        "strava_enrichment_config", "max_concurrency", fallback=10
+    )
+    activity_ids = read_activity_ids(sys.argv[1])
+    activity_details = enrich_strava_activities(
+        activity_ids, max_concurrency=max_concurrency
+    )
+    if activity_details:
+        details_file_path = save_details_to_csv(activity_details)
+        bucket_name = ctx.config.get("aws_boto_credentials", "bucket_name")
+        ctx.s3().upload_file(details_file_path, bucket_name, details_file_path)
+        _, role_string = ctx.s3_and_iam_details()
+        s3_file_path = f"s3://{bucket_name}/{details_file_path}"
+        load_details_to_redshift(ctx.redshift(), s3_file_path, role_string)
+        print("Strava activity details loaded into Redshift!")
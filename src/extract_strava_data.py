@@ -1,25 +1,45 @@
+import argparse
+import calendar
 import csv
+import gzip
+import json
+import os
 import requests
-import time
 
-from typing import Dict, List, Tuple
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from datetime import datetime, timedelta
 
-from src.utilities.mysql_utils import connect_mysql
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import get_pipeline_context
 from src.utilities.strava_api_utils import (
-    connect_strava,
+    STRAVA_ACTIVITIES_URL,
+    STRAVA_MAX_PER_PAGE,
+    StravaRateLimiter,
     convert_strava_start_date,
+    load_activity_parser,
+    load_strava_athletes,
     parse_api_output,
 )
-from src.utilities.s3_utils import connect_s3
+from src.utilities.raw_cache_utils import RawResponseCache, load_raw_cache
+from src.utilities.s3_utils import S3MultipartWriter
 
+EXTRACT_CHECKPOINT_PATH = ".strava_extract_checkpoint.json"
+ACTIVITY_HASHES_PATH = ".strava_activity_hashes.json"
+# file format of each part of a split export, by export format
+EXPORT_PART_FORMATS = {"csv": "csv.gz", "parquet": "parquet"}
+# watermark of athletes that have never been extracted
+FIRST_EXTRACTION_DATE = datetime(1900, 1, 1)
 
-def get_date_of_last_warehouse_update() -> Tuple[datetime, str]:
+
+def get_date_of_last_warehouse_update(mysql_conn=None) -> Tuple[datetime, str]:
     """
     Get the datetime of last time data was extracted from Strava API
     by querying MySQL database and also return current datetime.
     """
-    mysql_conn = connect_mysql()
+    if mysql_conn is None:
+        mysql_conn = get_pipeline_context().mysql()
     get_last_updated_query = """
         SELECT COALESCE(MAX(LastUpdated), '1900-01-01')
         FROM last_extracted;"""
@@ -31,81 +51,763 @@ def get_date_of_last_warehouse_update() -> Tuple[datetime, str]:
     return last_updated_warehouse, current_datetime
 
 
+def get_athlete_watermarks(
+    athlete_ids: Sequence[Optional[str]], mysql_conn=None
+) -> Dict[Optional[str], datetime]:
+    """
+    Get the start date of the newest activity extracted for each athlete,
+    rows without an athlete_id belong to the [strava_api_config] athlete.
+    """
+    if mysql_conn is None:
+        mysql_conn = get_pipeline_context().mysql()
+    get_watermarks_query = """
+        SELECT athlete_id, MAX(LastUpdated)
+        FROM last_extracted
+        GROUP BY athlete_id;"""
+    mysql_cursor = mysql_conn.cursor()
+    mysql_cursor.execute(get_watermarks_query)
+    saved = {}
+    for athlete_id, last_updated in mysql_cursor.fetchall():
+        if not isinstance(last_updated, datetime):
+            last_updated = datetime.strptime(str(last_updated), "%Y-%m-%d %H:%M:%S")
+        saved[athlete_id] = last_updated
+    return {
+        athlete_id: saved.get(athlete_id, FIRST_EXTRACTION_DATE)
+        for athlete_id in athlete_ids
+    }
+
+
 def make_strava_api_request(
-    header: Dict[str, str], activity_num: int = 1
-) -> Dict[str, str]:
-    """Use Strava API to get recent page of new data."""
-    param = {"per_page": 1, "page": activity_num}
-    api_response = requests.get(
-        "https://www.strava.com/api/v3/athlete/activities", headers=header, params=param
-    ).json()
-    response_json = api_response[0]
-    return response_json
-
-
-def extract_strava_activities(last_updated_warehouse: datetime) -> List[List]:
-    """Connect to Strava API and get data up until last_updated_warehouse datetime."""
-    header = connect_strava()
-    all_activities = []
-    activity_num = 1
-    # while activity has not been extracted yet
+    header: Dict[str, str],
+    page: int = 1,
+    per_page: int = STRAVA_MAX_PER_PAGE,
+    after: Optional[int] = None,
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    session: Optional[requests.Session] = None,
+    url: str = STRAVA_ACTIVITIES_URL,
+    before: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Use Strava API to get a page of activities.
+    :param after: only return activities that started after this epoch timestamp
+    :param before: only return activities that started before this epoch timestamp
+    :return: list of activity dictionaries, empty once all pages are consumed
+    """
+    param = {"per_page": per_page, "page": page}
+    if after is not None:
+        param["after"] = after
+    if before is not None:
+        param["before"] = before
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    http = session if session is not None else requests
     while True:
-        # Strava has a rate limit of 100 requests every 15 mins
-        if activity_num % 75 == 0:
-            print("Rate limit hit, sleeping for 15 minutes...")
-            time.sleep(15 * 60)
-        try:
-            response_json = make_strava_api_request(header, activity_num)
-        # rate limit has exceeded, wait 15 minutes
-        except KeyError:
-            print("Rate limit hit, sleeping for 15 minutes...")
-            time.sleep(15 * 60)
-            response_json = make_strava_api_request(header, activity_num)
-        date = response_json["start_date"]
-        converted_date = convert_strava_start_date(date)
-        if converted_date > last_updated_warehouse:
-            activity = parse_api_output(response_json)
-            all_activities.append(activity)
-            activity_num += 1
-        else:
-            break
+        rate_limiter.wait()
+        response = http.get(url, headers=header, params=param)
+        rate_limiter.update(response.headers)
+        # rate limit has been exceeded, wait for the window to reset and retry
+        if response.status_code == 429:
+            get_run_metrics().incr("extract", "http_429_responses")
+            rate_limiter.exhaust()
+            continue
+        response.raise_for_status()
+        return response.json()
+
+
+def load_extraction_checkpoint(checkpoint_path: str) -> Optional[dict]:
+    """Load the checkpoint of an unfinished extraction, if there is one."""
+    try:
+        with open(checkpoint_path, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def save_extraction_checkpoint(checkpoint: dict, checkpoint_path: str) -> None:
+    """Save an extraction checkpoint, atomically so a crash never corrupts it."""
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(checkpoint, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def clear_extraction_checkpoint(checkpoint_path: str) -> None:
+    """Remove a checkpoint and its spool once the extraction has been loaded."""
+    for path in (checkpoint_path, f"{checkpoint_path}.spool"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def athlete_checkpoint_path(
+    checkpoint_path: Optional[str], athlete_id: Optional[str]
+) -> Optional[str]:
+    """Checkpoint path of one athlete's extraction."""
+    if checkpoint_path is None or athlete_id is None:
+        return checkpoint_path
+    return f"{checkpoint_path}.{athlete_id}"
+
+
+def load_athlete_limits(config) -> Tuple[int, int]:
+    """Each athlete's short and daily request budget from pipeline.conf."""
+    return (
+        config.getint("strava_api_config", "athlete_short_limit", fallback=100),
+        config.getint("strava_api_config", "athlete_daily_limit", fallback=1000),
+    )
+
+
+def load_resync_window(config) -> timedelta:
+    """Trailing window of already loaded activities that are fetched again."""
+    return timedelta(
+        days=config.getfloat("strava_api_config", "resync_days", fallback=0)
+    )
+
+
+def load_activity_hashes(hashes_path: str) -> Dict[str, list]:
+    """
+    Load the content hashes of recently extracted activities.
+    :return: [content_hash, start_date] by activity id
+    """
+    try:
+        with open(hashes_path, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_activity_hashes(
+    hashes: Dict[str, list], hashes_path: str, prune_before: Optional[datetime] = None
+) -> None:
+    """
+    Save activity content hashes, atomically like the extraction checkpoint.
+    :param prune_before: drop activities that started before this, they are
+        outside every re-sync window and will not be fetched again
+    """
+    if prune_before is not None:
+        oldest = prune_before.strftime("%Y-%m-%d %H:%M:%S")
+        hashes = {k: v for k, v in hashes.items() if v[1] >= oldest}
+    save_extraction_checkpoint(hashes, hashes_path)
+
+
+def filter_changed_activities(
+    activities: Iterable[List], hashes: Dict[str, list]
+) -> Iterator[List]:
+    """
+    Yield only the activities that are new or changed since they were last
+    extracted, so re-synced activities nobody touched are never staged.
+    The hashes of yielded activities are recorded in hashes, which should
+    only be saved once the activities are safely in s3.
+    """
+    columns = load_activity_parser().columns
+    hash_position = columns.index("content_hash")
+    date_position = columns.index("start_date")
+    n_unchanged = 0
+    try:
+        for activity in activities:
+            activity_id = str(activity[0])
+            content_hash = activity[hash_position]
+            saved = hashes.get(activity_id)
+            if saved is not None and saved[0] == content_hash:
+                n_unchanged += 1
+                continue
+            start_date = activity[date_position]
+            hashes[activity_id] = [
+                content_hash,
+                start_date.strftime("%Y-%m-%d %H:%M:%S") if start_date else "",
+            ]
+            yield activity
+    finally:
+        get_run_metrics().incr("extract", "unchanged_rows", n_unchanged)
+
+
+def new_activity_ids(
+    results: Dict[Optional[str], List[List]], watermarks: Dict[Optional[str], datetime]
+) -> List[Tuple[Optional[str], str]]:
+    """
+    (athlete id, activity id) of the extracted activities that started after
+    their athlete's watermark.
+    """
+    date_position = load_activity_parser().columns.index("start_date")
+    return [
+        (athlete_id, activity[0])
+        for athlete_id, activities in results.items()
+        for activity in activities
+        if activity[date_position] > watermarks[athlete_id]
+    ]
+
+
+def get_extraction_watermark(checkpoint_path: str) -> Optional[datetime]:
+    """Start date of the newest activity extracted, the next run's watermark."""
+    checkpoint = load_extraction_checkpoint(checkpoint_path)
+    if checkpoint is None or checkpoint["max_start_date"] is None:
+        return None
+    return convert_strava_start_date(checkpoint["max_start_date"])
+
+
+def iter_strava_activities(
+    last_updated_warehouse: datetime,
+    header: Optional[Dict[str, str]] = None,
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    url: str = STRAVA_ACTIVITIES_URL,
+    per_page: int = STRAVA_MAX_PER_PAGE,
+    checkpoint_path: Optional[str] = None,
+    resync_window: timedelta = timedelta(0),
+    raw_cache: Optional[RawResponseCache] = None,
+) -> Iterator[List]:
+    """
+    Connect to Strava API and lazily yield parsed activities up until
+    last_updated_warehouse datetime, fetching one page at a time.
+
+    Activities keep changing after upload (kudos, comments, names), so
+    activities that started within resync_window before the watermark are
+    fetched again in the same bulk pages as the new ones.
+
+    With a raw_cache, every page is also cached as fetched, so it can be
+    re-parsed later without spending the request budget again.
+
+    With a checkpoint_path, the raw activities of each page are spooled to
+    disk and the page cursor, newest start date and spool size are
+    checkpointed before the page is yielded. A retry with the same
+    watermark first yields the spooled activities again and then resumes
+    from the next page, instead of spending the request budget again.
+    """
+    if header is None:
+        header = get_pipeline_context().strava_header()
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    last_updated_warehouse -= resync_window
+    # Strava start dates are UTC, so treat the watermark as UTC too
+    after = calendar.timegm(last_updated_warehouse.timetuple())
+    checkpoint = {
+        "after": after,
+        "next_page": 1,
+        "max_start_date": None,
+        "rows": 0,
+        "spool_bytes": 0,
+        "complete": False,
+    }
+    spool = None
+    n_rows, requests_made = 0, rate_limiter.requests_made
+    seconds_slept = rate_limiter.seconds_slept
+    try:
+        if checkpoint_path is not None:
+            saved = load_extraction_checkpoint(checkpoint_path)
+            # a checkpoint for another watermark belongs to an older extraction
+            if saved is not None and saved["after"] == after:
+                checkpoint = saved
+            spool = open(f"{checkpoint_path}.spool", "a+b")
+            # drop anything written after the last checkpoint
+            spool.truncate(checkpoint["spool_bytes"])
+            if checkpoint["rows"]:
+                print(
+                    f"Resuming extraction at page {checkpoint['next_page']} "
+                    f"with {checkpoint['rows']} spooled activities."
+                )
+                spool.seek(0)
+                for line in spool:
+                    n_rows += 1
+                    yield parse_api_output(json.loads(line))
+            save_extraction_checkpoint(checkpoint, checkpoint_path)
+
+        page = checkpoint["next_page"]
+        with requests.Session() as session:
+            while not checkpoint["complete"]:
+                activities = make_strava_api_request(
+                    header, page, per_page, after, rate_limiter, session, url
+                )
+                if raw_cache is not None and activities:
+                    raw_cache.put_page(activities)
+                new_activities = [
+                    response_json
+                    for response_json in activities
+                    if convert_strava_start_date(response_json["start_date"])
+                    > last_updated_warehouse
+                ]
+                # a short page means there is nothing left after the watermark
+                checkpoint["complete"] = len(activities) < per_page
+                page += 1
+                if spool is not None:
+                    spool.writelines(
+                        json.dumps(r).encode() + b"\n" for r in new_activities
+                    )
+                    spool.flush()
+                    os.fsync(spool.fileno())
+                    start_dates = [r["start_date"] for r in new_activities]
+                    if checkpoint["max_start_date"] is not None:
+                        start_dates.append(checkpoint["max_start_date"])
+                    checkpoint.update(
+                        next_page=page,
+                        max_start_date=max(start_dates, default=None),
+                        rows=checkpoint["rows"] + len(new_activities),
+                        spool_bytes=spool.tell(),
+                    )
+                    save_extraction_checkpoint(checkpoint, checkpoint_path)
+                for response_json in new_activities:
+                    n_rows += 1
+                    yield parse_api_output(response_json)
+    finally:
+        if spool is not None:
+            spool.close()
+        metrics = get_run_metrics()
+        metrics.incr("extract", "rows", n_rows)
+        metrics.incr(
+            "extract", "http_requests", rate_limiter.requests_made - requests_made
+        )
+        metrics.incr(
+            "extract",
+            "rate_limit_sleep_seconds",
+            rate_limiter.seconds_slept - seconds_slept,
+        )
+
+
+@instrumented("extract")
+def extract_strava_activities(
+    last_updated_warehouse: datetime,
+    header: Optional[Dict[str, str]] = None,
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    url: str = STRAVA_ACTIVITIES_URL,
+    per_page: int = STRAVA_MAX_PER_PAGE,
+    checkpoint_path: Optional[str] = None,
+    resync_window: timedelta = timedelta(0),
+    raw_cache: Optional[RawResponseCache] = None,
+) -> List[List]:
+    """
+    Connect to Strava API and get data up until last_updated_warehouse datetime.
+    :param checkpoint_path: checkpoint progress here to resume after a failure
+    :param resync_window: also fetch activities this far before the watermark
+    :param raw_cache: cache the raw pages here
+    """
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    all_activities = list(
+        iter_strava_activities(
+            last_updated_warehouse,
+            header,
+            rate_limiter,
+            url,
+            per_page,
+            checkpoint_path,
+            resync_window,
+            raw_cache,
+        )
+    )
+    print(
+        f"Extracted {len(all_activities)} activities "
+        f"using {rate_limiter.requests_made} API requests."
+    )
     return all_activities
 
 
-def save_data_to_csv(all_activities: List[List]) -> str:
-    """Save extracted data to .csv file."""
+@instrumented("extract")
+def extract_athletes_activities(
+    watermarks: Dict[Optional[str], datetime],
+    headers: Dict[Optional[str], Dict[str, str]],
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    athlete_limits: Tuple[int, int] = (100, 1000),
+    max_workers: int = 4,
+    url: str = STRAVA_ACTIVITIES_URL,
+    per_page: int = STRAVA_MAX_PER_PAGE,
+    checkpoint_path: Optional[str] = None,
+    resync_window: timedelta = timedelta(0),
+    raw_cache: Optional[RawResponseCache] = None,
+) -> Dict[Optional[str], List[List]]:
+    """
+    Extract the new activities of many athletes concurrently, each from their
+    own watermark with their own access token. Every athlete's requests draw
+    on their own budget (athlete_limits, short and daily) and on the shared
+    application budget of rate_limiter, so wall time is bound by the
+    application rate limit instead of growing with every athlete added.
+    :param checkpoint_path: each athlete checkpoints to this path suffixed
+        with their athlete id
+    :param resync_window: also fetch activities this far before each watermark
+    :param raw_cache: cache the raw pages of every athlete here
+    :return: extracted activities by athlete id
+    """
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+
+    def extract_athlete(athlete_id: Optional[str]) -> List[List]:
+        athlete_limiter = StravaRateLimiter(
+            *athlete_limits,
+            clock=rate_limiter.clock,
+            sleep=rate_limiter.sleep,
+            async_sleep=rate_limiter.async_sleep,
+            parent=rate_limiter,
+        )
+        return list(
+            iter_strava_activities(
+                watermarks[athlete_id],
+                headers[athlete_id],
+                athlete_limiter,
+                url,
+                per_page,
+                athlete_checkpoint_path(checkpoint_path, athlete_id),
+                resync_window,
+                raw_cache,
+            )
+        )
+
+    athlete_ids = list(watermarks)
+    with ThreadPoolExecutor(max(1, min(max_workers, len(athlete_ids)))) as pool:
+        results = dict(zip(athlete_ids, pool.map(extract_athlete, athlete_ids)))
+    print(
+        f"Extracted {sum(map(len, results.values()))} activities of "
+        f"{len(results)} athletes using {rate_limiter.requests_made} API requests."
+    )
+    return results
+
+
+@instrumented("export")
+def save_data_to_csv(all_activities: List[List], output_format: str = "csv") -> str:
+    """
+    Save extracted data to .csv file.
+    :param output_format: csv for a pipe-delimited file, or parquet for a
+        typed Parquet file with one row group per activity month
+    """
     todays_date = datetime.today().strftime("%Y_%m_%d")
-    export_file_path = f"strava_data/{todays_date}_export_file.csv"
-    with open(export_file_path, "w") as fp:
-        csvw = csv.writer(fp, delimiter="|")
-        csvw.writerows(all_activities)
+    export_file_path = f"strava_data/{todays_date}_export_file.{output_format}"
+    if output_format == "parquet":
+        # pyarrow is only needed for parquet exports
+        from src.utilities.parquet_utils import write_activities_to_parquet
+
+        write_activities_to_parquet(all_activities, export_file_path)
+    elif output_format == "csv":
+        with open(export_file_path, "w") as fp:
+            csvw = csv.writer(fp, delimiter="|")
+            csvw.writerows(all_activities)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+    metrics = get_run_metrics()
+    metrics.incr("export", "rows", len(all_activities))
+    metrics.incr("export", "bytes", os.path.getsize(export_file_path))
     print("Strava data extracted from API!")
     return export_file_path
 
 
-def upload_csv_to_s3(export_file_path: str) -> None:
+def load_bucket_name(config=None) -> str:
+    """The s3 bucket configured in pipeline.conf that exports are written to."""
+    if config is None:
+        config = get_pipeline_context().config
+    return config.get("aws_boto_credentials", "bucket_name")
+
+
+@instrumented("upload")
+def upload_csv_to_s3(
+    export_file_path: str, s3=None, bucket_name: Optional[str] = None
+) -> None:
     """Upload extracted .csv file to s3 bucket."""
-    s3 = connect_s3()
-    s3.upload_file(export_file_path, "strava-data-pipeline", export_file_path)
+    if s3 is None:
+        s3 = get_pipeline_context().s3()
+    if bucket_name is None:
+        bucket_name = load_bucket_name()
+    s3.upload_file(export_file_path, bucket_name, export_file_path)
+    get_run_metrics().incr("upload", "bytes", os.path.getsize(export_file_path))
     print("Strava data uploaded to s3 bucket!")
 
 
-def save_extraction_date_to_database(current_datetime: datetime) -> None:
-    """Update last extraction date in MySQL database to todays datetime."""
-    mysql_conn = connect_mysql()
+@instrumented("extract")
+def replay_raw_activities(raw_cache: RawResponseCache) -> List[List]:
+    """
+    Re-parse the latest cached payload of every activity in the raw cache,
+    making no HTTP calls, e.g. after adding a column or fixing the parser.
+    Pages and index lines missing locally are read from the cache's s3 mirror.
+    """
+    parser = load_activity_parser()
+    all_activities = [
+        parser.parse_list(response_json)
+        for response_json in raw_cache.iter_latest_activities()
+    ]
+    # an empty replay would otherwise pass for a run that found nothing new
+    if not all_activities:
+        raise ValueError(f"Raw cache {raw_cache.root} has no activities to replay")
+    get_run_metrics().incr("extract", "rows", len(all_activities))
+    print(f"Replayed {len(all_activities)} activities from {raw_cache.root}.")
+    return all_activities
+
+
+def write_export_part(
+    activities: List[List], part_file_path: str, output_format: str = "csv"
+) -> None:
+    """Write one part of a split export, gzip-compressed if it is a .csv."""
+    if output_format == "parquet":
+        from src.utilities.parquet_utils import write_activities_to_parquet
+
+        write_activities_to_parquet(activities, part_file_path)
+    elif output_format == "csv":
+        with gzip.open(part_file_path, "wt", newline="") as fp:
+            csvw = csv.writer(fp, delimiter="|")
+            csvw.writerows(activities)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")
+
+
+@instrumented("export")
+def export_activities_to_s3(
+    all_activities: List[List],
+    s3=None,
+    bucket_name: Optional[str] = None,
+    output_format: str = "csv",
+    n_parts: int = 4,
+    run_date: Optional[datetime] = None,
+    run_id: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Split extracted activities into n_parts compressed files under a date
+    and run partitioned prefix, upload them to s3 in parallel and write a
+    COPY manifest listing exactly these parts. A COPY through the manifest
+    loads the parts on all slices at once, and only loads this run's files.
+    :param bucket_name: defaults to the bucket configured in pipeline.conf
+    :param n_parts: a multiple of the Redshift cluster's slices
+    :return: s3 path of the manifest, None if there was nothing to export
+    """
+    if not all_activities:
+        return None
+    if s3 is None:
+        s3 = get_pipeline_context().s3()
+    if bucket_name is None:
+        bucket_name = load_bucket_name()
+    if run_date is None:
+        run_date = datetime.today()
+    if run_id is None:
+        run_id = get_run_metrics().run_id
+    export_dir = f"strava_data/date={run_date:%Y-%m-%d}/run={run_id}"
+    os.makedirs(export_dir, exist_ok=True)
+    part_format = EXPORT_PART_FORMATS[output_format]
+    part_rows = -(-len(all_activities) // max(1, n_parts))
+    part_file_paths = []
+    for start in range(0, len(all_activities), part_rows):
+        part_file_path = f"{export_dir}/part_{len(part_file_paths):04d}.{part_format}"
+        write_export_part(
+            all_activities[start : start + part_rows], part_file_path, output_format
+        )
+        part_file_paths.append(part_file_path)
+
+    def upload_part(part_file_path: str) -> None:
+        s3.upload_file(part_file_path, bucket_name, part_file_path)
+
+    with ThreadPoolExecutor(len(part_file_paths)) as pool:
+        list(pool.map(upload_part, part_file_paths))
+    # content_length is required to COPY parquet through a manifest
+    manifest = {
+        "entries": [
+            {
+                "url": f"s3://{bucket_name}/{part_file_path}",
+                "mandatory": True,
+                "meta": {"content_length": os.path.getsize(part_file_path)},
+            }
+            for part_file_path in part_file_paths
+        ]
+    }
+    manifest_key = f"{export_dir}/manifest.json"
+    s3.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(manifest))
+    metrics = get_run_metrics()
+    metrics.incr("export", "rows", len(all_activities))
+    metrics.incr("export", "parts", len(part_file_paths))
+    metrics.incr(
+        "export", "bytes", sum(e["meta"]["content_length"] for e in manifest["entries"])
+    )
+    print(
+        f"Exported {len(all_activities)} activities in {len(part_file_paths)} parts "
+        f"to s3://{bucket_name}/{export_dir}"
+    )
+    return f"s3://{bucket_name}/{manifest_key}"
+
+
+@instrumented("stream_export")
+def stream_activities_to_s3(
+    activities: Iterable[List],
+    s3=None,
+    bucket_name: Optional[str] = None,
+    export_file_path: Optional[str] = None,
+    part_size: int = 8 * 1024 * 1024,
+) -> int:
+    """
+    Stream parsed activities into a gzip-compressed .csv object in s3 using
+    multipart upload, so rows are uploaded while later pages are still being
+    fetched and memory stays flat however many activities there are.
+    :param bucket_name: defaults to the bucket configured in pipeline.conf
+    :return: number of activities uploaded, no object is created if zero
+    """
+    if s3 is None:
+        s3 = get_pipeline_context().s3()
+    if bucket_name is None:
+        bucket_name = load_bucket_name()
+    if export_file_path is None:
+        todays_date = datetime.today().strftime("%Y_%m_%d")
+        export_file_path = f"strava_data/{todays_date}_export_file.csv.gz"
+    n_activities = 0
+    with S3MultipartWriter(s3, bucket_name, export_file_path, part_size) as writer:
+        with gzip.open(writer, "wt", newline="") as fp:
+            csvw = csv.writer(fp, delimiter="|")
+            for activity in activities:
+                csvw.writerow(activity)
+                n_activities += 1
+        # don't leave an empty export behind for the COPY to load
+        if n_activities == 0:
+            writer.abort()
+    metrics = get_run_metrics()
+    metrics.incr("stream_export", "rows", n_activities)
+    metrics.incr("stream_export", "bytes", writer.bytes_written)
+    if n_activities:
+        print(
+            f"Streamed {n_activities} activities to s3://{bucket_name}/{export_file_path}"
+        )
+    return n_activities
+
+
+def save_extraction_date_to_database(
+    current_datetime: datetime, mysql_conn=None, athlete_id: Optional[str] = None
+) -> None:
+    """Update an athlete's last extraction date in MySQL database."""
+    if mysql_conn is None:
+        mysql_conn = get_pipeline_context().mysql()
     update_last_updated_query = """
-        INSERT INTO last_extracted (LastUpdated)
-        VALUES (%s);"""
+        INSERT INTO last_extracted (LastUpdated, athlete_id)
+        VALUES (%s, %s);"""
     mysql_cursor = mysql_conn.cursor()
-    mysql_cursor.execute(update_last_updated_query, current_datetime)
+    mysql_cursor.execute(update_last_updated_query, (current_datetime, athlete_id))
     mysql_conn.commit()
     print("Extraction datetime added to MySQL database!")
 
 
+def commit_extraction(
+    checkpoint_path: str, mysql_conn=None, athlete_id: Optional[str] = None
+) -> None:
+    """
+    Once the extracted activities are safely in s3, save the start date of
+    the newest one as the athlete's watermark and remove the extraction
+    checkpoint. Call it even when nothing was extracted, so the finished
+    checkpoint doesn't stop the next run from fetching anything.
+    """
+    checkpoint_path = athlete_checkpoint_path(checkpoint_path, athlete_id)
+    watermark = get_extraction_watermark(checkpoint_path)
+    if watermark is not None:
+        save_extraction_date_to_database(
+            watermark.strftime("%Y-%m-%d %H:%M:%S"), mysql_conn, athlete_id
+        )
+    clear_extraction_checkpoint(checkpoint_path)
+
+
 if __name__ == "__main__":
-    last_updated_warehouse, current_datetime = get_date_of_last_warehouse_update()
-    all_activities = extract_strava_activities(last_updated_warehouse)
-    if all_activities:
-        export_file_path = save_data_to_csv(all_activities)
-        upload_csv_to_s3(export_file_path)
-        save_extraction_date_to_database(current_datetime)
+    arg_parser = argparse.ArgumentParser(description="Extract new Strava activities.")
+    arg_parser.add_argument(
+        "--format",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="export file format",
+    )
+    arg_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream gzip-compressed activities straight to s3 while extracting",
+    )
+    arg_parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="re-parse and export every activity from the raw cache, without "
+        "calling the API",
+    )
+    args = arg_parser.parse_args()
+
+    from src.validate_extracted_activities import (
+        load_batch_validator,
+        report_batch_quality,
+    )
+    from src.validator import suite_should_halt
+
+    ctx = get_pipeline_context()
+    bucket_name = ctx.config.get("aws_boto_credentials", "bucket_name")
+    n_parts = ctx.config.getint("aws_redshift_creds", "export_parts", fallback=4)
+    raw_cache = load_raw_cache(ctx.config, ctx.s3())
+    # the same in-stream checks as the pipeline's extract step
+    validator = load_batch_validator(ctx.config, ctx.redshift())
+
+    def validated(activities: Iterable[List]) -> Iterable[List]:
+        return activities if validator is None else validator.check(activities)
+
+    def halt_on_failed_checks() -> None:
+        """Report the checks, exiting before any watermark moves if one halts."""
+        if validator is None:
+            return
+        check_results = report_batch_quality(
+            validator, ctx.config.get("slack_config", "webhook_url")
+        )
+        if suite_should_halt(check_results):
+            exit(1)
+
+    if args.replay:
+        if raw_cache is None:
+            arg_parser.error("--replay needs [strava_raw_cache_config] enabled")
+        all_activities = list(validated(replay_raw_activities(raw_cache)))
+        halt_on_failed_checks()
+        manifest_path = export_activities_to_s3(
+            all_activities,
+            ctx.s3(),
+            bucket_name,
+            args.format,
+            n_parts,
+        )
+        print(f"COPY manifest written to {manifest_path}")
+        exit(0)
+    checkpoint_path = ctx.config.get(
+        "strava_api_config", "checkpoint_path", fallback=EXTRACT_CHECKPOINT_PATH
+    )
+    hashes_path = ctx.config.get(
+        "strava_api_config", "hashes_path", fallback=ACTIVITY_HASHES_PATH
+    )
+    resync_window = load_resync_window(ctx.config)
+    athletes = load_strava_athletes(ctx.config)
+    watermarks = get_athlete_watermarks([a.athlete_id for a in athletes])
+    headers = {a.athlete_id: ctx.strava_header(a) for a in athletes}
+    hashes = load_activity_hashes(hashes_path)
+    if args.stream:
+        # streaming keeps memory flat by extracting one athlete after another
+        rate_limiter = StravaRateLimiter()
+        activities = chain.from_iterable(
+            iter_strava_activities(
+                watermarks[athlete_id],
+                headers[athlete_id],
+                rate_limiter,
+                checkpoint_path=athlete_checkpoint_path(checkpoint_path, athlete_id),
+                resync_window=resync_window,
+                raw_cache=raw_cache,
+            )
+            for athlete_id in watermarks
+        )
+        stream_activities_to_s3(
+            validated(filter_changed_activities(activities, hashes)),
+            ctx.s3(),
+            bucket_name,
+        )
+        # rows are checked as they stream, so a halting check is only reported
+        # once the export is uploaded, but the watermarks still stay put
+        halt_on_failed_checks()
+    else:
+        results = extract_athletes_activities(
+            watermarks,
+            headers,
+            athlete_limits=load_athlete_limits(ctx.config),
+            max_workers=ctx.config.getint(
+                "strava_api_config", "max_athlete_workers", fallback=4
+            ),
+            checkpoint_path=checkpoint_path,
+            resync_window=resync_window,
+            raw_cache=raw_cache,
+        )
+        all_activities = list(
+            validated(
+                filter_changed_activities(chain.from_iterable(results.values()), hashes)
+            )
+        )
+        halt_on_failed_checks()
+        manifest_path = export_activities_to_s3(
+            all_activities, ctx.s3(), bucket_name, args.format, n_parts
+        )
+        if manifest_path is not None:
+            print(f"COPY manifest written to {manifest_path}")
+    for athlete_id in watermarks:
+        commit_extraction(checkpoint_path, athlete_id=athlete_id)
+    save_activity_hashes(hashes, hashes_path, min(watermarks.values()) - resync_window)
+    if raw_cache is not None:
+        raw_cache.flush(get_run_metrics().run_id)
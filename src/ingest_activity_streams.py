@@ -0,0 +1,227 @@
+import asyncio
+import csv
+import sys
+import aiohttp
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.enrich_strava_activities import (
+    fetch_strava_json,
+    load_details_to_redshift,
+    read_export_columns,
+)
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import PipelineContext, get_pipeline_context
+from src.utilities.strava_api_utils import (
+    STRAVA_ACTIVITY_DETAIL_URL,
+    StravaRateLimiter,
+    load_strava_athletes,
+)
+from src.utilities.stream_utils import (
+    STREAM_KEYS,
+    StreamBatch,
+    StreamStore,
+    compute_best_efforts,
+    compute_splits,
+    compute_stream_metrics,
+)
+
+STREAM_STORE_DIR = "strava_data/streams"
+DEFAULT_MAX_HEARTRATE = 190
+SPLITS_TABLE_NAME = "public.strava_activity_splits"
+BEST_EFFORTS_TABLE_NAME = "public.strava_activity_best_efforts"
+STREAM_METRICS_TABLE_NAME = "public.strava_activity_stream_metrics"
+
+
+async def fetch_activity_streams_async(
+    requests: Iterable[Tuple[str, Dict[str, str], StravaRateLimiter]],
+    max_concurrency: int = 10,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> StreamBatch:
+    """
+    Fetch the streams of many activities concurrently.
+    :param requests: activity id, auth header and rate limiter of each activity
+    """
+    requests = list(requests)
+    params = {"keys": ",".join(STREAM_KEYS), "key_by_type": "true"}
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        responses = await asyncio.gather(
+            *(
+                fetch_strava_json(
+                    session,
+                    semaphore,
+                    rate_limiter,
+                    header,
+                    f"{url}/{activity_id}/streams",
+                    params,
+                )
+                for activity_id, header, rate_limiter in requests
+            )
+        )
+    activity_ids = [activity_id for activity_id, _, _ in requests]
+    return StreamBatch.from_streams(zip(activity_ids, responses))
+
+
+@instrumented("streams")
+def fetch_activity_streams(
+    activity_ids: Iterable[str],
+    header: Optional[Dict[str, str]] = None,
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    max_concurrency: int = 10,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> StreamBatch:
+    """Get the time, distance, latlng, altitude, velocity, HR and cadence streams."""
+    if header is None:
+        header = get_pipeline_context().strava_header()
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    requests = [(activity_id, header, rate_limiter) for activity_id in activity_ids]
+    batch = asyncio.run(fetch_activity_streams_async(requests, max_concurrency, url))
+    report_fetched_streams(batch, rate_limiter)
+    return batch
+
+
+@instrumented("streams")
+def fetch_athletes_activity_streams(
+    athlete_activity_ids: Dict[Optional[str], List[str]],
+    headers: Dict[Optional[str], Dict[str, str]],
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    athlete_limits: Tuple[int, int] = (100, 1000),
+    max_concurrency: int = 10,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> StreamBatch:
+    """
+    Get the streams of many athletes' activities concurrently, each requested
+    with its athlete's own access token. Like extract_athletes_activities,
+    every athlete's requests draw on their own budget (athlete_limits) and on
+    the shared application budget of rate_limiter.
+    :param athlete_activity_ids: activity ids by athlete id
+    :param headers: auth header of every athlete
+    """
+    if rate_limiter is None:
+        rate_limiter = StravaRateLimiter()
+    requests = []
+    for athlete_id, activity_ids in athlete_activity_ids.items():
+        athlete_limiter = StravaRateLimiter(
+            *athlete_limits,
+            clock=rate_limiter.clock,
+            sleep=rate_limiter.sleep,
+            async_sleep=rate_limiter.async_sleep,
+            parent=rate_limiter,
+        )
+        requests.extend(
+            (activity_id, headers[athlete_id], athlete_limiter)
+            for activity_id in activity_ids
+        )
+    batch = asyncio.run(fetch_activity_streams_async(requests, max_concurrency, url))
+    report_fetched_streams(batch, rate_limiter)
+    return batch
+
+
+def report_fetched_streams(batch: StreamBatch, rate_limiter: StravaRateLimiter) -> None:
+    metrics = get_run_metrics()
+    metrics.incr("streams", "rows", batch.n_samples)
+    metrics.incr("streams", "http_requests", rate_limiter.requests_made)
+    print(
+        f"Fetched {batch.n_samples} stream samples of {len(batch)} activities "
+        f"using {rate_limiter.requests_made} API requests."
+    )
+
+
+@instrumented("stream_metrics")
+def compute_activity_metrics(
+    batch: StreamBatch, max_heartrate: float = DEFAULT_MAX_HEARTRATE
+) -> Dict[str, List[list]]:
+    """Compute the rows of every derived metrics table from a batch of streams."""
+    get_run_metrics().incr("stream_metrics", "rows", batch.n_samples)
+    return {
+        SPLITS_TABLE_NAME: compute_splits(batch),
+        BEST_EFFORTS_TABLE_NAME: compute_best_efforts(batch),
+        STREAM_METRICS_TABLE_NAME: compute_stream_metrics(batch, max_heartrate),
+    }
+
+
+def save_metrics_to_csv(table_name: str, rows: List[list]) -> str:
+    """Save the rows of one metrics table to a .csv file."""
+    todays_date = datetime.today().strftime("%Y_%m_%d")
+    short_name = table_name.split(".")[-1]
+    metrics_file_path = f"strava_data/{todays_date}_{short_name}.csv"
+    with open(metrics_file_path, "w", newline="") as fp:
+        csvw = csv.writer(fp, delimiter="|")
+        csvw.writerows(rows)
+    return metrics_file_path
+
+
+def ingest_activity_streams(
+    athlete_activity_ids: Iterable[Tuple[Optional[str], str]],
+    ctx: Optional[PipelineContext] = None,
+    rate_limiter: Optional[StravaRateLimiter] = None,
+    url: str = STRAVA_ACTIVITY_DETAIL_URL,
+) -> int:
+    """
+    Fetch the streams of new activities, keep them in the local stream store
+    and load the metrics derived from them into Redshift.
+    :param athlete_activity_ids: (athlete id, activity id) of each activity,
+        its streams are requested with that athlete's access token
+    :return: number of activities with streams
+    """
+    from src.extract_strava_data import load_athlete_limits
+
+    if ctx is None:
+        ctx = get_pipeline_context()
+    config = ctx.config
+    athletes = {athlete.athlete_id: athlete for athlete in load_strava_athletes(config)}
+    activity_ids_by_athlete = defaultdict(list)
+    for athlete_id, activity_id in athlete_activity_ids:
+        # a single athlete configured without an id owns every activity
+        if None in athletes:
+            athlete_id = None
+        activity_ids_by_athlete[athlete_id].append(activity_id)
+    for athlete_id in set(activity_ids_by_athlete) - set(athletes):
+        activity_ids = activity_ids_by_athlete.pop(athlete_id)
+        print(
+            f"Skipping the streams of {len(activity_ids)} activities of athlete "
+            f"{athlete_id}, who is no longer configured."
+        )
+    batch = fetch_athletes_activity_streams(
+        activity_ids_by_athlete,
+        {
+            athlete_id: ctx.strava_header(athletes[athlete_id])
+            for athlete_id in activity_ids_by_athlete
+        },
+        rate_limiter,
+        load_athlete_limits(config),
+        config.getint("strava_streams_config", "max_concurrency", fallback=10),
+        url,
+    )
+    if not len(batch):
+        return 0
+    store_dir = config.get(
+        "strava_streams_config", "store_dir", fallback=STREAM_STORE_DIR
+    )
+    StreamStore(store_dir).append(batch)
+    max_heartrate = config.getfloat(
+        "strava_streams_config", "max_heartrate", fallback=DEFAULT_MAX_HEARTRATE
+    )
+    bucket_name = config.get("aws_boto_credentials", "bucket_name")
+    _, role_string = ctx.s3_and_iam_details()
+    for table_name, rows in compute_activity_metrics(batch, max_heartrate).items():
+        metrics_file_path = save_metrics_to_csv(table_name, rows)
+        ctx.s3().upload_file(metrics_file_path, bucket_name, metrics_file_path)
+        s3_file_path = f"s3://{bucket_name}/{metrics_file_path}"
+        load_details_to_redshift(ctx.redshift(), s3_file_path, role_string, table_name)
+    return len(batch)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python ingest_activity_streams.py s3://.../manifest.json")
+        exit(-1)
+    n_activities = ingest_activity_streams(
+        read_export_columns(sys.argv[1], ("athlete_id", "id"))
+    )
+    print(f"Stream metrics of {n_activities} activities loaded into Redshift!")
@@ -0,0 +1,208 @@
+import argparse
+import csv
+import glob
+import gzip
+import os
+import re
+import time
+
+from typing import List, Optional, Tuple
+
+from src.utilities.schema_utils import load_table_schema, parse_decimal_type
+
+LOCAL_DATA_DIR = "strava_data"
+DATA_MODELS_DIR = "sql/data_models"
+LOCAL_TABLE_NAME = "public.strava_activity_data"
+# the data models read the daily rollup of the activity table
+ROLLUP_TABLE_SCRIPTS = (
+    "sql/tables/create_activity_rollup_table.sql",
+    "sql/tables/populate_activity_rollup_table.sql",
+)
+# read-only models that can be queried straight from the exports
+ANALYTICS_MODELS = (
+    "monthly_statistics",
+    "yearly_statistics",
+    "average_kudos_by_workout",
+    "percentage_weekly_kudos_change",
+)
+
+
+def redshift_type_to_duckdb(col_type: str) -> str:
+    """Map a Redshift column type onto the DuckDB type that stores it the same way."""
+    if col_type.startswith(("DECIMAL", "NUMERIC")):
+        # Redshift defaults to DECIMAL(18, 0), DuckDB to DECIMAL(18, 3)
+        return "DECIMAL(%d, %d)" % parse_decimal_type(col_type)
+    if col_type.startswith("FLOAT"):
+        return "DOUBLE"
+    return col_type
+
+
+def connect_duckdb(database: str = ":memory:"):
+    """Connect to an embedded DuckDB database, in memory or in a local file."""
+    # duckdb is only needed for local analytics
+    import duckdb
+
+    return duckdb.connect(database)
+
+
+def _export_sort_key(path: str) -> Tuple[str, float, str]:
+    # split exports are partitioned by date, older exports prefixed with it
+    partition = re.search(r"date=(\d{4})-(\d{2})-(\d{2})", path)
+    if partition:
+        export_date = "_".join(partition.groups())
+    else:
+        export_date = os.path.basename(path)[:10]
+    return export_date, os.path.getmtime(path), path
+
+
+def find_export_files(data_dir: str = LOCAL_DATA_DIR) -> List[str]:
+    """List extraction exports, oldest first, in any of the export formats."""
+    paths = []
+    for pattern in (
+        "*_export_file.csv",
+        "*_export_file.csv.gz",
+        "*.parquet",
+        "date=*/run=*/part_*.csv.gz",
+        "date=*/run=*/part_*.parquet",
+    ):
+        paths.extend(glob.glob(os.path.join(data_dir, pattern)))
+    return sorted(paths, key=_export_sort_key)
+
+
+def _count_csv_columns(path: str) -> int:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as fp:
+        first_row = next(csv.reader(fp, delimiter="|"), [])
+    return len(first_row)
+
+
+def export_relation(path: str, schema: List[Tuple[str, str]]) -> Optional[str]:
+    """SQL reading one export file with the columns named after the schema."""
+    quoted_path = path.replace("'", "''")
+    # split exports live under date=/run= prefixes, which aren't columns
+    if path.endswith(".parquet"):
+        return f"read_parquet('{quoted_path}', hive_partitioning=false)"
+    n_columns = _count_csv_columns(path)
+    if n_columns == 0:
+        return None
+    # exports written before a column was added simply lack its trailing field
+    columns = ", ".join(
+        f"'{name}': '{redshift_type_to_duckdb(col_type)}'"
+        for name, col_type in schema[:n_columns]
+    )
+    return (
+        f"read_csv('{quoted_path}', delim='|', header=false, quote='\"', "
+        f"escape='\"', auto_detect=false, columns={{{columns}}}, "
+        "timestampformat='%Y-%m-%d %H:%M:%S', hive_partitioning=false)"
+    )
+
+
+def load_local_exports(
+    conn, data_dir: str = LOCAL_DATA_DIR, table_name: str = LOCAL_TABLE_NAME
+) -> int:
+    """
+    (Re)build a local columnar copy of the production table from the export
+    files in data_dir. Like the warehouse merge, an activity exported more
+    than once keeps the values of its latest export. Loading the production
+    table name also rebuilds the daily rollup the data models read from.
+    :return: number of activities loaded
+    """
+    schema = load_table_schema()
+    column_definitions = ", ".join(
+        f'"{name}" {redshift_type_to_duckdb(col_type)}' for name, col_type in schema
+    )
+    schema_name = table_name.split(".")[0] if "." in table_name else "main"
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
+    conn.execute(f"""CREATE TEMP TABLE exported_activities
+        ({column_definitions}, export_order INTEGER);""")
+    for export_order, path in enumerate(find_export_files(data_dir)):
+        relation = export_relation(path, schema)
+        if relation is None:
+            continue
+        conn.execute(f"""INSERT INTO exported_activities BY NAME
+            SELECT *, {export_order} AS export_order FROM {relation};""")
+    columns = ", ".join(f'"{name}"' for name, _ in schema)
+    conn.execute(f"""CREATE OR REPLACE TABLE {table_name} AS
+        SELECT {columns} FROM exported_activities
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY export_order DESC) = 1
+        ORDER BY start_date;""")
+    conn.execute("DROP TABLE exported_activities;")
+    if table_name == LOCAL_TABLE_NAME:
+        for script in ROLLUP_TABLE_SCRIPTS:
+            with open(script, "r") as sql_file:
+                conn.execute(sql_file.read())
+    return conn.execute(f"SELECT COUNT(*) FROM {table_name};").fetchone()[0]
+
+
+def local_table_exists(conn, table_name: str = LOCAL_TABLE_NAME) -> bool:
+    """Whether a persistent local database already holds the activity table."""
+    schema_name, _, name = table_name.rpartition(".")
+    return bool(
+        conn.execute(
+            """SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = ? AND table_name = ?;""",
+            [schema_name or "main", name],
+        ).fetchone()[0]
+    )
+
+
+def run_data_model(conn, model: str) -> Tuple[List[str], List[tuple]]:
+    """
+    Run one of the sql/data_models queries against the local database.
+    :param model: model name such as monthly_statistics, or a path to a .sql file
+    :return: column names and result rows
+    """
+    sql_script_path = model
+    if not model.endswith(".sql"):
+        sql_script_path = os.path.join(DATA_MODELS_DIR, f"{model}.sql")
+    with open(sql_script_path, "r") as sql_file:
+        cursor = conn.execute(sql_file.read())
+    columns = [description[0] for description in cursor.description]
+    return columns, cursor.fetchall()
+
+
+def format_results(columns: List[str], rows: List[tuple]) -> str:
+    """Format query results as a pipe-delimited table."""
+    lines = [" | ".join(columns)]
+    lines.extend(" | ".join(str(value) for value in row) for row in rows)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Run the data models over the local exports with DuckDB."
+    )
+    arg_parser.add_argument(
+        "models",
+        nargs="*",
+        default=list(ANALYTICS_MODELS),
+        help="model names in sql/data_models or paths to .sql files",
+    )
+    arg_parser.add_argument("--data-dir", default=LOCAL_DATA_DIR)
+    arg_parser.add_argument(
+        "--database",
+        default=":memory:",
+        help="DuckDB file to keep a local columnar copy of the exports in",
+    )
+    arg_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="reload the exports into an existing --database file",
+    )
+    args = arg_parser.parse_args()
+
+    conn = connect_duckdb(args.database)
+    start = time.perf_counter()
+    if args.refresh or not local_table_exists(conn):
+        n_activities = load_local_exports(conn, args.data_dir)
+        print(
+            f"Loaded {n_activities} activities from {args.data_dir} "
+            f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+    for model in args.models:
+        start = time.perf_counter()
+        columns, rows = run_data_model(conn, model)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n{model} ({len(rows)} rows in {elapsed:.1f} ms)")
+        print(format_results(columns, rows))
+    conn.close()
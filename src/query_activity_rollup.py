@@ -0,0 +1,164 @@
+import argparse
+import math
+
+from datetime import date, timedelta
+from typing import List, NamedTuple, Optional
+
+from src.redshift_staging_to_production import ACTIVITY_ROLLUP_TABLE
+from src.utilities.pipeline_context import get_pipeline_context
+
+# period each grain truncates the rollup dates to, Monday-based weeks
+ROLLUP_GRAINS = ("week", "month", "year")
+METERS_PER_MILE = 1609
+
+
+class RollupSummary(NamedTuple):
+    """Activity totals and kudos statistics of one period."""
+
+    period: date
+    activity_count: int
+    miles: float
+    moving_time_hours: float
+    elevation_gain_meters: float
+    avg_kudos: Optional[float]
+    std_kudos: Optional[float]
+    avg_speed: Optional[float]
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _summarize(row: tuple) -> RollupSummary:
+    (
+        period,
+        activity_count,
+        distance_sum,
+        moving_time_sum,
+        elevation_gain_sum,
+        kudos_n,
+        kudos_sum,
+        kudos_sum_sq,
+        average_speed_n,
+        average_speed_sum,
+    ) = row
+    avg_kudos = std_kudos = avg_speed = None
+    if kudos_n:
+        avg_kudos = float(kudos_sum) / float(kudos_n)
+    if kudos_n and kudos_n > 1:
+        # sample standard deviation, matching STDDEV over the fact table
+        variance = (float(kudos_sum_sq) - float(kudos_sum) * avg_kudos) / (
+            float(kudos_n) - 1
+        )
+        std_kudos = math.sqrt(max(variance, 0.0))
+    if average_speed_n:
+        avg_speed = float(average_speed_sum) / float(average_speed_n)
+    return RollupSummary(
+        period,
+        int(activity_count),
+        float(distance_sum or 0) / METERS_PER_MILE,
+        float(moving_time_sum or 0) / (60 * 60),
+        float(elevation_gain_sum or 0),
+        avg_kudos,
+        std_kudos,
+        avg_speed,
+    )
+
+
+def query_activity_rollup(
+    rs_conn,
+    grain: str = "month",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    activity_type: Optional[str] = "Run",
+    workout_type: Optional[str] = None,
+) -> List[RollupSummary]:
+    """
+    Summarize activities per week, month or year from the daily rollup, so the
+    query cost depends on the number of days, not the number of activities.
+    :param start: first date to include
+    :param end: last date to include
+    :param activity_type: activity type to keep, None for every type
+    :param workout_type: workout type to keep, None for every workout type
+    :return: one summary per period with activities, oldest first
+    """
+    if grain not in ROLLUP_GRAINS:
+        raise ValueError(f"Unknown rollup grain: {grain}")
+    filters = ["TRUE"]
+    if start is not None:
+        filters.append(f"activity_date >= '{start.isoformat()}'")
+    if end is not None:
+        filters.append(f"activity_date <= '{end.isoformat()}'")
+    if activity_type is not None:
+        filters.append(f"type = {_sql_literal(activity_type)}")
+    if workout_type is not None:
+        filters.append(f"workout_type = {_sql_literal(workout_type)}")
+    cur = rs_conn.cursor()
+    cur.execute(f"""
+        SELECT DATE_TRUNC('{grain}', activity_date) AS period,
+            SUM(activity_count),
+            SUM(distance_sum),
+            SUM(moving_time_sum),
+            SUM(elevation_gain_sum),
+            SUM(kudos_n),
+            SUM(kudos_sum),
+            SUM(kudos_sum_sq),
+            SUM(average_speed_n),
+            SUM(average_speed_sum)
+        FROM {ACTIVITY_ROLLUP_TABLE}
+        WHERE {" AND ".join(filters)}
+        GROUP BY period
+        ORDER BY period;""")
+    return [_summarize(row) for row in cur.fetchall()]
+
+
+def summarize_week(
+    rs_conn, day: date, activity_type: Optional[str] = "Run"
+) -> Optional[RollupSummary]:
+    """Summary of the Monday-based week holding day, None if it has no activities."""
+    monday = day - timedelta(days=day.weekday())
+    summaries = query_activity_rollup(
+        rs_conn, "week", monday, monday + timedelta(days=6), activity_type
+    )
+    return summaries[0] if summaries else None
+
+
+def summarize_month(
+    rs_conn, year: int, month: int, activity_type: Optional[str] = "Run"
+) -> Optional[RollupSummary]:
+    """Summary of one calendar month, None if it has no activities."""
+    first_day = date(year, month, 1)
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    summaries = query_activity_rollup(
+        rs_conn, "month", first_day, next_month - timedelta(days=1), activity_type
+    )
+    return summaries[0] if summaries else None
+
+
+def summarize_year(
+    rs_conn, year: int, activity_type: Optional[str] = "Run"
+) -> Optional[RollupSummary]:
+    """Summary of one calendar year, None if it has no activities."""
+    summaries = query_activity_rollup(
+        rs_conn, "year", date(year, 1, 1), date(year, 12, 31), activity_type
+    )
+    return summaries[0] if summaries else None
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Summarize activities per period from the daily rollup."
+    )
+    arg_parser.add_argument("grain", choices=ROLLUP_GRAINS)
+    arg_parser.add_argument("--start", type=date.fromisoformat, default=None)
+    arg_parser.add_argument("--end", type=date.fromisoformat, default=None)
+    arg_parser.add_argument(
+        "--type", default="Run", help="activity type, 'all' for every type"
+    )
+    args = arg_parser.parse_args()
+    activity_type = None if args.type == "all" else args.type
+    rs_conn = get_pipeline_context().redshift()
+    for summary in query_activity_rollup(
+        rs_conn, args.grain, args.start, args.end, activity_type
+    ):
+        print(summary)
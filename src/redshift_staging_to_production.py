@@ -1,28 +1,207 @@
-import configparser
+from typing import NamedTuple
 
-from src.utilities.redshift_utils import connect_redshift
+from src.copy_to_redshift_staging import STAGING_TABLE
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import get_pipeline_context
+from src.utilities.schema_utils import load_table_schema
 
+WEEKLY_STATS_TABLE = "public.strava_weekly_stats"
+ACTIVITY_ROLLUP_TABLE = "public.strava_activity_rollup_daily"
+PENDING_MODEL_MONTHS_TABLE = "public.pending_model_months"
 
-def redshift_staging_to_production(table_name: str, rs_conn) -> None:
-    """Copy data from Redshift staging table to production table."""
-    # if id already exists in table, we remove it and add new id record during load
-    delete_from_table = f"DELETE FROM {table_name} USING staging_table WHERE '{table_name}'.id = staging_table.id;"
-    insert_into_table = f"INSERT INTO {table_name} SELECT * FROM staging_table;"
-    drop_temp_table = "DROP TABLE staging_table;"
+
+class MergeCounts(NamedTuple):
+    inserted: int
+    updated: int
+    unchanged: int
+
+
+@instrumented("merge")
+def redshift_staging_to_production(
+    table_name: str,
+    rs_conn,
+    weekly_stats_table: str = WEEKLY_STATS_TABLE,
+    pending_model_months_table: str = PENDING_MODEL_MONTHS_TABLE,
+    activity_rollup_table: str = ACTIVITY_ROLLUP_TABLE,
+    staging_table: str = STAGING_TABLE,
+    lock_tables: bool = True,
+) -> MergeCounts:
+    """
+    Merge the Redshift staging table into the production table. New ids are
+    inserted, existing rows are only updated when their content_hash differs,
+    and identical rows are left untouched, so a re-extracted batch doesn't
+    rewrite rows that haven't changed. In the same transaction, refresh the
+    weekly aggregates of every week the changes touched, so the z-score
+    validations never rescan the full history, or fill them from the whole
+    production table if they're still empty, refresh the daily rollup the
+    data models read from on every touched date, or fill it from the whole
+    production table if it's still empty, and queue the touched months for
+    the incremental data model build.
+    :param staging_table: the run's staging table, dropped once merged
+    :param lock_tables: lock the tables the merge writes first, so concurrent
+        promotes queue behind each other instead of failing on serializable
+        isolation conflicts (the local DuckDB warehouse has no LOCK)
+    :return: number of inserted, updated and unchanged activities
+    """
+    columns = [name for name, _ in load_table_schema()]
+    lock_written_tables = f"""
+        LOCK {table_name}, {weekly_stats_table}, {activity_rollup_table},
+            {pending_model_months_table};"""
+    # staged rows that are new or differ from production, NULL hashes predate
+    # the content_hash column and are always rewritten
+    create_staging_changes = f"""
+        CREATE TEMP TABLE staging_changes AS
+        SELECT s.id, p.id IS NULL AS is_new, p.start_date AS old_start_date
+        FROM {staging_table} s LEFT JOIN {table_name} p ON p.id = s.id
+        WHERE p.id IS NULL
+            OR p.content_hash IS NULL
+            OR p.content_hash <> s.content_hash;"""
+    count_changes = f"""
+        SELECT COUNT(*),
+            (SELECT COUNT(*) FROM staging_changes WHERE is_new),
+            (SELECT COUNT(*) FROM staging_changes WHERE NOT is_new)
+        FROM {staging_table};"""
+    # dates of the changed rows, before and after the update
+    create_touched_dates = f"""
+        CREATE TEMP TABLE touched_dates AS
+        SELECT s.start_date::date AS activity_date
+        FROM {staging_table} s JOIN staging_changes c ON c.id = s.id
+        UNION
+        SELECT old_start_date::date AS activity_date
+        FROM staging_changes
+        WHERE NOT is_new;"""
+    create_touched_weeks = """
+        CREATE TEMP TABLE touched_weeks AS
+        SELECT DISTINCT DATE_TRUNC('week', activity_date) AS activity_week
+        FROM touched_dates;"""
+    set_columns = ", ".join(f'"{col}" = s."{col}"' for col in columns if col != "id")
+    update_changed_rows = f"""
+        UPDATE {table_name} SET {set_columns}
+        FROM {staging_table} s, staging_changes c
+        WHERE {table_name}.id = s.id AND c.id = s.id AND NOT c.is_new;"""
+    insert_new_rows = f"""
+        INSERT INTO {table_name}
+        SELECT s.* FROM {staging_table} s JOIN staging_changes c ON c.id = s.id
+        WHERE c.is_new;"""
+    drop_temp_table = f"DROP TABLE {staging_table};"
+    # recompute only the touched weeks, the range filter lets Redshift skip blocks
+    delete_weekly_stats = f"""
+        DELETE FROM {weekly_stats_table} USING touched_weeks
+        WHERE {weekly_stats_table}.activity_week = touched_weeks.activity_week;"""
+    weekly_stats_columns = """DATE_TRUNC('week', start_date::date) AS activity_week,
+            COUNT(*) AS activity_count,
+            COUNT(kudos_count) AS kudos_n,
+            COALESCE(SUM(kudos_count), 0) AS kudos_sum"""
+    insert_weekly_stats = f"""
+        INSERT INTO {weekly_stats_table}
+        SELECT {weekly_stats_columns}
+        FROM {table_name}
+        WHERE start_date >= (SELECT MIN(activity_week) FROM touched_weeks)
+            AND DATE_TRUNC('week', start_date::date) IN
+                (SELECT activity_week FROM touched_weeks)
+        GROUP BY activity_week;"""
+    # like the rollup, weekly stats that predate the table would otherwise
+    # only ever cover the weeks touched since, skewing the z-score history
+    check_weekly_stats_is_empty = f"""
+        SELECT COUNT(*) = 0
+        FROM (SELECT 1 FROM {weekly_stats_table} LIMIT 1) AS weekly_stats_rows;"""
+    populate_weekly_stats = f"""
+        INSERT INTO {weekly_stats_table}
+        SELECT {weekly_stats_columns}
+        FROM {table_name}
+        WHERE start_date IS NOT NULL
+        GROUP BY activity_week;"""
+    delete_rollup = f"""
+        DELETE FROM {activity_rollup_table} USING touched_dates
+        WHERE {activity_rollup_table}.activity_date = touched_dates.activity_date;"""
+    rollup_columns = """start_date::date AS activity_date,
+            type,
+            workout_type,
+            COUNT(*) AS activity_count,
+            SUM(distance) AS distance_sum,
+            SUM(moving_time) AS moving_time_sum,
+            SUM(total_elevation_gain) AS elevation_gain_sum,
+            COUNT(athlete_count) AS athlete_count_n,
+            SUM(athlete_count) AS athlete_count_sum,
+            COUNT(kudos_count) AS kudos_n,
+            SUM(kudos_count) AS kudos_sum,
+            SUM(kudos_count * kudos_count) AS kudos_sum_sq,
+            COUNT(average_speed) AS average_speed_n,
+            SUM(average_speed) AS average_speed_sum"""
+    insert_rollup = f"""
+        INSERT INTO {activity_rollup_table}
+        SELECT {rollup_columns}
+        FROM {table_name}
+        WHERE start_date >= (SELECT MIN(activity_date) FROM touched_dates)
+            AND start_date::date IN (SELECT activity_date FROM touched_dates)
+        GROUP BY activity_date, type, workout_type;"""
+    # the rollup of a deployment that predates it starts out empty, filling only
+    # the touched dates would leave every other day out of the data models
+    check_rollup_is_empty = f"""
+        SELECT COUNT(*) = 0
+        FROM (SELECT 1 FROM {activity_rollup_table} LIMIT 1) AS rollup_rows;"""
+    populate_rollup = f"""
+        INSERT INTO {activity_rollup_table}
+        SELECT {rollup_columns}
+        FROM {table_name}
+        WHERE start_date IS NOT NULL
+        GROUP BY activity_date, type, workout_type;"""
+    queue_touched_months = f"""
+        INSERT INTO {pending_model_months_table}
+        SELECT DISTINCT DATE_TRUNC('month', activity_date) AS activity_month
+        FROM touched_dates;"""
+    drop_touched_tables = """
+        DROP TABLE touched_weeks;
+        DROP TABLE touched_dates;
+        DROP TABLE staging_changes;"""
     # execute queries
     cur = rs_conn.cursor()
-    cur.execute(delete_from_table)
-    cur.execute(insert_into_table)
+    if lock_tables:
+        cur.execute(lock_written_tables)
+    cur.execute(create_staging_changes)
+    cur.execute(count_changes)
+    n_staged, n_inserted, n_updated = cur.fetchone()
+    counts = MergeCounts(n_inserted, n_updated, n_staged - n_inserted - n_updated)
+    cur.execute(create_touched_dates)
+    cur.execute(create_touched_weeks)
+    cur.execute(check_weekly_stats_is_empty)
+    weekly_stats_is_empty = cur.fetchone()[0]
+    cur.execute(check_rollup_is_empty)
+    rollup_is_empty = cur.fetchone()[0]
+    # skip the writes entirely when the batch holds nothing new
+    if n_inserted or n_updated:
+        cur.execute(update_changed_rows)
+        cur.execute(insert_new_rows)
+        if weekly_stats_is_empty:
+            cur.execute(populate_weekly_stats)
+        else:
+            cur.execute(delete_weekly_stats)
+            cur.execute(insert_weekly_stats)
+        if rollup_is_empty:
+            cur.execute(populate_rollup)
+        else:
+            cur.execute(delete_rollup)
+            cur.execute(insert_rollup)
+        cur.execute(queue_touched_months)
+    cur.execute(drop_touched_tables)
     cur.execute(drop_temp_table)
     rs_conn.commit()
+    metrics = get_run_metrics()
+    metrics.incr("merge", "rows", n_staged)
+    for counter, value in counts._asdict().items():
+        metrics.incr("merge", counter, value)
+    print(
+        f"Merged staging into {table_name}: {counts.inserted} inserted, "
+        f"{counts.updated} updated, {counts.unchanged} unchanged."
+    )
+    return counts
 
 
 if __name__ == "__main__":
     # get redshift table name
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
-    table_name = parser.get("aws_redshift_creds", "table_name")
+    ctx = get_pipeline_context()
+    table_name = ctx.config.get("aws_redshift_creds", "table_name")
     # copy redshift staging table to production table
     table_name = "public.strava_activity_data"
-    rs_conn = connect_redshift()
+    rs_conn = ctx.redshift()
     redshift_staging_to_production(table_name, rs_conn)
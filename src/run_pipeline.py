@@ -0,0 +1,405 @@
+import argparse
+import json
+import os
+import time
+
+from graphlib import TopologicalSorter
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from src.utilities.metrics_utils import RunMetrics, get_run_metrics, start_run_metrics
+from src.utilities.pipeline_context import PipelineContext, get_pipeline_context
+
+RUN_REPORT_PATH = "metrics/run_report.json"
+PROMETHEUS_TEXTFILE_PATH = "metrics/strava_pipeline.prom"
+# state of a run whose batch was extracted but not yet fully loaded
+RUN_STATE_PATH = ".strava_pipeline_run.json"
+
+
+class ValidationError(Exception):
+    """Raised when a validation check with severity 'halt' fails."""
+
+
+# Each step is imported lazily, so a run only pays for the SDKs it uses and
+# pays for them once, instead of once per interpreter as with BashOperators.
+def extract_step(ctx: PipelineContext, state: dict) -> bool:
+    """
+    Extract new Strava activities of every configured athlete, plus those in
+    the trailing re-sync window, and upload the new and changed ones to s3.
+    Then move each athlete's watermark up to their newest activity. A replay
+    re-parses the raw response cache instead, without calling the API. Either
+    way the activities are checked in-stream, duplicate and invalid ones are
+    quarantined to a rejects file and the rest go on to be uploaded.
+    """
+    from itertools import chain
+
+    from src.extract_strava_data import (
+        ACTIVITY_HASHES_PATH,
+        EXTRACT_CHECKPOINT_PATH,
+        commit_extraction,
+        export_activities_to_s3,
+        extract_athletes_activities,
+        filter_changed_activities,
+        get_athlete_watermarks,
+        load_activity_hashes,
+        load_athlete_limits,
+        load_resync_window,
+        new_activity_ids,
+        replay_raw_activities,
+        save_activity_hashes,
+    )
+    from src.utilities.metrics_utils import get_run_metrics
+    from src.utilities.raw_cache_utils import load_raw_cache
+    from src.utilities.strava_api_utils import load_strava_athletes
+    from src.validate_extracted_activities import (
+        load_batch_validator,
+        report_batch_quality,
+    )
+    from src.validator import suite_should_halt
+
+    def validated(activities):
+        validator = load_batch_validator(ctx.config, ctx.redshift())
+        if validator is None:
+            return list(activities)
+        activities = list(validator.check(activities))
+        check_results = report_batch_quality(
+            validator, ctx.config.get("slack_config", "webhook_url")
+        )
+        if suite_should_halt(check_results):
+            failed = [r.name for r in check_results if not r.passed]
+            raise ValidationError(f"Batch rejected by checks: {', '.join(failed)}")
+        return activities
+
+    raw_cache = load_raw_cache(ctx.config, ctx.s3())
+    bucket_name = ctx.config.get("aws_boto_credentials", "bucket_name")
+    n_parts = ctx.config.getint("aws_redshift_creds", "export_parts", fallback=4)
+    if state.get("replay"):
+        if raw_cache is None:
+            raise ValueError("Replay needs [strava_raw_cache_config] enabled")
+        # reprocess the cached history, the watermarks and hashes stay as they are
+        all_activities = validated(replay_raw_activities(raw_cache))
+        state["n_activities"] = len(all_activities)
+        state["activity_ids"] = []
+        state["manifest_path"] = export_activities_to_s3(
+            all_activities, ctx.s3(), bucket_name, state["export_format"], n_parts
+        )
+        return bool(all_activities)
+
+    mysql_conn = ctx.mysql()
+    athletes = load_strava_athletes(ctx.config)
+    watermarks = get_athlete_watermarks([a.athlete_id for a in athletes], mysql_conn)
+    # a retried run resumes from the checkpoints instead of starting over
+    checkpoint_path = ctx.config.get(
+        "strava_api_config", "checkpoint_path", fallback=EXTRACT_CHECKPOINT_PATH
+    )
+    resync_window = load_resync_window(ctx.config)
+    results = extract_athletes_activities(
+        watermarks,
+        {a.athlete_id: ctx.strava_header(a) for a in athletes},
+        athlete_limits=load_athlete_limits(ctx.config),
+        max_workers=ctx.config.getint(
+            "strava_api_config", "max_athlete_workers", fallback=4
+        ),
+        checkpoint_path=checkpoint_path,
+        resync_window=resync_window,
+        raw_cache=raw_cache,
+    )
+    # re-synced activities are only staged when their content hash changed
+    hashes_path = ctx.config.get(
+        "strava_api_config", "hashes_path", fallback=ACTIVITY_HASHES_PATH
+    )
+    hashes = load_activity_hashes(hashes_path)
+    all_activities = validated(
+        filter_changed_activities(chain.from_iterable(results.values()), hashes)
+    )
+    state["n_activities"] = len(all_activities)
+    # streams don't change after upload, only new activities need fetching
+    state["activity_ids"] = new_activity_ids(results, watermarks)
+    # the stage step loads exactly the parts of this run through the manifest
+    state["manifest_path"] = export_activities_to_s3(
+        all_activities, ctx.s3(), bucket_name, state["export_format"], n_parts
+    )
+    # finished checkpoints are cleared even when there was nothing new, or the
+    # next run would resume from them and never fetch anything
+    for athlete_id in watermarks:
+        commit_extraction(checkpoint_path, mysql_conn, athlete_id)
+    save_activity_hashes(hashes, hashes_path, min(watermarks.values()) - resync_window)
+    if raw_cache is not None:
+        raw_cache.flush(get_run_metrics().run_id)
+    # nothing new or changed to load, skip the rest of the pipeline
+    return bool(all_activities)
+
+
+def stage_step(ctx: PipelineContext, state: dict) -> None:
+    """
+    Copy the parts of this run's s3 export into the run's own staging table,
+    after dropping the staging tables crashed runs left behind.
+    """
+    from src.copy_to_redshift_staging import (
+        COPY_OPTIONS,
+        copy_to_redshift_staging,
+        drop_stale_staging_tables,
+    )
+    from src.extract_strava_data import EXPORT_PART_FORMATS
+
+    _, role_string = ctx.s3_and_iam_details()
+    rs_conn = ctx.redshift()
+    for name in drop_stale_staging_tables(rs_conn):
+        print(f"Dropped stale staging table {name}")
+    copy_to_redshift_staging(
+        state["table_name"],
+        rs_conn,
+        state["manifest_path"],
+        role_string,
+        COPY_OPTIONS[EXPORT_PART_FORMATS[state["export_format"]]],
+        manifest=True,
+        staging_table=state["staging_table"],
+    )
+
+
+def validate_step(ctx: PipelineContext, state: dict) -> None:
+    """
+    Run the validation suite against the run's staging table, halting on
+    critical failures.
+    """
+    from src.utilities.redshift_utils import connect_redshift
+    from src.validator import run_validation_suite_with_digest, suite_should_halt
+
+    check_results = run_validation_suite_with_digest(
+        lambda: connect_redshift(ctx.config),
+        ctx.config.get("slack_config", "webhook_url"),
+        staging_table=state["staging_table"],
+    )
+    if suite_should_halt(check_results):
+        failed = [r.name for r in check_results if not r.passed]
+        raise ValidationError(
+            f"Validation checks failed on {state['staging_table']}: "
+            f"{', '.join(failed)}"
+        )
+
+
+def promote_step(ctx: PipelineContext, state: dict) -> None:
+    """Merge the run's staging table into production, locking the tables it writes."""
+    from src.redshift_staging_to_production import redshift_staging_to_production
+
+    state["merge_counts"] = redshift_staging_to_production(
+        state["table_name"], ctx.redshift(), staging_table=state["staging_table"]
+    )
+
+
+def model_step(ctx: PipelineContext, state: dict) -> None:
+    """Refresh the monthly data model for the months touched by this load."""
+    from src.build_data_model import build_monthly_data_model
+
+    build_monthly_data_model(ctx.redshift(), state["full_rebuild"])
+
+
+def tiles_step(ctx: PipelineContext, state: dict) -> None:
+    """Index new and changed routes and update the heatmap tiles they touch."""
+    from src.build_heatmap_tiles import update_heatmap_tiles
+
+    update_heatmap_tiles(state["table_name"], ctx)
+
+
+def streams_step(ctx: PipelineContext, state: dict) -> None:
+    """Store the streams of new activities and load the metrics derived from them."""
+    from src.ingest_activity_streams import ingest_activity_streams
+
+    ingest_activity_streams(state["activity_ids"], ctx)
+
+
+# step name -> (callable, upstream steps)
+PIPELINE_STEPS: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {
+    "extract": (extract_step, ()),
+    "stage": (stage_step, ("extract",)),
+    "validate": (validate_step, ("stage",)),
+    "promote": (promote_step, ("validate",)),
+    "model": (model_step, ("promote",)),
+    "tiles": (tiles_step, ("promote",)),
+    "streams": (streams_step, ("extract",)),
+}
+
+
+def load_run_state(run_state_path: str) -> Optional[dict]:
+    """Load the state of an unfinished run, if there is one."""
+    try:
+        with open(run_state_path, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def save_run_state(state: dict, run_state_path: str) -> None:
+    """Save a run's state, atomically so a crash never corrupts it."""
+    tmp_path = f"{run_state_path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(state, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, run_state_path)
+
+
+def clear_run_state(run_state_path: str) -> None:
+    """Remove a run's state once every step has finished."""
+    if os.path.exists(run_state_path):
+        os.remove(run_state_path)
+
+
+def publish_run_metrics(metrics: RunMetrics, ctx: PipelineContext) -> None:
+    """Write the JSON run report and Prometheus textfile, and post a Slack summary."""
+    from src.validator import post_slack_message
+
+    metrics.write_json(
+        ctx.config.get("metrics_config", "report_path", fallback=RUN_REPORT_PATH)
+    )
+    metrics.write_prometheus(
+        ctx.config.get(
+            "metrics_config", "prometheus_textfile", fallback=PROMETHEUS_TEXTFILE_PATH
+        )
+    )
+    summary = metrics.format_summary()
+    print(summary)
+    post_slack_message(ctx.config.get("slack_config", "webhook_url"), summary)
+
+
+def run_pipeline(
+    steps: Optional[Iterable[str]] = None,
+    ctx: Optional[PipelineContext] = None,
+    export_format: str = "csv",
+    full_rebuild: bool = False,
+    publish_metrics: bool = False,
+    replay: bool = False,
+    staging_table: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Run pipeline steps in dependency order in this process, sharing one
+    PipelineContext (config and connections) between them. A step that
+    returns False skips every step downstream of it. The state of a run that
+    extracts is saved after every step, so when a later step fails the next
+    run, e.g. a retry of the task, resumes that batch from the failed step
+    instead of extracting again and finding nothing. A batch halted by
+    validation isn't resumed, it's left in its staging table for review.
+    :param steps: names of the steps to run, defaults to the whole pipeline
+    :param full_rebuild: rebuild the data model from scratch, not incrementally
+    :param publish_metrics: export the run's metrics once it ends, even if it fails
+    :param replay: extract from the raw response cache instead of the Strava API
+    :param staging_table: staging table to load, validate and promote, defaults
+        to a new table named after the run
+    :return: seconds taken by each step that ran
+    """
+    if ctx is None:
+        ctx = get_pipeline_context()
+    metrics = start_run_metrics()
+    try:
+        timings = _run_steps(
+            steps, ctx, export_format, full_rebuild, replay, staging_table
+        )
+    except BaseException:
+        metrics.finish("failed")
+        raise
+    else:
+        metrics.finish("success")
+    finally:
+        if publish_metrics:
+            publish_run_metrics(metrics, ctx)
+    return timings
+
+
+def _run_steps(
+    steps: Optional[Iterable[str]],
+    ctx: PipelineContext,
+    export_format: str,
+    full_rebuild: bool,
+    replay: bool = False,
+    staging_table: Optional[str] = None,
+) -> Dict[str, float]:
+    from src.copy_to_redshift_staging import staging_table_name
+
+    selected = set(PIPELINE_STEPS if steps is None else steps)
+    graph = {name: deps for name, (_, deps) in PIPELINE_STEPS.items()}
+    # runs loading a given staging table or skipping the extract manage their
+    # batch themselves
+    run_state_path = None
+    if "extract" in selected and staging_table is None:
+        run_state_path = ctx.config.get(
+            "pipeline_config", "run_state_path", fallback=RUN_STATE_PATH
+        )
+    state = load_run_state(run_state_path) if run_state_path else None
+    if state is not None:
+        print(
+            f"Resuming the batch in {state['staging_table']} after "
+            f"{', '.join(state['finished_steps'])}."
+        )
+    else:
+        state = {
+            "export_format": export_format,
+            "full_rebuild": full_rebuild,
+            "replay": replay,
+            "table_name": ctx.config.get("aws_redshift_creds", "table_name"),
+            # each run stages into its own table, so runs can load side by side
+            "staging_table": staging_table
+            or staging_table_name(get_run_metrics().run_id),
+            "finished_steps": [],
+        }
+    timings = {}
+    stopped = set()
+    for name in TopologicalSorter(graph).static_order():
+        step, deps = PIPELINE_STEPS[name]
+        if name not in selected or name in state["finished_steps"]:
+            continue
+        if stopped.intersection(deps):
+            stopped.add(name)
+            print(f"Skipping {name}, upstream step had nothing to do.")
+            continue
+        start = time.perf_counter()
+        try:
+            result = step(ctx, state)
+        except ValidationError:
+            if run_state_path:
+                clear_run_state(run_state_path)
+            raise
+        timings[name] = time.perf_counter() - start
+        print(f"Step {name} finished in {timings[name]:.2f}s")
+        if result is False:
+            stopped.add(name)
+        state["finished_steps"].append(name)
+        if run_state_path:
+            save_run_state(state, run_state_path)
+    if run_state_path:
+        clear_run_state(run_state_path)
+    return timings
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Run the Strava ELT pipeline in a single process."
+    )
+    arg_parser.add_argument(
+        "--steps",
+        nargs="+",
+        choices=list(PIPELINE_STEPS),
+        help="steps to run (default: all)",
+    )
+    arg_parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    arg_parser.add_argument(
+        "--full-rebuild", action="store_true", help="fully rebuild the data model"
+    )
+    arg_parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="reprocess the raw response cache instead of calling the Strava API",
+    )
+    arg_parser.add_argument(
+        "--staging-table",
+        help="existing staging table to validate or promote, e.g. a halted run's",
+    )
+    args = arg_parser.parse_args()
+    with get_pipeline_context() as ctx:
+        run_pipeline(
+            args.steps,
+            ctx,
+            args.format,
+            args.full_rebuild,
+            publish_metrics=True,
+            replay=args.replay,
+            staging_table=args.staging_table,
+        )
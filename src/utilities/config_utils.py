@@ -0,0 +1,13 @@
+import configparser
+
+from functools import lru_cache
+
+CONFIG_PATH = "pipeline.conf"
+
+
+@lru_cache(maxsize=None)
+def load_pipeline_config(config_path: str = CONFIG_PATH) -> configparser.ConfigParser:
+    """Read and parse the pipeline config once per process."""
+    parser = configparser.ConfigParser()
+    parser.read(config_path)
+    return parser
@@ -0,0 +1,158 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+POLYLINE_PRECISION = 1e5
+# web mercator zoom levels heatmap tiles are pre-aggregated at
+HEATMAP_ZOOM_LEVELS = (6, 8, 10, 12, 14)
+# each 256px tile is split into 16x16 bins of 16px
+BINS_PER_TILE = 16
+MAX_MERCATOR_LATITUDE = 85.0511287798
+# long straight segments are densified at most this many bins
+MAX_SEGMENT_STEPS = 4096
+
+
+def encode_polyline(coordinates: Sequence[Tuple[float, float]]) -> str:
+    """Encode (lat, lng) pairs with Google's encoded polyline algorithm."""
+    encoded = []
+    previous = (0, 0)
+    for lat, lng in coordinates:
+        point = (round(lat * POLYLINE_PRECISION), round(lng * POLYLINE_PRECISION))
+        for value, last in zip(point, previous):
+            delta = value - last
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                encoded.append(chr((0x20 | (delta & 0x1F)) + 63))
+                delta >>= 5
+            encoded.append(chr(delta + 63))
+        previous = point
+    return "".join(encoded)
+
+
+def decode_polylines(
+    polylines: Sequence[Optional[str]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decode many encoded polylines at once. Every character of every polyline
+    is decoded in a handful of NumPy passes, instead of looping over
+    characters in Python.
+    :return: offsets (points of polyline i are offsets[i]:offsets[i + 1]),
+        latitudes and longitudes
+    """
+    polylines = [polyline or "" for polyline in polylines]
+    lengths = np.fromiter(map(len, polylines), dtype=np.int64, count=len(polylines))
+    chunks = np.frombuffer("".join(polylines).encode("ascii"), dtype=np.uint8)
+    chunks = chunks.astype(np.int64) - 63
+    # each value is a run of 5 bit chunks, all but the last with the 0x20 bit set
+    value_ends = np.flatnonzero((chunks & 0x20) == 0)
+    value_starts = np.concatenate(([0], value_ends[:-1] + 1))
+    value_index = np.repeat(np.arange(len(value_ends)), value_ends - value_starts + 1)
+    shift = 5 * (np.arange(len(value_index)) - value_starts[value_index])
+    values = np.zeros(len(value_ends), dtype=np.int64)
+    if len(values):
+        values = np.add.reduceat(
+            (chunks[: len(value_index)] & 0x1F) << shift, value_starts
+        )
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # values alternate lat, lng and restart from zero with every polyline
+    char_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    value_offsets = np.searchsorted(value_ends, char_offsets)
+    offsets = value_offsets // 2
+    coordinates = np.cumsum(deltas[: 2 * offsets[-1]].reshape(-1, 2), axis=0)
+    starts = offsets[:-1]
+    base = np.zeros((len(polylines), 2), dtype=np.int64)
+    has_points = starts > 0
+    base[has_points] = coordinates[starts[has_points] - 1]
+    coordinates -= np.repeat(base, np.diff(offsets), axis=0)
+    coordinates = coordinates / POLYLINE_PRECISION
+    return offsets, coordinates[:, 0], coordinates[:, 1]
+
+
+def decode_polyline(polyline: str) -> List[Tuple[float, float]]:
+    """Decode one encoded polyline into (lat, lng) pairs."""
+    _, lat, lng = decode_polylines([polyline])
+    return list(zip(lat.tolist(), lng.tolist()))
+
+
+def lnglat_to_bins(
+    lat: np.ndarray, lng: np.ndarray, zoom: int, bins_per_tile: int = BINS_PER_TILE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Fractional web mercator bin coordinates of points at a zoom level."""
+    scale = (1 << zoom) * bins_per_tile
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE))
+    x = (np.asarray(lng) + 180.0) / 360.0 * scale
+    y = (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * scale
+    return x, y
+
+
+def route_cells(
+    offsets: np.ndarray,
+    lat: np.ndarray,
+    lng: np.ndarray,
+    zoom_levels: Sequence[int] = HEATMAP_ZOOM_LEVELS,
+    bins_per_tile: int = BINS_PER_TILE,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The heatmap bins every decoded route passes through, at every zoom level.
+
+    Summary polylines are simplified, so consecutive points can be many bins
+    apart at high zoom. Segments are densified to one point per bin at the
+    highest zoom level before binning, so routes leave a continuous trail.
+    :return: arrays of route index, zoom, bin_x and bin_y, one entry per
+        distinct (route, zoom, bin)
+    """
+    max_zoom = max(zoom_levels)
+    x, y = lnglat_to_bins(lat, lng, max_zoom, bins_per_tile)
+    route = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    segment = np.flatnonzero(route[1:] == route[:-1])
+    dx, dy = x[segment + 1] - x[segment], y[segment + 1] - y[segment]
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64)
+    steps = np.clip(steps, 1, MAX_SEGMENT_STEPS)
+    first_step = np.repeat(np.cumsum(steps) - steps, steps)
+    fraction = (np.arange(steps.sum()) - first_step) / np.repeat(steps, steps)
+    x = np.concatenate(
+        (x, np.repeat(x[segment], steps) + fraction * np.repeat(dx, steps))
+    )
+    y = np.concatenate(
+        (y, np.repeat(y[segment], steps) + fraction * np.repeat(dy, steps))
+    )
+    route = np.concatenate((route, np.repeat(route[segment], steps)))
+
+    max_bin = ((1 << max_zoom) * bins_per_tile) - 1
+    bin_x = np.clip(x.astype(np.int64), 0, max_bin)
+    bin_y = np.clip(y.astype(np.int64), 0, max_bin)
+    bits = max_bin.bit_length()
+    parts = []
+    for zoom in zoom_levels:
+        shift = max_zoom - zoom
+        keys = np.unique(
+            (route << (2 * bits)) | ((bin_x >> shift) << bits) | (bin_y >> shift)
+        )
+        mask = (1 << bits) - 1
+        parts.append(
+            (
+                keys >> (2 * bits),
+                np.full(len(keys), zoom),
+                (keys >> bits) & mask,
+                keys & mask,
+            )
+        )
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def bbox_to_bin_range(
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    zoom: int,
+    bins_per_tile: int = BINS_PER_TILE,
+) -> Tuple[int, int, int, int]:
+    """Inclusive (min_x, min_y, max_x, max_y) range of bins covering a box."""
+    x, y = lnglat_to_bins(
+        np.array([max_lat, min_lat]), np.array([min_lng, max_lng]), zoom, bins_per_tile
+    )
+    # y grows southwards, so the box's north edge has the smaller y
+    return int(x[0]), int(y[0]), int(x[1]), int(y[1])
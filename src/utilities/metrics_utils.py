@@ -0,0 +1,201 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, Optional
+
+METRICS_PREFIX = "strava_pipeline"
+# counters whose rate is worth reporting, e.g. rows per second through COPY
+RATE_COUNTERS = ("rows", "bytes")
+
+
+class StageMetrics:
+    """Timings and counters recorded for one pipeline stage."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.failed = False
+        self.counters: Dict[str, float] = {}
+        # counters are incremented from extraction threads
+        self._lock = threading.Lock()
+
+    def incr(self, counter: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self) -> dict:
+        report = {
+            "calls": self.calls,
+            "seconds": round(self.seconds, 6),
+            "failed": self.failed,
+            "counters": dict(self.counters),
+        }
+        for counter in RATE_COUNTERS:
+            if counter in self.counters and self.seconds > 0:
+                report[f"{counter}_per_second"] = round(
+                    self.counters[counter] / self.seconds, 3
+                )
+        return report
+
+
+class RunMetrics:
+    """
+    Lightweight instrumentation for one pipeline run.
+
+    Entry points record into named stages with `stage()` (or the
+    `instrumented` decorator) and `incr()`. Once the run is over the stages
+    are exported as a JSON run report, a Prometheus textfile for
+    node_exporter's textfile collector and a short Slack summary.
+    """
+
+    def __init__(self, run_id: Optional[str] = None, clock=time.perf_counter) -> None:
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = datetime.now(timezone.utc)
+        self.clock = clock
+        self.status = "running"
+        self.stages: Dict[str, StageMetrics] = {}
+        self._start = clock()
+        self._end: Optional[float] = None
+
+    def get_stage(self, name: str) -> StageMetrics:
+        if name not in self.stages:
+            self.stages[name] = StageMetrics(name)
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """Time a block of work as (another call of) the named stage."""
+        stage = self.get_stage(name)
+        stage.calls += 1
+        start = self.clock()
+        try:
+            yield stage
+        except BaseException:
+            stage.failed = True
+            raise
+        finally:
+            stage.seconds += self.clock() - start
+
+    def incr(self, stage: str, counter: str, value: float = 1) -> None:
+        """Add value to a counter of the named stage."""
+        self.get_stage(stage).incr(counter, value)
+
+    def finish(self, status: str = "success") -> None:
+        self.status = status
+        self._end = self.clock()
+
+    @property
+    def seconds(self) -> float:
+        end = self.clock() if self._end is None else self._end
+        return end - self._start
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat(),
+            "status": self.status,
+            "seconds": round(self.seconds, 6),
+            "stages": {name: s.to_dict() for name, s in self.stages.items()},
+        }
+
+    def write_json(self, path: str) -> None:
+        """Write the JSON run report."""
+        _write_atomically(path, json.dumps(self.to_dict(), indent=2))
+
+    def to_prometheus(self) -> str:
+        """Render the run in the Prometheus text exposition format."""
+        run = f"{METRICS_PREFIX}_run"
+        lines = [
+            f"# HELP {run}_seconds Wall time of the last pipeline run.",
+            f"# TYPE {run}_seconds gauge",
+            f"{run}_seconds {self.seconds:.6f}",
+            f"# HELP {run}_success Whether the last pipeline run succeeded.",
+            f"# TYPE {run}_success gauge",
+            f"{run}_success {int(self.status == 'success')}",
+            f"# HELP {run}_timestamp_seconds When the last pipeline run started.",
+            f"# TYPE {run}_timestamp_seconds gauge",
+            f"{run}_timestamp_seconds {self.started_at.timestamp():.0f}",
+        ]
+        samples: Dict[str, list] = {"stage_seconds": [], "stage_calls": []}
+        for name, stage in self.stages.items():
+            label = f'{{stage="{name}"}}'
+            samples["stage_seconds"].append(f"{label} {stage.seconds:.6f}")
+            samples["stage_calls"].append(f"{label} {stage.calls}")
+            for counter, value in stage.counters.items():
+                metric = "stage_" + re.sub(r"[^a-zA-Z0-9_]", "_", counter)
+                samples.setdefault(metric, []).append(f"{label} {value:g}")
+        for metric, metric_samples in samples.items():
+            name = f"{METRICS_PREFIX}_{metric}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{name}{sample}" for sample in metric_samples)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Write a Prometheus textfile, replacing the previous run's atomically."""
+        _write_atomically(path, self.to_prometheus())
+
+    def format_summary(self) -> str:
+        """Summarise the run as one Slack message."""
+        lines = [
+            f"Strava pipeline run {self.run_id} {self.status} "
+            f"in {self.seconds:.1f}s"
+        ]
+        for name, stage in self.stages.items():
+            details = [f"{stage.seconds:.2f}s"]
+            details.extend(f"{k}={v:g}" for k, v in stage.counters.items())
+            if "rows" in stage.counters and stage.seconds > 0:
+                details.append(f"{stage.counters['rows'] / stage.seconds:,.0f} rows/s")
+            status = " FAILED" if stage.failed else ""
+            lines.append(f"{name}{status}: {', '.join(details)}")
+        return "\n".join(lines)
+
+
+def _write_atomically(path: str, text: str) -> None:
+    # the textfile collector may read at any time, so never expose a partial file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fp:
+        fp.write(text)
+    os.replace(tmp_path, path)
+
+
+_run_metrics: Optional[RunMetrics] = None
+
+
+def get_run_metrics() -> RunMetrics:
+    """Get the metrics of the current run, starting one if needed."""
+    global _run_metrics
+    if _run_metrics is None:
+        _run_metrics = RunMetrics()
+    return _run_metrics
+
+
+def start_run_metrics(run_id: Optional[str] = None) -> RunMetrics:
+    """Start recording a new run, replacing the current run's metrics."""
+    global _run_metrics
+    _run_metrics = RunMetrics(run_id)
+    return _run_metrics
+
+
+def instrumented(stage: str) -> Callable:
+    """Decorator timing every call of a function as the named stage."""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_run_metrics().stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
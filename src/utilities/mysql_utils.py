@@ -1,16 +1,21 @@
-import pymysql
 import configparser
 
+from typing import Optional
 
-def connect_mysql():
+from src.utilities.config_utils import load_pipeline_config
+
+
+def connect_mysql(parser: Optional[configparser.ConfigParser] = None):
     """Get the MySQL connection info and connect."""
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
+    if parser is None:
+        parser = load_pipeline_config()
     hostname = parser.get("mysql_config", "hostname")
     port = parser.get("mysql_config", "port")
     username = parser.get("mysql_config", "username")
     dbname = parser.get("mysql_config", "database")
     password = parser.get("mysql_config", "password")
+    # only import the driver when a connection is actually needed
+    import pymysql
 
     conn = pymysql.connect(
         host=hostname, user=username, password=password, db=dbname, port=int(port)
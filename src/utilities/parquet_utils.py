@@ -0,0 +1,109 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby
+from typing import Callable, List, Tuple
+
+from src.utilities.schema_utils import load_table_schema, parse_decimal_type
+
+
+def redshift_type_to_arrow(col_type: str) -> pa.DataType:
+    """Map a Redshift column type onto the Parquet type COPY expects for it."""
+    base_type = col_type.split("(")[0]
+    if base_type in ("VARCHAR", "CHAR", "TEXT"):
+        return pa.string()
+    if base_type in ("FLOAT", "FLOAT8", "DOUBLE"):
+        return pa.float64()
+    if base_type in ("REAL", "FLOAT4"):
+        return pa.float32()
+    if base_type in ("INTEGER", "INT", "INT4"):
+        return pa.int32()
+    if base_type in ("BIGINT", "INT8"):
+        return pa.int64()
+    if base_type in ("SMALLINT", "INT2"):
+        return pa.int16()
+    if base_type in ("DECIMAL", "NUMERIC"):
+        return pa.decimal128(*parse_decimal_type(col_type))
+    if base_type == "TIMESTAMP":
+        return pa.timestamp("us")
+    if base_type == "BOOLEAN":
+        return pa.bool_()
+    raise ValueError(f"Unsupported Redshift column type: {col_type}")
+
+
+def load_arrow_schema() -> pa.Schema:
+    """Build the Parquet schema of the activity table from its CREATE TABLE script."""
+    return pa.schema(
+        [
+            pa.field(name, redshift_type_to_arrow(col_type), nullable=True)
+            for name, col_type in load_table_schema()
+        ]
+    )
+
+
+def _value_converter(arrow_type: pa.DataType) -> Callable:
+    """Coerce raw API values (e.g. 177.0 for an INTEGER column) to the arrow type."""
+    if pa.types.is_string(arrow_type):
+        return str
+    if pa.types.is_integer(arrow_type):
+        return lambda value: int(round(value))
+    if pa.types.is_floating(arrow_type):
+        return float
+    if pa.types.is_decimal(arrow_type):
+        scale = arrow_type.scale
+        return lambda value: Decimal(str(round(value, scale))).quantize(
+            Decimal(1).scaleb(-scale)
+        )
+    return lambda value: value
+
+
+def _activity_month(activity: List, start_date_index: int) -> Tuple[int, int]:
+    start_date = activity[start_date_index]
+    if not isinstance(start_date, datetime):
+        return (0, 0)
+    return (start_date.year, start_date.month)
+
+
+def _activities_to_table(
+    activities: List[List], schema: pa.Schema, converters: List[Callable]
+) -> pa.Table:
+    columns = list(zip(*activities))
+    arrays = [
+        pa.array(
+            [None if value is None else convert(value) for value in column],
+            type=field.type,
+        )
+        for column, field, convert in zip(columns, schema, converters)
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_activities_to_parquet(
+    all_activities: List[List],
+    export_file_path: str,
+    min_row_group_rows: int = 10000,
+) -> None:
+    """
+    Write activities to a Parquet file typed by the Redshift table schema.
+    Row groups are partitioned by activity month: a row group never splits a
+    month, but consecutive small months are packed together until a group
+    holds min_row_group_rows, as tiny row groups cost more in metadata than
+    they save.
+    """
+    schema = load_arrow_schema()
+    converters = [_value_converter(field.type) for field in schema]
+    start_date_index = schema.get_field_index("start_date")
+    month_key = lambda activity: _activity_month(activity, start_date_index)
+    with pq.ParquetWriter(export_file_path, schema, compression="snappy") as writer:
+        row_group = []
+        for _, month_activities in groupby(
+            sorted(all_activities, key=month_key), month_key
+        ):
+            row_group.extend(month_activities)
+            if len(row_group) >= min_row_group_rows:
+                writer.write_table(_activities_to_table(row_group, schema, converters))
+                row_group = []
+        if row_group:
+            writer.write_table(_activities_to_table(row_group, schema, converters))
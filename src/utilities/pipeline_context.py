@@ -0,0 +1,106 @@
+import configparser
+import copy
+import threading
+
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from src.utilities.config_utils import CONFIG_PATH, load_pipeline_config
+
+
+class PipelineContext:
+    """
+    Config and connections shared by every step of a pipeline run.
+
+    pipeline.conf is parsed once and each client (MySQL, Redshift, S3) is
+    created on first use and reused afterwards, reconnecting only if the
+    connection has been closed. The SDKs are imported lazily so a step only
+    pays for the clients it actually uses.
+    """
+
+    def __init__(self, config_path: str = CONFIG_PATH) -> None:
+        self.config: configparser.ConfigParser = load_pipeline_config(config_path)
+        self._mysql_conn = None
+        self._redshift_conn = None
+        self._s3 = None
+        self._lock = threading.Lock()
+
+    def mysql(self):
+        """Get the shared MySQL connection."""
+        from src.utilities.mysql_utils import connect_mysql
+
+        with self._lock:
+            if self._mysql_conn is None or not self._mysql_conn.open:
+                self._mysql_conn = connect_mysql(self.config)
+            return self._mysql_conn
+
+    def redshift(self):
+        """Get the shared Redshift connection."""
+        from src.utilities.redshift_utils import connect_redshift
+
+        with self._lock:
+            if self._redshift_conn is None or self._redshift_conn.closed:
+                self._redshift_conn = connect_redshift(self.config)
+            return self._redshift_conn
+
+    def s3(self):
+        """Get the shared boto3 s3 client (boto3 clients are thread safe)."""
+        from src.utilities.s3_utils import connect_s3
+
+        with self._lock:
+            if self._s3 is None:
+                self._s3 = connect_s3(self.config)
+            return self._s3
+
+    def strava_header(self, athlete=None) -> Dict[str, str]:
+        """Get the Strava auth header, the access token is cached until it expires."""
+        from src.utilities.strava_api_utils import connect_strava
+
+        return connect_strava(self.config, athlete)
+
+    def s3_and_iam_details(
+        self, date: Optional[str] = None, file_extension: str = "csv"
+    ) -> Tuple[str, str]:
+        from src.utilities.redshift_utils import get_s3_and_iam_details
+
+        if date is None:
+            date = datetime.today().strftime("%Y_%m_%d")
+        return get_s3_and_iam_details(date, file_extension, self.config)
+
+    def fork(self) -> "PipelineContext":
+        """
+        A context sharing this one's config and s3 client, with database
+        connections of its own, for steps run concurrently in another thread.
+        """
+        ctx = copy.copy(self)
+        ctx._mysql_conn = ctx._redshift_conn = None
+        ctx._lock = threading.Lock()
+        return ctx
+
+    def close(self) -> None:
+        """Close any open connections."""
+        with self._lock:
+            for conn in (self._mysql_conn, self._redshift_conn):
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._mysql_conn = self._redshift_conn = None
+
+    def __enter__(self) -> "PipelineContext":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_pipeline_context: Optional[PipelineContext] = None
+
+
+def get_pipeline_context() -> PipelineContext:
+    """Get the process-wide pipeline context, creating it on first use."""
+    global _pipeline_context
+    if _pipeline_context is None:
+        _pipeline_context = PipelineContext()
+    return _pipeline_context
@@ -0,0 +1,241 @@
+import csv
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+RAW_CACHE_DIR = "strava_data/raw"
+INDEX_FILE_NAME = "index.csv"
+# page file extension of each supported compression
+PAGE_EXTENSIONS = {"gzip": "json.gz", "zstd": "json.zst"}
+
+
+class RawIndexEntry(NamedTuple):
+    """Where the raw payload of an activity fetched at one time is cached."""
+
+    activity_id: str
+    start_date: str
+    fetched_at: str
+    digest: str
+    position: int
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        # zstandard is optional, gzip needs nothing outside the standard library
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data: bytes, path: str) -> bytes:
+    if path.endswith(".zst"):
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class RawResponseCache:
+    """
+    Content-addressed store of raw Strava API pages.
+
+    Every page is saved compressed under the SHA-256 of its canonical JSON, so
+    re-fetching an unchanged page stores nothing new. An index line per
+    activity on a new page records which page and position holds its payload
+    and when it was fetched, so activities can be re-parsed from their latest
+    payload without any HTTP calls. With an s3 client, new pages are mirrored
+    to s3 as they are written and each run's index lines once it is flushed,
+    and a cache missing its index or pages locally reads them from the mirror.
+    """
+
+    def __init__(
+        self,
+        root: str = RAW_CACHE_DIR,
+        s3=None,
+        bucket_name: Optional[str] = None,
+        compression: str = "gzip",
+    ) -> None:
+        if compression not in PAGE_EXTENSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.root = root
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.compression = compression
+        self.pages_written = 0
+        self._pending_index: List[RawIndexEntry] = []
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.root, INDEX_FILE_NAME)
+
+    def page_path(self, digest: str, compression: Optional[str] = None) -> str:
+        extension = PAGE_EXTENSIONS[compression or self.compression]
+        return os.path.join(self.root, "pages", digest[:2], f"{digest}.{extension}")
+
+    def _find_page(self, digest: str) -> Optional[str]:
+        for compression in PAGE_EXTENSIONS:
+            path = self.page_path(digest, compression)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _list_mirrored_keys(self, prefix: str) -> Iterator[str]:
+        kwargs = {"Bucket": self.bucket_name, "Prefix": prefix}
+        while True:
+            response = self.s3.list_objects_v2(**kwargs)
+            for s3_object in response.get("Contents", []):
+                yield s3_object["Key"]
+            if not response.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def _download(self, key: str, path: str) -> None:
+        body = self.s3.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(body)
+        os.replace(tmp_path, path)
+
+    def _fetch_mirrored_page(self, digest: str) -> Optional[str]:
+        """Download a page missing locally from the s3 mirror, if it's there."""
+        if self.s3 is None:
+            return None
+        for compression in PAGE_EXTENSIONS:
+            path = self.page_path(digest, compression)
+            if path in set(self._list_mirrored_keys(path)):
+                self._download(path, path)
+                return path
+        return None
+
+    def restore_index(self) -> int:
+        """
+        Rebuild the local index from the index lines every run mirrored to s3,
+        e.g. to replay on a machine that didn't run the extractions.
+        :return: number of index files read
+        """
+        keys = sorted(self._list_mirrored_keys(f"{self.root}/index/"))
+        lines = b"".join(
+            self.s3.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+            for key in keys
+        )
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            tmp_path = f"{self.index_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fp:
+                fp.write(lines)
+            os.replace(tmp_path, self.index_path)
+        return len(keys)
+
+    def put_page(
+        self, activities: Sequence[dict], fetched_at: Optional[datetime] = None
+    ) -> str:
+        """
+        Cache a raw page of activities and index every activity on it. A page
+        that is already cached was indexed when it was first stored, so
+        re-fetching it unchanged adds nothing.
+        :return: digest of the page
+        """
+        if fetched_at is None:
+            fetched_at = datetime.utcnow()
+        data = json.dumps(activities, sort_keys=True, separators=(",", ":")).encode()
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find_page(digest) is not None:
+            return digest
+        path = self.page_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so a crash never leaves a truncated page
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(_compress(data, self.compression))
+        os.replace(tmp_path, path)
+        if self.s3 is not None:
+            self.s3.upload_file(path, self.bucket_name, path)
+        fetched = fetched_at.strftime("%Y-%m-%d %H:%M:%S")
+        entries = [
+            RawIndexEntry(
+                str(activity["id"]), activity.get("start_date", ""), fetched, digest, i
+            )
+            for i, activity in enumerate(activities)
+        ]
+        with self._lock:
+            self.pages_written += 1
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.index_path, "a", newline="") as fp:
+                csv.writer(fp, delimiter="|").writerows(entries)
+            self._pending_index.extend(entries)
+        return digest
+
+    def flush(self, run_id: str) -> None:
+        """Mirror the index lines added since the last flush to s3."""
+        with self._lock:
+            entries, self._pending_index = self._pending_index, []
+        if self.s3 is None or not entries:
+            return
+        lines = "".join("|".join(map(str, entry)) + "\n" for entry in entries)
+        key = f"{self.root}/index/{run_id}.csv"
+        self.s3.put_object(Bucket=self.bucket_name, Key=key, Body=lines.encode())
+
+    def load_index(self) -> List[RawIndexEntry]:
+        """Every index entry, in the order the pages were fetched."""
+        if not os.path.exists(self.index_path):
+            if self.s3 is None or not self.restore_index():
+                return []
+        with open(self.index_path, "r", newline="") as fp:
+            return [
+                RawIndexEntry(activity_id, start_date, fetched_at, digest, int(i))
+                for activity_id, start_date, fetched_at, digest, i in csv.reader(
+                    fp, delimiter="|"
+                )
+            ]
+
+    def load_page(self, digest: str) -> List[dict]:
+        path = self._find_page(digest) or self._fetch_mirrored_page(digest)
+        if path is None:
+            raise FileNotFoundError(f"Raw page {digest} is not in {self.root}")
+        with open(path, "rb") as fp:
+            return json.loads(_decompress(fp.read(), path))
+
+    def latest_entries(self) -> Dict[str, RawIndexEntry]:
+        """The most recently fetched entry of every cached activity."""
+        latest = {}
+        for entry in self.load_index():
+            saved = latest.get(entry.activity_id)
+            # index lines are appended in fetch order, ties keep the later line
+            if saved is None or entry.fetched_at >= saved.fetched_at:
+                latest[entry.activity_id] = entry
+        return latest
+
+    def iter_latest_activities(self) -> Iterator[dict]:
+        """
+        Yield the latest raw payload of every cached activity, reading each
+        page once. Makes no HTTP calls.
+        """
+        positions = defaultdict(list)
+        for entry in self.latest_entries().values():
+            positions[entry.digest].append(entry.position)
+        for digest, page_positions in positions.items():
+            page = self.load_page(digest)
+            for position in sorted(page_positions):
+                yield page[position]
+
+
+def load_raw_cache(config, s3=None) -> Optional[RawResponseCache]:
+    """The raw response cache configured in pipeline.conf, None if disabled."""
+    section = "strava_raw_cache_config"
+    if not config.getboolean(section, "enabled", fallback=False):
+        return None
+    return RawResponseCache(
+        config.get(section, "cache_dir", fallback=RAW_CACHE_DIR),
+        s3 if config.getboolean(section, "mirror_to_s3", fallback=False) else None,
+        config.get("aws_boto_credentials", "bucket_name"),
+        config.get(section, "compression", fallback="gzip"),
+    )
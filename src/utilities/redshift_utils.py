@@ -1,18 +1,22 @@
 import configparser
-import psycopg2
 from datetime import datetime
-from typing import Tuple
+from typing import Optional, Tuple
 
+from src.utilities.config_utils import load_pipeline_config
 
-def connect_redshift():
+
+def connect_redshift(parser: Optional[configparser.ConfigParser] = None):
     """Connect to the redshift cluster."""
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
+    if parser is None:
+        parser = load_pipeline_config()
     dbname = parser.get("aws_redshift_creds", "database")
     user = parser.get("aws_redshift_creds", "username")
     password = parser.get("aws_redshift_creds", "password")
     host = parser.get("aws_redshift_creds", "host")
     port = parser.get("aws_redshift_creds", "port")
+    # only import the driver when a connection is actually needed
+    import psycopg2
+
     conn = psycopg2.connect(
         dbname=dbname, host=host, port=port, user=user, password=password
     )
@@ -20,13 +24,21 @@ def connect_redshift():
 
 
 def get_s3_and_iam_details(
-    date: datetime = datetime.today().strftime("%Y_%m_%d"),
+    date: Optional[str] = None,
+    file_extension: str = "csv",
+    parser: Optional[configparser.ConfigParser] = None,
 ) -> Tuple[str, str]:
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
+    """
+    Get the s3 path of a day's single file export and the IAM role used to
+    COPY it, the date defaults to today when called, not when imported.
+    """
+    if date is None:
+        date = datetime.today().strftime("%Y_%m_%d")
+    if parser is None:
+        parser = load_pipeline_config()
     account_id = parser.get("aws_boto_credentials", "account_id")
     iam_role = parser.get("aws_redshift_creds", "iam_role")
     bucket_name = parser.get("aws_boto_credentials", "bucket_name")
-    s3_file_path = f"s3://{bucket_name}/strava_data/{date}_export_file.csv"
+    s3_file_path = f"s3://{bucket_name}/strava_data/{date}_export_file.{file_extension}"
     role_string = f"arn:aws:iam::{account_id}:role/{iam_role}"
     return s3_file_path, role_string
@@ -1,17 +1,139 @@
-import boto3
 import configparser
 
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-def connect_s3():
-    """Get the MySQL connection info and connect."""
+from src.utilities.config_utils import load_pipeline_config
+
+# S3 rejects multipart parts smaller than this, except for the last part
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def connect_s3(parser: Optional[configparser.ConfigParser] = None):
+    """Get the S3 connection info and connect."""
     # load the aws_boto_credentials values
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
+    if parser is None:
+        parser = load_pipeline_config()
     access_key = parser.get("aws_boto_credentials", "access_key")
     secret_key = parser.get("aws_boto_credentials", "secret_key")
-    bucket_name = parser.get("aws_boto_credentials", "bucket_name")
+    # boto3 is slow to import, so only import it when a client is needed
+    import boto3
+
     # connect to s3 bucket
     s3 = boto3.client(
         "s3", aws_access_key_id=access_key, aws_secret_access_key=secret_key
     )
     return s3
+
+
+class S3MultipartWriter:
+    """
+    Binary file-like object that streams everything written to it into a
+    single S3 object using multipart upload.
+
+    Bytes are buffered until a part is full and each part is uploaded on a
+    background thread, so uploading overlaps with whatever produces the data.
+    At most `max_pending_parts` parts are held in memory at once, keeping
+    memory bounded regardless of the object size.
+    """
+
+    def __init__(
+        self,
+        s3,
+        bucket_name: str,
+        key: str,
+        part_size: int = 8 * 1024 * 1024,
+        max_pending_parts: int = 2,
+    ) -> None:
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.max_pending_parts = max_pending_parts
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+        self._pending = []
+        self._parts: List[dict] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_pending_parts)
+        upload = s3.create_multipart_upload(Bucket=bucket_name, Key=key)
+        self._upload_id = upload["UploadId"]
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._submit_part(part)
+        return len(data)
+
+    def flush(self) -> None:
+        # parts are only uploaded once full, S3 can't take small parts
+        pass
+
+    def _submit_part(self, part: bytes) -> None:
+        # block while too many parts are in flight to keep memory bounded
+        while len(self._pending) >= self.max_pending_parts:
+            self._parts.append(self._pending.pop(0).result())
+        part_number = len(self._parts) + len(self._pending) + 1
+        self._pending.append(
+            self._executor.submit(self._upload_part, part_number, part)
+        )
+
+    def _upload_part(self, part_number: int, part: bytes) -> dict:
+        response = self.s3.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=part,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def close(self) -> None:
+        """Upload the final part and complete the multipart upload."""
+        if self.closed:
+            return
+        try:
+            if self._buffer or not (self._parts or self._pending):
+                self._submit_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._parts.extend(future.result() for future in self._pending)
+            self._pending = []
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown()
+            self.closed = True
+
+    def abort(self) -> None:
+        """Abort the multipart upload so no partial object is left behind."""
+        if self.closed:
+            return
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown()
+        self.s3.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id
+        )
+        self.closed = True
+
+    def __enter__(self) -> "S3MultipartWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
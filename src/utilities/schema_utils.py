@@ -0,0 +1,39 @@
+import re
+
+from typing import List, Tuple
+
+TABLE_SCHEMA_PATH = "sql/tables/create_redshift_table.sql"
+
+# matches column definitions such as "distance" FLOAT or "total" DECIMAL(18, 2)
+COLUMN_DEFINITION = re.compile(
+    r'"(\w+)"\s+([A-Za-z]+(?:\s*\(\s*\d+(?:\s*,\s*\d+)?\s*\))?)'
+)
+
+
+def load_table_schema(sql_path: str = TABLE_SCHEMA_PATH) -> List[Tuple[str, str]]:
+    """Read (column name, Redshift type) pairs from a CREATE TABLE script."""
+    with open(sql_path, "r") as sql_file:
+        sql = sql_file.read()
+    return [
+        (name, re.sub(r"\s+", "", col_type).upper())
+        for name, col_type in COLUMN_DEFINITION.findall(sql)
+    ]
+
+
+def parse_decimal_type(col_type: str) -> Tuple[int, int]:
+    """Get (precision, scale) of a DECIMAL type, using Redshift's (18, 0) default."""
+    match = re.match(r"(?:DECIMAL|NUMERIC)\((\d+)(?:,(\d+))?\)", col_type)
+    if match is None:
+        return 18, 0
+    return int(match.group(1)), int(match.group(2) or 0)
+
+
+def load_required_columns(sql_path: str = TABLE_SCHEMA_PATH) -> List[str]:
+    """Names of the columns a CREATE TABLE script declares NOT NULL or PRIMARY KEY."""
+    with open(sql_path, "r") as sql_file:
+        sql = sql_file.read()
+    return [
+        name
+        for name, constraints in re.findall(r'"(\w+)"([^,\n]*)', sql)
+        if re.search(r"NOT\s+NULL|PRIMARY\s+KEY", constraints, re.IGNORECASE)
+    ]
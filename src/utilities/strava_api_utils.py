@@ -1,97 +1,547 @@
+import asyncio
+import hashlib
+import json
+import marshal
+import os
 import requests
 import configparser
+import threading
+import time
 import urllib3
-import re
 
-from typing import Dict
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple
 from datetime import datetime
+from functools import lru_cache
+
+from src.utilities.config_utils import load_pipeline_config
+from src.utilities.schema_utils import load_table_schema
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+STRAVA_ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities"
+STRAVA_ACTIVITY_DETAIL_URL = "https://www.strava.com/api/v3/activities"
+# largest page size the /athlete/activities endpoint will return
+STRAVA_MAX_PER_PAGE = 200
+STRAVA_TOKEN_CACHE_PATH = ".strava_token_cache.json"
+# refresh access tokens a little before Strava expires them
+TOKEN_EXPIRY_MARGIN = 5 * 60
+# keys every usable token response has, error bodies lack them
+STRAVA_TOKEN_KEYS = ("access_token", "expires_at")
+# pipeline.conf sections holding one athlete each, e.g. [strava_athlete:5028644]
+ATHLETE_SECTION_PREFIX = "strava_athlete:"
 
-def connect_strava() -> Dict[str, str]:
-    """Get the Strava API connection info and return header."""
-    # get strava api info
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
-    auth_url = parser.get("strava_api_config", "auth_url")
-    client_id = parser.get("strava_api_config", "client_id")
-    client_secret = parser.get("strava_api_config", "client_secret")
-    refresh_token = parser.get("strava_api_config", "refresh_token")
 
-    # connect to API
+class StravaAthlete(NamedTuple):
+    """
+    An athlete whose activities are extracted, with their own refresh token
+    and token cache. athlete_id is None for the single athlete configured in
+    [strava_api_config] before multi-athlete support.
+    """
+
+    athlete_id: Optional[str]
+    refresh_token: str
+    token_cache_path: str
+
+
+def load_cached_strava_token(token_cache_path: str) -> Optional[dict]:
+    """Load a previously saved Strava token, if there is one."""
+    try:
+        with open(token_cache_path, "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def save_strava_token(token: dict, token_cache_path: str) -> None:
+    """Save a Strava token readable only by the current user."""
+    fd = os.open(token_cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fp:
+        json.dump(token, fp)
+
+
+def get_strava_access_token(
+    auth_url: str,
+    client_id: str,
+    client_secret: str,
+    refresh_token: str,
+    token_cache_path: str = STRAVA_TOKEN_CACHE_PATH,
+) -> str:
+    """
+    Get a Strava access token, reusing the cached one until it expires and
+    only then exchanging the refresh token for a new one.
+    """
+    token = load_cached_strava_token(token_cache_path)
+    # ignore tokens cached for a different app or refresh token, and anything
+    # cached that isn't a token at all
+    if token is not None and (
+        token.get("source") != [client_id, refresh_token]
+        or any(key not in token for key in STRAVA_TOKEN_KEYS)
+    ):
+        token = None
+    if token is not None and token["expires_at"] - TOKEN_EXPIRY_MARGIN > time.time():
+        return token["access_token"]
+
+    # connect to API, Strava may have rotated the refresh token since last time
     payload = {
         "client_id": client_id,
         "client_secret": client_secret,
-        "refresh_token": refresh_token,
+        "refresh_token": (
+            token.get("refresh_token", refresh_token) if token else refresh_token
+        ),
         "grant_type": "refresh_token",
         "f": "json",
     }
     res = requests.post(auth_url, data=payload, verify=False)
-    access_token = res.json()["access_token"]
+    # never cache an error body, the next call would read it as a token
+    res.raise_for_status()
+    token = res.json()
+    missing = [key for key in STRAVA_TOKEN_KEYS if key not in token]
+    if missing:
+        raise ValueError(f"Strava token response lacks {', '.join(missing)}")
+    token["source"] = [client_id, refresh_token]
+    save_strava_token(token, token_cache_path)
+    return token["access_token"]
+
+
+def load_strava_athletes(
+    parser: Optional[configparser.ConfigParser] = None,
+) -> List[StravaAthlete]:
+    """
+    Read the athletes to extract from pipeline.conf: one per
+    [strava_athlete:<id>] section, or the single athlete whose refresh_token
+    is in [strava_api_config] if there are none.
+    """
+    if parser is None:
+        parser = load_pipeline_config()
+    token_cache_path = parser.get(
+        "strava_api_config", "token_cache_path", fallback=STRAVA_TOKEN_CACHE_PATH
+    )
+    athletes = [
+        StravaAthlete(
+            section[len(ATHLETE_SECTION_PREFIX) :],
+            parser.get(section, "refresh_token"),
+            # each athlete's access token is cached separately
+            parser.get(
+                section,
+                "token_cache_path",
+                fallback=f"{token_cache_path}.{section[len(ATHLETE_SECTION_PREFIX):]}",
+            ),
+        )
+        for section in parser.sections()
+        if section.startswith(ATHLETE_SECTION_PREFIX)
+    ]
+    if athletes:
+        return athletes
+    refresh_token = parser.get("strava_api_config", "refresh_token")
+    return [StravaAthlete(None, refresh_token, token_cache_path)]
+
+
+def connect_strava(
+    parser: Optional[configparser.ConfigParser] = None,
+    athlete: Optional[StravaAthlete] = None,
+) -> Dict[str, str]:
+    """
+    Get the Strava API connection info and return header.
+    :param athlete: athlete to authenticate as, defaults to the first configured
+    """
+    # get strava api info
+    if parser is None:
+        parser = load_pipeline_config()
+    if athlete is None:
+        athlete = load_strava_athletes(parser)[0]
+    auth_url = parser.get("strava_api_config", "auth_url")
+    client_id = parser.get("strava_api_config", "client_id")
+    client_secret = parser.get("strava_api_config", "client_secret")
+
+    access_token = get_strava_access_token(
+        auth_url,
+        client_id,
+        client_secret,
+        athlete.refresh_token,
+        athlete.token_cache_path,
+    )
     header = {"Authorization": "Bearer " + access_token}
     return header
 
 
+class StravaRateLimiter:
+    """
+    Track Strava's 15 minute and daily request budgets.
+
+    Budgets are synced from the X-RateLimit-Limit / X-RateLimit-Usage headers
+    on every response, so we only sleep when the next request would actually
+    exceed a limit, and then only until that window resets. The short window
+    resets on the quarter hour and the daily window at midnight UTC.
+
+    A limiter with a parent is one athlete's budget within the application
+    wide budget of the parent: a request needs room in both, and response
+    headers (which report application usage) are synced into the parent.
+
+    Requests reserved through wait_async() count as in flight until their
+    response is synced. Those still in flight when a window resets may land
+    in the new window, so they are counted against its budget too.
+    """
+
+    SHORT_WINDOW_SECONDS = 15 * 60
+    DAILY_WINDOW_SECONDS = 24 * 60 * 60
+
+    def __init__(
+        self,
+        short_limit: int = 100,
+        daily_limit: int = 1000,
+        clock=time.time,
+        sleep=time.sleep,
+        async_sleep=asyncio.sleep,
+        parent: Optional["StravaRateLimiter"] = None,
+    ) -> None:
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.requests_made = 0
+        self.in_flight = 0
+        self.seconds_slept = 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._short_window, self._daily_window = self._windows(clock())
+
+    def _windows(self, now: float):
+        return (
+            int(now // self.SHORT_WINDOW_SECONDS),
+            int(now // self.DAILY_WINDOW_SECONDS),
+        )
+
+    def _roll_windows(self, now: float) -> None:
+        """Reset usage counters when a rate limit window has passed."""
+        short_window, daily_window = self._windows(now)
+        # requests still in flight may be counted in the new window by Strava
+        if short_window != self._short_window:
+            self._short_window = short_window
+            self.short_usage = self.in_flight
+        if daily_window != self._daily_window:
+            self._daily_window = daily_window
+            self.daily_usage = self.in_flight
+
+    def _add_in_flight(self, n: int) -> None:
+        limiter = self
+        while limiter is not None:
+            with limiter._lock:
+                limiter.in_flight = max(0, limiter.in_flight + n)
+            limiter = limiter.parent
+
+    def reserve(self) -> float:
+        """
+        Reserve budget for one request.
+        :return: 0 if the request can be made now, otherwise the number of
+            seconds until the exhausted window resets
+        """
+        with self._lock:
+            now = self.clock()
+            self._roll_windows(now)
+            if self.daily_usage >= self.daily_limit:
+                return (self._daily_window + 1) * self.DAILY_WINDOW_SECONDS - now
+            if self.short_usage >= self.short_limit:
+                return (self._short_window + 1) * self.SHORT_WINDOW_SECONDS - now
+            # locks are always taken child first, so this can't deadlock
+            if self.parent is not None:
+                delay = self.parent.reserve()
+                if delay > 0:
+                    return delay
+            self.short_usage += 1
+            self.daily_usage += 1
+            self.requests_made += 1
+            return 0.0
+
+    def wait(self) -> None:
+        """Block until a request can be made without exceeding the rate limit."""
+        while True:
+            delay = self.reserve()
+            if delay <= 0:
+                return
+            print(f"Rate limit hit, sleeping for {delay:.0f} seconds...")
+            self.seconds_slept += delay
+            self.sleep(delay)
+
+    async def wait_async(self) -> None:
+        """
+        Coroutine version of wait(), so many coroutines can share one budget.
+        Reservations are made synchronously, so concurrent callers can never
+        overspend the budget between them. The request counts as in flight
+        until update() syncs its response.
+        """
+        while True:
+            delay = self.reserve()
+            if delay <= 0:
+                self._add_in_flight(1)
+                return
+            await self.async_sleep(delay)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Sync budgets with the rate limit headers of a Strava API response."""
+        if self.in_flight:
+            self._add_in_flight(-1)
+        self._sync_headers(headers)
+
+    def _sync_headers(self, headers: Mapping[str, str]) -> None:
+        if self.parent is not None:
+            self.parent._sync_headers(headers)
+            return
+        # read endpoints may also report a (stricter) read-only budget
+        budgets = []
+        for prefix in ("X-RateLimit", "X-ReadRateLimit"):
+            limit = headers.get(f"{prefix}-Limit")
+            usage = headers.get(f"{prefix}-Usage")
+            if limit and usage:
+                budgets.append(
+                    [int(v) for v in limit.split(",")]
+                    + [int(v) for v in usage.split(",")]
+                )
+        if not budgets:
+            return
+        # the limits Strava reports replace the configured ones, so a raised
+        # limit is picked up as well as a lowered one
+        short_limit, daily_limit, short_usage, daily_usage = zip(*budgets)
+        with self._lock:
+            self._roll_windows(self.clock())
+            self.short_limit = min(short_limit)
+            self.daily_limit = min(daily_limit)
+            self.short_usage = max(self.short_usage, *short_usage)
+            self.daily_usage = max(self.daily_usage, *daily_usage)
+
+    def exhaust(self) -> None:
+        """Mark the current 15 minute window as used up (e.g. after a 429)."""
+        if self.parent is not None:
+            self.parent.exhaust()
+            return
+        with self._lock:
+            self._roll_windows(self.clock())
+            self.short_usage = max(self.short_usage, self.short_limit)
+
+
 def convert_strava_start_date(date: str) -> datetime:
     date_format = "%Y-%m-%dT%H:%M:%SZ"
     converted_date = datetime.strptime(date, date_format)
     return converted_date
 
 
+def _convert_start_date(date: Optional[str]) -> Optional[datetime]:
+    # much cheaper than strptime for Strava's fixed "%Y-%m-%dT%H:%M:%SZ" format
+    return None if date is None else datetime.fromisoformat(date.rstrip("Z"))
+
+
+def _strip_timezone_offset(timezone: Optional[str]) -> Optional[str]:
+    # "(GMT+00:00) Europe/London" -> "Europe/London"
+    return None if timezone is None else timezone.partition(") ")[2] or timezone
+
+
+def _split_latlng(start_latlng: Optional[list]) -> Tuple[Any, Any]:
+    if start_latlng and len(start_latlng) == 2:
+        return start_latlng[0], start_latlng[1]
+    return None, None
+
+
+def _summary_polyline(activity_map: Optional[dict]) -> Optional[str]:
+    # encoded route, simplified by Strava for display at summary level
+    if not activity_map:
+        return None
+    return activity_map.get("summary_polyline") or None
+
+
+def _athlete_id(athlete: Optional[dict]) -> Optional[str]:
+    return str(athlete["id"]) if athlete and "id" in athlete else None
+
+
+def column_number_type(col_type: str) -> Optional[type]:
+    """Python type the numbers of a Redshift column are stored as, if any."""
+    if col_type in ("SMALLINT", "INT", "INTEGER", "BIGINT"):
+        return int
+    if col_type.startswith(("DECIMAL", "NUMERIC", "FLOAT", "REAL", "DOUBLE")):
+        return float
+    if col_type.startswith(("VARCHAR", "CHAR", "TEXT")):
+        return str
+    return None
+
+
+@lru_cache(maxsize=None)
+def _hash_conversions(number_types: Tuple[Optional[type], ...]) -> tuple:
+    # (position, type) of every column whose values may need converting,
+    # string columns never do and other types (timestamps) are hashed as str
+    return tuple(
+        (position, number_type or str)
+        for position, number_type in enumerate(number_types)
+        if number_type is not str
+    )
+
+
+def activity_content_hash(
+    values: Sequence[Any], number_types: Optional[Sequence[Optional[type]]] = None
+) -> str:
+    """
+    Hash an activity's column values, so unchanged rows can be skipped on load.
+    The values are serialized with marshal version 2, which unlike pickle never
+    refers back to an object it already wrote, so equal rows hash alike
+    whichever objects hold them.
+    :param number_types: column_number_type of each value, numbers are
+        converted to it first so e.g. 3 and 3.0 in a FLOAT column hash alike,
+        without them every value but a string is hashed as its str
+    """
+    values = list(values)
+    if number_types is None:
+        number_types = (None,) * len(values)
+    for position, value_type in _hash_conversions(tuple(number_types)):
+        value = values[position]
+        if value is not None and type(value) is not value_type:
+            values[position] = value_type(value)
+    data = marshal.dumps(values, 2)
+    return hashlib.md5(data, usedforsecurity=False).hexdigest()
+
+
+def make_activity_record_type(columns: Sequence[str]) -> type:
+    """Build a compact __slots__ record class with one attribute per column."""
+
+    def __init__(self, values):
+        for set_slot, value in zip(slot_setters, values):
+            set_slot(self, value)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in columns)
+
+    def __repr__(self):
+        return f"ActivityRecord(id={self.id!r})"
+
+    record_type = type(
+        "ActivityRecord",
+        (),
+        {
+            "__slots__": tuple(columns),
+            "__init__": __init__,
+            "__iter__": __iter__,
+            "__repr__": __repr__,
+        },
+    )
+    # calling the slot descriptors directly skips setattr's attribute lookup
+    slot_setters = [getattr(record_type, name).__set__ for name in columns]
+    return record_type
+
+
+class ActivityParser:
+    """
+    Parser for /athlete/activities payloads compiled once from the table schema.
+
+    Columns that map straight onto an API field are read with dict.get, the
+    derived start_date, timezone, lat, lng, summary_polyline and athlete_id
+    columns are converted after and content_hash, if the schema has it, is
+    computed last from all the other columns. A single payload parses into a
+    list or __slots__ record; a whole page parses column-wise, into one list
+    per column, still converting each date and coordinate on its own.
+    """
+
+    DERIVED_COLUMNS = (
+        "start_date",
+        "timezone",
+        "lat",
+        "lng",
+        "summary_polyline",
+        "athlete_id",
+        "content_hash",
+    )
+
+    def __init__(self, schema: Optional[List[Tuple[str, str]]] = None) -> None:
+        if schema is None:
+            schema = load_table_schema()
+        self.columns = tuple(name for name, _ in schema)
+        self.record_type = make_activity_record_type(self.columns)
+        self._direct_columns = tuple(
+            name for name in self.columns if name not in self.DERIVED_COLUMNS
+        )
+        # positions that derived values are written into after the direct fields
+        self._positions = {name: i for i, name in enumerate(self.columns)}
+        self._direct_positions = tuple(
+            self._positions[name] for name in self._direct_columns
+        )
+        self._in_order = self._direct_positions == tuple(
+            range(len(self._direct_columns))
+        )
+        self._hash_position = self._positions.get("content_hash")
+        self._hash_number_types = tuple(
+            column_number_type(col_type)
+            for name, col_type in schema
+            if name != "content_hash"
+        )
+
+    def parse_list(self, response_json: dict) -> list:
+        """Parse one API payload into a list of column values."""
+        get = response_json.get
+        if self._in_order:
+            activity = [get(col) for col in self._direct_columns]
+            activity.extend([None] * (len(self.columns) - len(activity)))
+        else:
+            activity = [None] * len(self.columns)
+            for position, col in zip(self._direct_positions, self._direct_columns):
+                activity[position] = get(col)
+        positions = self._positions
+        activity[positions["start_date"]] = _convert_start_date(get("start_date"))
+        activity[positions["timezone"]] = _strip_timezone_offset(get("timezone"))
+        lat, lng = _split_latlng(get("start_latlng"))
+        activity[positions["lat"]] = lat
+        activity[positions["lng"]] = lng
+        if "summary_polyline" in positions:
+            activity[positions["summary_polyline"]] = _summary_polyline(get("map"))
+        if "athlete_id" in positions:
+            activity[positions["athlete_id"]] = _athlete_id(get("athlete"))
+        position = self._hash_position
+        if position is not None:
+            activity[position] = activity_content_hash(
+                activity[:position] + activity[position + 1 :],
+                self._hash_number_types,
+            )
+        return activity
+
+    def parse(self, response_json: dict):
+        """Parse one API payload into an ActivityRecord."""
+        return self.record_type(self.parse_list(response_json))
+
+    def parse_page(self, page: List[dict]) -> Dict[str, list]:
+        """Parse a page of API payloads into one list of values per column."""
+        columns = {
+            col: [response_json.get(col) for response_json in page]
+            for col in self._direct_columns
+        }
+        columns["start_date"] = list(
+            map(_convert_start_date, [r.get("start_date") for r in page])
+        )
+        columns["timezone"] = list(
+            map(_strip_timezone_offset, [r.get("timezone") for r in page])
+        )
+        latlngs = list(map(_split_latlng, [r.get("start_latlng") for r in page]))
+        columns["lat"] = [latlng[0] for latlng in latlngs]
+        columns["lng"] = [latlng[1] for latlng in latlngs]
+        if "summary_polyline" in self._positions:
+            columns["summary_polyline"] = list(
+                map(_summary_polyline, [r.get("map") for r in page])
+            )
+        if "athlete_id" in self._positions:
+            columns["athlete_id"] = list(
+                map(_athlete_id, [r.get("athlete") for r in page])
+            )
+        if self._hash_position is not None:
+            hashed = [columns[col] for col in self.columns if col != "content_hash"]
+            columns["content_hash"] = [
+                activity_content_hash(values, self._hash_number_types)
+                for values in zip(*hashed)
+            ]
+        return {col: columns[col] for col in self.columns}
+
+
+@lru_cache(maxsize=None)
+def load_activity_parser() -> ActivityParser:
+    """Compile the activity parser for the production table schema once."""
+    return ActivityParser()
+
+
 def parse_api_output(response_json: dict) -> list:
     """Parse output from Strava API."""
-    activity = []
-    cols_to_extract = [
-        "id",
-        "name",
-        "distance",
-        "moving_time",
-        "elapsed_time",
-        "total_elevation_gain",
-        "type",
-        "workout_type",
-        "location_country",
-        "achievement_count",
-        "kudos_count",
-        "comment_count",
-        "athlete_count",
-        "average_speed",
-        "max_speed",
-        "average_cadence",
-        "average_temp",
-        "average_heartrate",
-        "max_heartrate",
-        "suffer_score",
-    ]
-    for col in cols_to_extract:
-        try:
-            activity.append(response_json[col])
-        # if col is not found in API repsonse
-        except KeyError:
-            activity.append(None)
-    try:
-        start_date = convert_strava_start_date(response_json["start_date"])
-        activity.append(start_date)
-    except KeyError:
-        activity.append(None)
-    try:
-        # remove timezone info
-        timezone = response_json["timezone"]
-        timezone = re.sub("[\(\[].*?[\)\]]", "", timezone)
-        activity.append(timezone[1:])
-    except KeyError:
-        activity.append(None)
-    try:
-        start_latlng = response_json["start_latlng"]
-        if len(start_latlng) == 2:
-            lat, lng = start_latlng[0], start_latlng[1]
-            activity.append(lat)
-            activity.append(lng)
-        else:
-            activity.append(None)
-            activity.append(None)
-    except KeyError:
-        activity.append(None)
-        activity.append(None)
-    return activity
+    return load_activity_parser().parse_list(response_json)
@@ -0,0 +1,451 @@
+import os
+import shutil
+
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# streams requested from /activities/{id}/streams
+STREAM_KEYS = (
+    "time",
+    "distance",
+    "latlng",
+    "altitude",
+    "velocity_smooth",
+    "heartrate",
+    "cadence",
+)
+# stored columns and their on-disk types: latlng is split into lat/lng in
+# fixed point (1e-7 degrees, ~1cm) and heart rate and cadence fit in a byte,
+# so a sample takes 26 bytes instead of 64 as float64s
+STREAM_COLUMNS: Dict[str, np.dtype] = {
+    "time": np.dtype(np.int32),
+    "distance": np.dtype(np.float32),
+    "lat": np.dtype(np.int32),
+    "lng": np.dtype(np.int32),
+    "altitude": np.dtype(np.float32),
+    "velocity_smooth": np.dtype(np.float32),
+    "heartrate": np.dtype(np.uint8),
+    "cadence": np.dtype(np.uint8),
+}
+LATLNG_SCALE = 10_000_000
+# fill values for streams an activity was recorded without
+MISSING_LATLNG = np.iinfo(np.int32).min
+MISSING_BYTE = 0
+
+# standard best effort distances in metres, as reported by Strava
+BEST_EFFORT_DISTANCES: Dict[str, float] = {
+    "400m": 400.0,
+    "1/2 mile": 804.672,
+    "1k": 1000.0,
+    "1 mile": 1609.344,
+    "2 mile": 3218.688,
+    "5k": 5000.0,
+    "10k": 10000.0,
+    "15k": 15000.0,
+    "10 mile": 16093.44,
+    "20k": 20000.0,
+    "Half-Marathon": 21097.5,
+    "Marathon": 42195.0,
+}
+# lower bounds of HR zones 2-5 as fractions of max heart rate
+HR_ZONE_FRACTIONS = (0.6, 0.7, 0.8, 0.9)
+# gaps between samples longer than this are pauses, not moving time
+MAX_SAMPLE_GAP_SECONDS = 30
+MOVING_SPEED_THRESHOLD = 0.5
+# grade is measured over this many samples to smooth out GPS altitude noise
+GRADE_WINDOW_SAMPLES = 10
+MAX_ABS_GRADE = 0.45
+# activities are laid end to end on one distance axis this far apart, so a
+# whole batch can be interpolated and searched with single NumPy calls
+ACTIVITY_DISTANCE_STRIDE = 1e8
+
+
+class StreamBatch:
+    """
+    The streams of many activities as concatenated columns.
+
+    Samples of activity i are rows offsets[i]:offsets[i + 1] of every column,
+    which lets metrics be computed for a whole batch at once instead of
+    looping over activities (or worse, samples) in Python.
+    """
+
+    def __init__(
+        self,
+        activity_ids: np.ndarray,
+        offsets: np.ndarray,
+        columns: Dict[str, np.ndarray],
+    ) -> None:
+        self.activity_ids = activity_ids
+        self.offsets = offsets
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.activity_ids)
+
+    @property
+    def n_samples(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def sample_activity_index(self) -> np.ndarray:
+        """Index into activity_ids of the activity each sample belongs to."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def get(self, activity_id: int) -> Optional[Dict[str, np.ndarray]]:
+        """The streams of one activity, or None if the batch doesn't hold it."""
+        matches = np.flatnonzero(self.activity_ids == activity_id)
+        if not len(matches):
+            return None
+        start, end = self.offsets[matches[0]], self.offsets[matches[0] + 1]
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+    @classmethod
+    def from_streams(cls, streams: Iterable[Tuple[int, dict]]) -> "StreamBatch":
+        """
+        Build a batch from /activities/{id}/streams responses fetched with
+        key_by_type=true. Activities without a time stream (e.g. manually
+        entered ones) are skipped.
+        """
+        activity_ids, lengths = [], []
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in STREAM_COLUMNS}
+        for activity_id, response_json in streams:
+            data = {
+                key: value["data"]
+                for key, value in (response_json or {}).items()
+                if isinstance(value, dict) and "data" in value
+            }
+            if not data.get("time"):
+                continue
+            n = len(data["time"])
+            for name, column in _parse_stream_columns(data, n).items():
+                parts[name].append(column)
+            activity_ids.append(int(activity_id))
+            lengths.append(n)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        columns = {
+            name: np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+            for (name, dtype), chunks in zip(STREAM_COLUMNS.items(), parts.values())
+        }
+        return cls(np.array(activity_ids, dtype=np.int64), offsets, columns)
+
+
+def _stream_column(values: Optional[list], n: int, dtype: np.dtype, fill) -> np.ndarray:
+    if not values or len(values) != n:
+        return np.full(n, fill, dtype=dtype)
+    values = np.asarray(values, dtype=np.float64)
+    if dtype.kind == "u":
+        values = np.clip(np.rint(values), 0, np.iinfo(dtype).max)
+    return values.astype(dtype)
+
+
+def _parse_stream_columns(data: Dict[str, list], n: int) -> Dict[str, np.ndarray]:
+    """Convert one activity's stream lists into the stored column types."""
+    columns = {"time": np.asarray(data["time"], dtype=np.int32)}
+    for name in ("distance", "altitude", "velocity_smooth"):
+        columns[name] = _stream_column(data.get(name), n, STREAM_COLUMNS[name], np.nan)
+    latlng = data.get("latlng")
+    if latlng and len(latlng) == n:
+        fixed = np.rint(np.asarray(latlng, dtype=np.float64) * LATLNG_SCALE)
+        columns["lat"] = fixed[:, 0].astype(np.int32)
+        columns["lng"] = fixed[:, 1].astype(np.int32)
+    else:
+        columns["lat"] = columns["lng"] = np.full(n, MISSING_LATLNG, dtype=np.int32)
+    for name in ("heartrate", "cadence"):
+        columns[name] = _stream_column(
+            data.get(name), n, STREAM_COLUMNS[name], MISSING_BYTE
+        )
+    return {name: columns[name] for name in STREAM_COLUMNS}
+
+
+class StreamStore:
+    """
+    On-disk store of activity streams, one segment directory per batch.
+
+    A segment holds a plain .npy file per column plus the activity ids and
+    offsets of the batch, so every segment can be memory-mapped and scanned
+    without reading years of samples into memory. Segments are written to a
+    temporary directory and renamed into place, so a crashed write never
+    leaves a partial segment behind.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def segment_paths(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            os.path.join(self.root, name)
+            for name in os.listdir(self.root)
+            if name.startswith("segment_")
+        )
+
+    def append(self, batch: StreamBatch) -> Optional[str]:
+        """Write a batch as a new segment, returning its path (None if empty)."""
+        if not len(batch):
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        segments = self.segment_paths()
+        next_index = int(segments[-1].rsplit("_", 1)[1]) + 1 if segments else 0
+        path = os.path.join(self.root, f"segment_{next_index:06d}")
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "activity_ids.npy"), batch.activity_ids)
+        np.save(os.path.join(tmp_path, "offsets.npy"), batch.offsets)
+        for name, column in batch.columns.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), column)
+        os.rename(tmp_path, path)
+        return path
+
+    @staticmethod
+    def load_segment(path: str, mmap_mode: Optional[str] = "r") -> StreamBatch:
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        return StreamBatch(
+            load("activity_ids"),
+            load("offsets"),
+            {name: load(name) for name in STREAM_COLUMNS},
+        )
+
+    def segments(self) -> Iterator[StreamBatch]:
+        """Memory-map the stored segments one at a time, oldest first."""
+        for path in self.segment_paths():
+            yield self.load_segment(path)
+
+    def activity_ids(self) -> np.ndarray:
+        """Ids of every stored activity."""
+        ids = [
+            np.load(os.path.join(path, "activity_ids.npy"))
+            for path in self.segment_paths()
+        ]
+        return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+    def get(self, activity_id: int) -> Optional[Dict[str, np.ndarray]]:
+        """The streams of one activity, latest copy first, as memory-mapped views."""
+        for batch in reversed(list(self.segments())):
+            streams = batch.get(activity_id)
+            if streams is not None:
+                return streams
+        return None
+
+
+def _distance_axis(batch: StreamBatch) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Lay every activity's (cleaned) distance stream on one increasing axis.
+    :return: the axis, the activity index of each sample and each activity's
+        total distance
+    """
+    activity_index = batch.sample_activity_index()
+    distance = np.nan_to_num(batch.columns["distance"].astype(np.float64), nan=0.0)
+    axis = activity_index * ACTIVITY_DISTANCE_STRIDE + distance
+    # GPS glitches can step distance backwards, which interp can't handle
+    np.maximum.accumulate(axis, out=axis)
+    distance = axis - activity_index * ACTIVITY_DISTANCE_STRIDE
+    totals = np.zeros(len(batch))
+    nonempty = batch.lengths > 0
+    totals[nonempty] = distance[batch.offsets[1:][nonempty] - 1]
+    return axis, activity_index, totals
+
+
+def _sample_intervals(batch: StreamBatch) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Seconds from each sample to the next one of the same activity (0 for the
+    last sample), and whether the athlete was moving over that interval.
+    """
+    time = batch.columns["time"].astype(np.float64)
+    distance = np.nan_to_num(batch.columns["distance"].astype(np.float64), nan=0.0)
+    dt, ds = np.zeros(len(time)), np.zeros(len(time))
+    dt[:-1], ds[:-1] = np.diff(time), np.diff(distance)
+    last = batch.offsets[1:][batch.lengths > 0] - 1
+    dt[last] = ds[last] = 0.0
+    moving = (dt > 0) & (dt <= MAX_SAMPLE_GAP_SECONDS)
+    moving &= ds >= MOVING_SPEED_THRESHOLD * dt
+    return dt, moving
+
+
+def compute_splits(batch: StreamBatch, split_distance: float = 1000.0) -> List[list]:
+    """
+    Per-km (or per split_distance) splits of every activity, the last one
+    usually partial.
+    :return: rows of id, split, distance, elapsed_time, average_speed,
+        elevation_difference, average_heartrate
+    """
+    axis, activity_index, totals = _distance_axis(batch)
+    n_splits = np.ceil(totals / split_distance).astype(np.int64)
+    split_activity = np.repeat(np.arange(len(batch)), n_splits)
+    first_split = np.repeat(np.cumsum(n_splits) - n_splits, n_splits)
+    split = np.arange(len(split_activity)) - first_split + 1
+    start = (split - 1) * split_distance
+    end = np.minimum(split * split_distance, totals[split_activity])
+    start_key = split_activity * ACTIVITY_DISTANCE_STRIDE + start
+    end_key = split_activity * ACTIVITY_DISTANCE_STRIDE + end
+
+    time = batch.columns["time"].astype(np.float64)
+    elapsed = np.interp(end_key, axis, time) - np.interp(start_key, axis, time)
+    altitude = batch.columns["altitude"].astype(np.float64)
+    elevation = np.interp(end_key, axis, altitude) - np.interp(
+        start_key, axis, altitude
+    )
+    # average heart rate of the samples inside each split, from prefix sums
+    heartrate = batch.columns["heartrate"].astype(np.float64)
+    has_heartrate = heartrate > MISSING_BYTE
+    heartrate_sum = np.concatenate(([0.0], np.cumsum(heartrate)))
+    heartrate_count = np.concatenate(([0], np.cumsum(has_heartrate)))
+    first = np.searchsorted(axis, start_key, "left")
+    last = np.searchsorted(axis, end_key, "right")
+    n_heartrate = heartrate_count[last] - heartrate_count[first]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        average_heartrate = (heartrate_sum[last] - heartrate_sum[first]) / n_heartrate
+        average_speed = (end - start) / elapsed
+
+    rows = []
+    for i in range(len(split_activity)):
+        rows.append(
+            [
+                int(batch.activity_ids[split_activity[i]]),
+                int(split[i]),
+                round(float(end[i] - start[i]), 1),
+                round(float(elapsed[i]), 1),
+                _finite_or_none(average_speed[i], 3),
+                _finite_or_none(elevation[i], 1),
+                _finite_or_none(average_heartrate[i], 1),
+            ]
+        )
+    return rows
+
+
+def compute_best_efforts(
+    batch: StreamBatch, distances: Dict[str, float] = BEST_EFFORT_DISTANCES
+) -> List[list]:
+    """
+    Fastest time over each standard distance within every activity. For every
+    sample the time to cover the distance from it is interpolated on the
+    distance axis, so each distance costs one pass over the batch.
+    :return: rows of id, name, distance, elapsed_time
+    """
+    axis, activity_index, totals = _distance_axis(batch)
+    time = batch.columns["time"].astype(np.float64)
+    remaining = totals[activity_index] - (
+        axis - activity_index * ACTIVITY_DISTANCE_STRIDE
+    )
+    nonempty = np.flatnonzero(batch.lengths > 0)
+    rows = []
+    for name, distance in distances.items():
+        if not len(nonempty) or distance > totals.max():
+            continue
+        elapsed = np.interp(axis + distance, axis, time) - time
+        elapsed[remaining < distance] = np.inf
+        best = np.minimum.reduceat(elapsed, batch.offsets[nonempty])
+        for i, seconds in zip(nonempty, best):
+            if np.isfinite(seconds):
+                rows.append(
+                    [
+                        int(batch.activity_ids[i]),
+                        name,
+                        distance,
+                        round(float(seconds), 1),
+                    ]
+                )
+    return rows
+
+
+def compute_hr_zone_times(
+    batch: StreamBatch,
+    max_heartrate: float,
+    zone_fractions: Sequence[float] = HR_ZONE_FRACTIONS,
+) -> np.ndarray:
+    """
+    Moving seconds spent in each heart rate zone.
+    :return: array of shape (activities, zones)
+    """
+    dt, moving = _sample_intervals(batch)
+    heartrate = batch.columns["heartrate"]
+    zone = np.digitize(heartrate, np.asarray(zone_fractions) * max_heartrate)
+    n_zones = len(zone_fractions) + 1
+    weights = np.where(moving & (heartrate > MISSING_BYTE), dt, 0.0)
+    seconds = np.bincount(
+        batch.sample_activity_index() * n_zones + zone,
+        weights=weights,
+        minlength=len(batch) * n_zones,
+    )
+    return seconds.reshape(len(batch), n_zones)
+
+
+def minetti_cost_of_running(grade: np.ndarray) -> np.ndarray:
+    """Energy cost of running (J/kg/m) at a grade, Minetti et al. (2002)."""
+    return (
+        ((((155.4 * grade - 30.4) * grade - 43.3) * grade + 46.3) * grade + 19.5)
+        * grade
+    ) + 3.6
+
+
+def compute_grade_adjusted_distance(
+    batch: StreamBatch,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Moving time and grade adjusted distance of every activity: the flat
+    distance that would have cost the same energy as the distance run, with
+    grade measured over GRADE_WINDOW_SAMPLES samples.
+    :return: arrays of moving seconds and grade adjusted metres per activity
+    """
+    dt, moving = _sample_intervals(batch)
+    distance = np.nan_to_num(batch.columns["distance"].astype(np.float64), nan=0.0)
+    altitude = batch.columns["altitude"].astype(np.float64)
+    ds = np.zeros(len(distance))
+    ds[:-1] = np.diff(distance)
+    ds[~moving] = 0.0
+
+    activity_index = batch.sample_activity_index()
+    last_sample = batch.offsets[1:][activity_index] - 1
+    ahead = np.minimum(np.arange(len(distance)) + GRADE_WINDOW_SAMPLES, last_sample)
+    run = distance[ahead] - distance
+    rise = altitude[ahead] - altitude
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grade = np.where(run > 1.0, rise / run, 0.0)
+    grade = np.clip(np.nan_to_num(grade), -MAX_ABS_GRADE, MAX_ABS_GRADE)
+    flat_equivalent = ds * minetti_cost_of_running(grade) / minetti_cost_of_running(0.0)
+
+    n = len(batch)
+    moving_time = np.bincount(
+        activity_index, weights=np.where(moving, dt, 0.0), minlength=n
+    )
+    adjusted_distance = np.bincount(
+        activity_index, weights=flat_equivalent, minlength=n
+    )
+    return moving_time, adjusted_distance
+
+
+def compute_stream_metrics(batch: StreamBatch, max_heartrate: float) -> List[list]:
+    """
+    Activity level stream metrics.
+    :return: rows of id, samples, moving_time, grade_adjusted_distance,
+        grade_adjusted_pace (seconds per km) and the seconds in each HR zone
+    """
+    moving_time, adjusted_distance = compute_grade_adjusted_distance(batch)
+    zone_seconds = compute_hr_zone_times(batch, max_heartrate)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = moving_time / (adjusted_distance / 1000)
+    rows = []
+    for i in range(len(batch)):
+        rows.append(
+            [
+                int(batch.activity_ids[i]),
+                int(batch.lengths[i]),
+                round(float(moving_time[i]), 1),
+                round(float(adjusted_distance[i]), 1),
+                _finite_or_none(pace[i], 1),
+                *(round(float(s), 1) for s in zone_seconds[i]),
+            ]
+        )
+    return rows
+
+
+def _finite_or_none(value: float, ndigits: int) -> Optional[float]:
+    return round(float(value), ndigits) if np.isfinite(value) else None
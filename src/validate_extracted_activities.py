@@ -0,0 +1,359 @@
+import csv
+import math
+import os
+import re
+import time
+
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from src.redshift_staging_to_production import WEEKLY_STATS_TABLE
+from src.utilities.metrics_utils import get_run_metrics
+from src.utilities.schema_utils import (
+    load_required_columns,
+    load_table_schema,
+    parse_decimal_type,
+)
+from src.validator import (
+    CheckResult,
+    compare_results,
+    format_suite_digest,
+    post_slack_message,
+)
+
+# two-sided 90% interval, the threshold of the warehouse z-score checks
+DEFAULT_ZSCORE_THRESHOLD = 1.645
+# Redshift stores a VARCHAR without a length as VARCHAR(256)
+DEFAULT_VARCHAR_BYTES = 256
+INTEGER_RANGE = (-(2**31), 2**31 - 1)
+BIGINT_RANGE = (-(2**63), 2**63 - 1)
+# bounds a valid activity stays within, on top of what its column type allows
+COLUMN_RANGES = {
+    "distance": (0, None),
+    "moving_time": (0, None),
+    "elapsed_time": (0, None),
+    "total_elevation_gain": (0, None),
+    "achievement_count": (0, None),
+    "kudos_count": (0, None),
+    "comment_count": (0, None),
+    "athlete_count": (0, None),
+    "average_speed": (0, None),
+    "max_speed": (0, None),
+    "lat": (-90, 90),
+    "lng": (-180, 180),
+}
+IN_STREAM_SCRIPT = "in-stream"
+REJECTS_DIR = "strava_data/rejects"
+
+
+class WeeklyHistory(NamedTuple):
+    """Mean and standard deviation of the weekly activity count and kudos."""
+
+    avg_count: Optional[float]
+    std_count: Optional[float]
+    avg_kudos: Optional[float]
+    std_kudos: Optional[float]
+
+
+def load_weekly_history(rs_conn, weekly_stats_table: str) -> WeeklyHistory:
+    """
+    Read the weekly history the batch statistics are compared against from
+    the weekly aggregates, a small table, instead of the fact table.
+    """
+    cur = rs_conn.cursor()
+    cur.execute(f"""
+        SELECT AVG(activity_count::DOUBLE PRECISION),
+            STDDEV(activity_count::DOUBLE PRECISION),
+            AVG(kudos_sum::DOUBLE PRECISION / NULLIF(kudos_n, 0)),
+            STDDEV(kudos_sum::DOUBLE PRECISION / NULLIF(kudos_n, 0))
+        FROM {weekly_stats_table};""")
+    return WeeklyHistory(
+        *(None if value is None else float(value) for value in cur.fetchone())
+    )
+
+
+def _number_rule(low, high) -> Callable[[object], bool]:
+    def is_valid(value) -> bool:
+        if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+            return False
+        if isinstance(value, float) and not math.isfinite(value):
+            return False
+        return (low is None or value >= low) and (high is None or value <= high)
+
+    return is_valid
+
+
+def _integer_rule(low, high) -> Callable[[object], bool]:
+    in_range = _number_rule(low, high)
+    # the API reports some integer columns such as max_heartrate as 182.0
+    return lambda value: in_range(value) and value == int(value)
+
+
+def _varchar_rule(max_bytes: int) -> Callable[[object], bool]:
+    return lambda value: len(str(value).encode("utf-8")) <= max_bytes
+
+
+def _timestamp_rule(value) -> bool:
+    if isinstance(value, datetime):
+        return True
+    try:
+        datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return False
+    return True
+
+
+def column_rule(column: str, col_type: str) -> Callable[[object], bool]:
+    """
+    Check that a non-NULL value fits a Redshift column type and the column's
+    range in COLUMN_RANGES, so a bad row is caught before COPY rejects it.
+    """
+    low, high = COLUMN_RANGES.get(column, (None, None))
+
+    def clamp(type_low, type_high):
+        return (
+            type_low if low is None else max(low, type_low),
+            type_high if high is None else min(high, type_high),
+        )
+
+    if col_type in ("INTEGER", "INT", "INT4"):
+        return _integer_rule(*clamp(*INTEGER_RANGE))
+    if col_type in ("BIGINT", "INT8"):
+        return _integer_rule(*clamp(*BIGINT_RANGE))
+    if col_type.startswith(("DECIMAL", "NUMERIC")):
+        precision, scale = parse_decimal_type(col_type)
+        limit = 10 ** (precision - scale)
+        return _number_rule(*clamp(-limit, limit))
+    if col_type.startswith(("FLOAT", "DOUBLE", "REAL")):
+        return _number_rule(low, high)
+    if col_type.startswith("TIMESTAMP"):
+        return _timestamp_rule
+    if col_type.startswith("VARCHAR"):
+        length = re.search(r"\((\d+)\)", col_type)
+        return _varchar_rule(int(length.group(1)) if length else DEFAULT_VARCHAR_BYTES)
+    return lambda value: True
+
+
+class ActivityBatchValidator:
+    """
+    Data quality checks run on parsed activities as they stream towards the
+    s3 export, so a bad batch is rejected before the upload and COPY are paid
+    for. In one pass it tracks duplicate ids, NULLs in required columns,
+    values out of their column's type or range, and the batch's activity
+    count and kudos statistics, which are compared to the weekly history.
+    With a rejects_path, duplicate and invalid rows are quarantined there
+    instead of passed on, so they're kept for review without blocking the
+    rest of the batch, or the batch that retries it, from loading.
+    """
+
+    def __init__(
+        self,
+        seen_ids: Iterable = (),
+        history: Optional[WeeklyHistory] = None,
+        max_invalid_fraction: float = 0.0,
+        zscore_threshold: float = DEFAULT_ZSCORE_THRESHOLD,
+        schema_path: Optional[str] = None,
+        rejects_path: Optional[str] = None,
+    ) -> None:
+        """
+        :param seen_ids: ids already loaded, which the batch must not repeat
+        :param history: weekly history the batch statistics are compared to
+        :param max_invalid_fraction: fraction of rows that may break a column
+            rule before the batch is rejected, or only warned about when the
+            rows are quarantined
+        :param rejects_path: pipe-delimited file to quarantine duplicate and
+            invalid rows to, each followed by the checks it failed
+        """
+        schema_args = () if schema_path is None else (schema_path,)
+        schema = load_table_schema(*schema_args)
+        required = set(load_required_columns(*schema_args))
+        self.columns = [name for name, _ in schema]
+        self._rules = [column_rule(name, col_type) for name, col_type in schema]
+        self._required = [name in required for name in self.columns]
+        self._kudos_position = self.columns.index("kudos_count")
+        self.seen_ids = {str(activity_id) for activity_id in seen_ids}
+        self.history = history
+        self.max_invalid_fraction = max_invalid_fraction
+        self.zscore_threshold = zscore_threshold
+        self.rejects_path = rejects_path
+        self.n_rows = 0
+        self.n_invalid_rows = 0
+        self.n_rejected_rows = 0
+        self.duplicate_ids: List[str] = []
+        self.column_violations: Dict[str, int] = Counter()
+        self.kudos_n = 0
+        self.kudos_sum = 0
+        self.seconds = 0.0
+
+    def check(self, activities: Iterable[List]) -> Iterator[List]:
+        """
+        Yield every activity unchanged, recording its violations on the way.
+        With a rejects_path, the duplicate and invalid ones are quarantined
+        instead of yielded.
+        """
+        rules = list(zip(self.columns, self._rules, self._required))
+        rejects_fp = None
+        try:
+            for activity in activities:
+                start = time.perf_counter()
+                self.n_rows += 1
+                failed = []
+                activity_id = str(activity[0])
+                if activity_id in self.seen_ids:
+                    self.duplicate_ids.append(activity_id)
+                    failed.append("duplicate_ids")
+                self.seen_ids.add(activity_id)
+                valid = True
+                for (column, is_valid, required), value in zip(rules, activity):
+                    if value is None:
+                        ok = not required
+                    else:
+                        ok = is_valid(value)
+                    if not ok:
+                        self.column_violations[column] += 1
+                        failed.append(f"invalid_{column}")
+                        valid = False
+                if not valid:
+                    self.n_invalid_rows += 1
+                kudos = activity[self._kudos_position]
+                if isinstance(kudos, (int, float)) and not isinstance(kudos, bool):
+                    self.kudos_n += 1
+                    self.kudos_sum += kudos
+                if failed and self.rejects_path is not None:
+                    if rejects_fp is None:
+                        os.makedirs(
+                            os.path.dirname(self.rejects_path) or ".", exist_ok=True
+                        )
+                        rejects_fp = open(self.rejects_path, "a", newline="")
+                    csv.writer(rejects_fp, delimiter="|").writerow(
+                        list(activity) + [",".join(failed)]
+                    )
+                    self.n_rejected_rows += 1
+                    self.seconds += time.perf_counter() - start
+                    continue
+                self.seconds += time.perf_counter() - start
+                yield activity
+        finally:
+            if rejects_fp is not None:
+                rejects_fp.close()
+
+    def _zscore(self, value, avg, std) -> Optional[float]:
+        if value is None or avg is None or not std:
+            return None
+        return abs(value - avg) / std
+
+    def results(self) -> List[CheckResult]:
+        """
+        The batch's checks, in the shape of the warehouse validation suite.
+        Row-level checks halt, batch statistics only warn like their
+        warehouse counterparts, and are skipped without weekly history.
+        """
+        metrics = get_run_metrics()
+        metrics.incr("quality", "rows", self.n_rows)
+        metrics.incr("quality", "invalid_rows", self.n_invalid_rows)
+        metrics.incr("quality", "duplicate_ids", len(self.duplicate_ids))
+        metrics.incr("quality", "rejected_rows", self.n_rejected_rows)
+        allowed_invalid = math.floor(self.max_invalid_fraction * self.n_rows)
+        # quarantined rows no longer reach the export, so they only warn
+        row_severity = "halt" if self.rejects_path is None else "warn"
+        checks = [
+            ("duplicate_ids", len(self.duplicate_ids), "equals", 0, row_severity),
+            (
+                "invalid_rows",
+                self.n_invalid_rows,
+                "less_equals",
+                allowed_invalid,
+                row_severity,
+            ),
+        ]
+        for column, count in sorted(self.column_violations.items()):
+            checks.append(
+                (
+                    f"invalid_{column}",
+                    count,
+                    "less_equals",
+                    allowed_invalid,
+                    row_severity,
+                )
+            )
+        if self.history is not None and self.n_rows:
+            avg_kudos = self.kudos_sum / self.kudos_n if self.kudos_n else None
+            for name, zscore in (
+                (
+                    "batch_activity_count_zscore",
+                    self._zscore(
+                        self.n_rows, self.history.avg_count, self.history.std_count
+                    ),
+                ),
+                (
+                    "batch_kudos_avg_zscore",
+                    self._zscore(
+                        avg_kudos, self.history.avg_kudos, self.history.std_kudos
+                    ),
+                ),
+            ):
+                if zscore is not None:
+                    zscore = round(zscore, 3)
+                    checks.append(
+                        (name, zscore, "less_equals", self.zscore_threshold, "warn")
+                    )
+        return [
+            CheckResult(
+                name=name,
+                script_1=IN_STREAM_SCRIPT,
+                script_2=IN_STREAM_SCRIPT,
+                comp_operator=comp_operator,
+                severity=severity,
+                result_1=result_1,
+                result_2=result_2,
+                passed=compare_results(result_1, result_2, comp_operator),
+                seconds=0.0,
+            )
+            for name, result_1, comp_operator, result_2, severity in checks
+        ]
+
+
+def report_batch_quality(
+    validator: ActivityBatchValidator, webhook_url: str
+) -> List[CheckResult]:
+    """Post one Slack digest of a batch's in-stream checks, like the suite's."""
+    check_results = validator.results()
+    title = f"In-stream checks of {validator.n_rows} rows"
+    if validator.n_rejected_rows:
+        title += (
+            f", {validator.n_rejected_rows} quarantined to {validator.rejects_path}"
+        )
+    digest = format_suite_digest(check_results, validator.seconds, title)
+    print(digest)
+    post_slack_message(webhook_url, digest)
+    return check_results
+
+
+def load_batch_validator(config, rs_conn=None) -> Optional[ActivityBatchValidator]:
+    """
+    The in-stream validator configured in pipeline.conf, None if disabled.
+    Duplicate and invalid rows are quarantined to a rejects file of the run.
+    Only ids repeated within the batch count as duplicates: a loaded activity
+    the extraction returns again is a re-sync the merge updates in place.
+    :param rs_conn: warehouse connection to read the weekly history with,
+        without it the batch statistics aren't checked
+    """
+    section = "strava_quality_config"
+    if not config.getboolean(section, "enabled", fallback=True):
+        return None
+    history = None
+    if rs_conn is not None:
+        history = load_weekly_history(rs_conn, WEEKLY_STATS_TABLE)
+    rejects_dir = config.get(section, "rejects_dir", fallback=REJECTS_DIR)
+    return ActivityBatchValidator(
+        history=history,
+        max_invalid_fraction=config.getfloat(
+            section, "max_invalid_fraction", fallback=0.0
+        ),
+        zscore_threshold=config.getfloat(
+            section, "zscore_threshold", fallback=DEFAULT_ZSCORE_THRESHOLD
+        ),
+        rejects_path=os.path.join(rejects_dir, f"{get_run_metrics().run_id}.csv"),
+    )
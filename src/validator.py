@@ -1,39 +1,43 @@
 import sys
+import re
 import requests
 import json
-import configparser
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Callable, List, NamedTuple
+
+from src.copy_to_redshift_staging import STAGING_TABLE
+from src.utilities.metrics_utils import get_run_metrics, instrumented
+from src.utilities.pipeline_context import get_pipeline_context
 from src.utilities.redshift_utils import connect_redshift
 
+VALIDATION_SUITE_PATH = "sql/validation/suite.json"
+# scripts such as "SELECT 1.645;" that don't need a warehouse round trip
+CONSTANT_SCRIPT = re.compile(r"^\s*SELECT\s+(-?\d+(?:\.\d+)?)\s*;?\s*$", re.IGNORECASE)
+
 
-def execute_test(db_conn, script_1: str, script_2: str, comp_operator: str) -> bool:
+def run_sql_script(db_conn, script: str, staging_table: str = STAGING_TABLE):
     """
-    Execute test made up of two scripts and a comparison operator
-    :param comp_operator: comparison operator to compare script outcome
-        (equals, greater_equals, greater, less_equals, less, not_equals)
-    :return: True/False for test pass/fail
+    Execute a sql script and return the first column of its first row.
+    :param staging_table: table the script's {staging_table} placeholder names
     """
-    # execute the 1st script and store the result
-    cursor = db_conn.cursor()
-    sql_file = open(script_1, "r")
-    cursor.execute(sql_file.read())
-    record = cursor.fetchone()
-    result_1 = record[0]
-    db_conn.commit()
-    cursor.close()
-
-    # execute the 2nd script and store the result
     cursor = db_conn.cursor()
-    sql_file = open(script_2, "r")
-    cursor.execute(sql_file.read())
+    sql_file = open(script, "r")
+    cursor.execute(sql_file.read().replace("{staging_table}", staging_table))
     record = cursor.fetchone()
-    result_2 = record[0]
     db_conn.commit()
     cursor.close()
+    return record[0]
 
-    print("Result 1 = " + str(result_1))
-    print("Result 2 = " + str(result_2))
 
-    # compare values based on the comp_operator
+def compare_results(result_1, result_2, comp_operator: str) -> bool:
+    """Compare two script results based on the comp_operator."""
+    # a NULL result (e.g. a z-score with no history) can't pass a test
+    if result_1 is None or result_2 is None:
+        return False
     if comp_operator == "equals":
         return result_1 == result_2
     elif comp_operator == "greater_equals":
@@ -44,32 +48,162 @@ def execute_test(db_conn, script_1: str, script_2: str, comp_operator: str) -> b
         return result_1 <= result_2
     elif comp_operator == "less":
         return result_1 < result_2
-    elif comp_operator == "not_equal":
+    elif comp_operator in ("not_equals", "not_equal"):
         return result_1 != result_2
 
     # tests have failed if we make it here
     return False
 
 
-# test_result should be True/False
-def send_slack_notification(
-    webhook_url: str,
+def execute_test(
+    db_conn,
     script_1: str,
     script_2: str,
     comp_operator: str,
-    test_result: bool,
+    staging_table: str = STAGING_TABLE,
 ) -> bool:
+    """
+    Execute test made up of two scripts and a comparison operator
+    :param comp_operator: comparison operator to compare script outcome
+        (equals, greater_equals, greater, less_equals, less, not_equals)
+    :return: True/False for test pass/fail
+    """
+    # execute the scripts and store the results
+    result_1 = run_sql_script(db_conn, script_1, staging_table)
+    result_2 = run_sql_script(db_conn, script_2, staging_table)
+
+    print("Result 1 = " + str(result_1))
+    print("Result 2 = " + str(result_2))
+
+    return compare_results(result_1, result_2, comp_operator)
+
+
+class CheckResult(NamedTuple):
+    name: str
+    script_1: str
+    script_2: str
+    comp_operator: str
+    severity: str
+    result_1: Any
+    result_2: Any
+    passed: bool
+    seconds: float
+
+
+def evaluate_constant_script(script: str):
+    """
+    Return the value of a script that just selects a constant, e.g. SELECT 1.645;
+    so it can be evaluated locally, or None if the script needs the warehouse.
+    """
+    with open(script, "r") as sql_file:
+        match = CONSTANT_SCRIPT.match(sql_file.read())
+    if match is None:
+        return None
+    value = match.group(1)
+    return Decimal(value) if "." in value else int(value)
+
+
+def load_suite_manifest(manifest_path: str) -> List[dict]:
+    """Load the list of checks from a validation suite manifest."""
+    with open(manifest_path, "r") as fp:
+        return json.load(fp)["checks"]
+
+
+@instrumented("validate")
+def run_validation_suite(
+    connect: Callable,
+    manifest_path: str,
+    max_workers: int = 4,
+    staging_table: str = STAGING_TABLE,
+) -> List[CheckResult]:
+    """
+    Run every check listed in a suite manifest in one go.
+
+    Constant scripts are evaluated locally, each distinct warehouse script is
+    executed once, and warehouse scripts run concurrently with one connection
+    per worker thread.
+    :param connect: callable returning a new warehouse connection
+    :param staging_table: staging table the checks run against
+    """
+    checks = load_suite_manifest(manifest_path)
+    scripts = {c[key] for c in checks for key in ("script_1", "script_2")}
+    results, seconds = {}, {}
+    for script in scripts:
+        value = evaluate_constant_script(script)
+        if value is not None:
+            results[script], seconds[script] = value, 0.0
+    warehouse_scripts = sorted(scripts - set(results))
+
+    thread_state = threading.local()
+    connections = []
+
+    def run_warehouse_script(script):
+        if not hasattr(thread_state, "conn"):
+            thread_state.conn = connect()
+            connections.append(thread_state.conn)
+        start = time.perf_counter()
+        value = run_sql_script(thread_state.conn, script, staging_table)
+        return script, value, time.perf_counter() - start
 
     try:
-        if test_result == True:
-            message = (
-                f"Validation Test Passed!: {script_1} / {script_2} / {comp_operator}"
-            )
-        else:
-            message = (
-                f"Validation Test FAILED!: {script_1} / {script_2} / {comp_operator}"
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            for script, value, elapsed in executor.map(
+                run_warehouse_script, warehouse_scripts
+            ):
+                results[script], seconds[script] = value, elapsed
+    finally:
+        for conn in connections:
+            conn.close()
+
+    metrics = get_run_metrics()
+    metrics.incr("validate", "queries", len(warehouse_scripts))
+    check_results = []
+    for check in checks:
+        script_1, script_2 = check["script_1"], check["script_2"]
+        comp_operator = check["comparison"]
+        check_results.append(
+            CheckResult(
+                name=check.get("name", script_1),
+                script_1=script_1,
+                script_2=script_2,
+                comp_operator=comp_operator,
+                severity=check.get("severity", "warn"),
+                result_1=results[script_1],
+                result_2=results[script_2],
+                passed=compare_results(
+                    results[script_1], results[script_2], comp_operator
+                ),
+                seconds=seconds[script_1] + seconds[script_2],
             )
-        # send test result to Slack
+        )
+    metrics.incr("validate", "checks", len(check_results))
+    metrics.incr("validate", "checks_failed", sum(not r.passed for r in check_results))
+    return check_results
+
+
+def format_suite_digest(
+    check_results: List[CheckResult],
+    total_seconds: float,
+    title: str = "Validation suite",
+) -> str:
+    """Summarise a validation suite run as one Slack message."""
+    n_passed = sum(result.passed for result in check_results)
+    lines = [
+        f"{title}: {n_passed}/{len(check_results)} checks passed "
+        f"in {total_seconds:.2f}s"
+    ]
+    for result in check_results:
+        status = "Passed" if result.passed else "FAILED"
+        lines.append(
+            f"{status} [{result.severity}] {result.name}: {result.result_1} "
+            f"{result.comp_operator} {result.result_2} ({result.seconds:.2f}s)"
+        )
+    return "\n".join(lines)
+
+
+def post_slack_message(webhook_url: str, message: str) -> bool:
+    """Post a message to Slack, returning whether it was delivered."""
+    try:
         slack_data = {"text": message}
         response = requests.post(
             webhook_url,
@@ -80,6 +214,7 @@ def send_slack_notification(
         if response.status_code != 200:
             print(response)
             return False
+        return True
 
     except Exception as e:
         print("Error sending slack notification")
@@ -87,15 +222,67 @@ def send_slack_notification(
         return False
 
 
+def run_validation_suite_with_digest(
+    connect: Callable,
+    webhook_url: str,
+    manifest_path: str = VALIDATION_SUITE_PATH,
+    staging_table: str = STAGING_TABLE,
+) -> List[CheckResult]:
+    """Run a validation suite and post one Slack digest of all its checks."""
+    start = time.perf_counter()
+    check_results = run_validation_suite(
+        connect, manifest_path, staging_table=staging_table
+    )
+    digest = format_suite_digest(check_results, time.perf_counter() - start)
+    print(digest)
+    post_slack_message(webhook_url, digest)
+    return check_results
+
+
+def suite_should_halt(check_results: List[CheckResult]) -> bool:
+    """Whether any failed check has severity halt."""
+    return any(not r.passed and r.severity == "halt" for r in check_results)
+
+
+# test_result should be True/False
+def send_slack_notification(
+    webhook_url: str,
+    script_1: str,
+    script_2: str,
+    comp_operator: str,
+    test_result: bool,
+) -> bool:
+
+    if test_result == True:
+        message = f"Validation Test Passed!: {script_1} / {script_2} / {comp_operator}"
+    else:
+        message = f"Validation Test FAILED!: {script_1} / {script_2} / {comp_operator}"
+    # send test result to Slack
+    return post_slack_message(webhook_url, message)
+
+
 if __name__ == "__main__":
 
     if len(sys.argv) == 2 and sys.argv[1] == "-h":
         print("Usage: python validator.py script1.sql script2.sql comparison_operator")
+        print("       python validator.py --suite [suite.json] [staging_table]")
         print(
             "Valid comparison_operator values: (equals, greater_equals, greater, less_equals, less, not_equals)"
         )
         exit(0)
 
+    if len(sys.argv) in (2, 3, 4) and sys.argv[1] == "--suite":
+        manifest_path = sys.argv[2] if len(sys.argv) >= 3 else VALIDATION_SUITE_PATH
+        staging_table = sys.argv[3] if len(sys.argv) == 4 else STAGING_TABLE
+        ctx = get_pipeline_context()
+        check_results = run_validation_suite_with_digest(
+            lambda: connect_redshift(ctx.config),
+            ctx.config.get("slack_config", "webhook_url"),
+            manifest_path,
+            staging_table,
+        )
+        exit(1 if suite_should_halt(check_results) else 0)
+
     if len(sys.argv) != 5:
         print(
             "Usage: python validator.py script1.sql script2.sql comparison_operator severity_level"
@@ -108,13 +295,12 @@ if __name__ == "__main__":
     comp_operator = sys.argv[3]
     sev_level = sys.argv[4]
     # execute test
-    db_conn = connect_redshift()
+    ctx = get_pipeline_context()
+    db_conn = ctx.redshift()
     test_result = execute_test(db_conn, script_1, script_2, comp_operator)
     print("Result of test: " + str(test_result))
     # load slack webhook_url
-    parser = configparser.ConfigParser()
-    parser.read("pipeline.conf")
-    webhook_url = parser.get("slack_config", "webhook_url")
+    webhook_url = ctx.config.get("slack_config", "webhook_url")
     send_slack_notification(webhook_url, script_1, script_2, comp_operator, test_result)
     # exit
     if sev_level == "halt":
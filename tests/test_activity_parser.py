@@ -0,0 +1,67 @@
+import pytest
+from datetime import datetime
+
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.utilities.strava_api_utils import ActivityParser, parse_api_output
+
+
+def test_parse_api_output():
+    response_json = next(generate_activity_payloads(1))
+    response_json["timezone"] = "(GMT+00:00) Europe/London"
+    response_json["start_date"] = "2022-06-17T08:36:46Z"
+    activity = parse_api_output(response_json)
+    assert len(activity) == 27, "Activity should have a value for every column."
+    assert activity[20] == datetime(2022, 6, 17, 8, 36, 46), "Bad start_date."
+    assert activity[21] == "Europe/London", "Timezone offset should be removed."
+    assert activity[22:24] == response_json["start_latlng"], "Bad lat/lng."
+    assert activity[25] == response_json["map"]["summary_polyline"], "Bad polyline."
+    assert activity[26] == str(response_json["athlete"]["id"]), "Bad athlete_id."
+
+
+def test_parse_api_output_missing_fields():
+    activity = parse_api_output({"id": 1, "start_latlng": []})
+    assert activity[0] == 1, "Present fields should be parsed."
+    assert activity[1:24] == [None] * 23, "Missing fields should be None."
+    assert len(activity[24]) == 32, "Content hash should always be set."
+    assert activity[25] is None, "Activities without a map have no polyline."
+    assert activity[26] is None, "Activities without an athlete have no athlete_id."
+
+
+def test_activity_parser_page_matches_single_payloads():
+    parser = ActivityParser()
+    page = list(generate_activity_payloads(50))
+    columns = parser.parse_page(page)
+    rows = [parser.parse_list(response_json) for response_json in page]
+    assert list(columns) == list(parser.columns), "Columns should follow schema."
+    assert [list(row) for row in zip(*columns.values())] == rows, "Page mismatch."
+    record = parser.parse(page[0])
+    assert list(record) == rows[0], "Record should hold the parsed values."
+    assert record.kudos_count == page[0]["kudos_count"], "Bad record attribute."
+
+
+def test_content_hash_tracks_activity_changes():
+    response_json = next(generate_activity_payloads(1))
+    content_hash = parse_api_output(response_json)[24]
+    assert parse_api_output(dict(response_json))[24] == content_hash, "Unstable hash."
+    response_json["kudos_count"] += 1
+    assert parse_api_output(response_json)[24] != content_hash, "Hash ignored change."
+
+
+def test_content_hash_is_canonical():
+    response_json = next(generate_activity_payloads(1))
+    # one string object in two columns, equal but distinct objects in the other
+    shared = "".join(["Ru", "n"])
+    response_json.update(name=shared, type=shared, distance=5000, moving_time=1500)
+    other_json = dict(response_json)
+    other_json.update(
+        name="".join(["R", "un"]),
+        type="".join(["Ru", "n"]),
+        distance=5000.0,
+        moving_time=1500.0,
+    )
+    assert other_json["name"] is not other_json["type"], "Need distinct objects."
+    parser = ActivityParser()
+    content_hash = parser.parse_list(response_json)[24]
+    assert parser.parse_list(other_json)[24] == content_hash, "Equal rows differ."
+    columns = parser.parse_page([response_json, other_json])
+    assert columns["content_hash"] == [content_hash] * 2, "Page hashes differ."
@@ -0,0 +1,143 @@
+import configparser
+import numpy as np
+import os
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.ingest_activity_streams import fetch_activity_streams, ingest_activity_streams
+from src.utilities.strava_api_utils import StravaRateLimiter
+from src.utilities.stream_utils import (
+    StreamBatch,
+    StreamStore,
+    compute_best_efforts,
+    compute_hr_zone_times,
+    compute_splits,
+    compute_stream_metrics,
+)
+from tests.test_s3_streaming import FakeRedshiftConnection
+
+
+def make_streams(n_seconds, speed, altitude=None, heartrate=150):
+    time = list(range(n_seconds))
+    return {
+        "time": {"data": time},
+        "distance": {"data": [speed * t for t in time]},
+        "altitude": {"data": altitude or [10.0] * n_seconds},
+        "heartrate": {"data": [heartrate] * n_seconds},
+        "latlng": {"data": [[50.84, -0.39]] * n_seconds},
+    }
+
+
+def test_stream_metrics_at_constant_pace():
+    # 10.4km at 4 m/s (4:10 per km) followed by an activity without streams
+    batch = StreamBatch.from_streams([(1, make_streams(2601, 4.0)), (2, {})])
+    assert list(batch.activity_ids) == [1], "Activities without streams are skipped."
+
+    splits = compute_splits(batch)
+    assert len(splits) == 11, "The last partial km should be its own split."
+    assert splits[0][1:4] == [1, 1000.0, 250.0], "Each full km should take 250s."
+    assert splits[-1][2:4] == [400.0, 100.0], "The last split covers the last 400m."
+    assert splits[0][6] == 150.0, "Average heart rate should come from the split."
+
+    efforts = {row[1]: row[3] for row in compute_best_efforts(batch)}
+    assert efforts["1k"] == 250.0 and efforts["10k"] == 2500.0
+    assert "Half-Marathon" not in efforts, "Efforts longer than the run are skipped."
+
+    zones = compute_hr_zone_times(batch, max_heartrate=190)
+    assert zones[0, 2] == 2600, "150bpm of 190 should all be zone 3."
+    (metrics,) = compute_stream_metrics(batch, max_heartrate=190)
+    assert metrics[4] == 250.0, "On the flat grade adjusted pace is the actual pace."
+
+
+def test_grade_adjusted_pace_is_faster_uphill():
+    climb = [10.0 + 0.05 * 3.0 * t for t in range(1000)]
+    batch = StreamBatch.from_streams(
+        [(1, make_streams(1000, 3.0, climb)), (2, make_streams(1000, 3.0))]
+    )
+    uphill, flat = compute_stream_metrics(batch, max_heartrate=190)
+    assert uphill[4] < flat[4], "A 5% climb should adjust the pace to a faster one."
+
+
+def test_stream_store_round_trip(tmp_path):
+    store = StreamStore(str(tmp_path / "streams"))
+    store.append(StreamBatch.from_streams([(1, make_streams(10, 3.0))]))
+    store.append(StreamBatch.from_streams([(2, make_streams(20, 3.0))]))
+    assert sorted(store.activity_ids()) == [1, 2]
+    streams = store.get(2)
+    assert isinstance(streams["time"], np.memmap), "Segments should be memory-mapped."
+    assert len(streams["time"]) == 20
+    assert streams["lat"][0] == 508400000, "latlng is stored in 1e-7 degrees."
+
+
+def test_fetch_activity_streams_from_mock_api():
+    payloads = list(generate_activity_payloads(5))
+    activity_ids = [payload["id"] for payload in payloads] + [1]
+    clock = VirtualClock()
+    with MockStravaAPI(payloads, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+        batch = fetch_activity_streams(
+            activity_ids, {}, rate_limiter, 4, f"{api.base_url}/activities"
+        )
+    assert len(batch) == 5, "Unknown activity ids should be skipped."
+    assert api.request_count == 6, "Each activity's streams should be one request."
+    expected_samples = sum(payload["moving_time"] for payload in payloads)
+    assert batch.n_samples == expected_samples, "Streams are 1Hz samples."
+    splits = compute_splits(batch)
+    assert {row[0] for row in splits} == set(activity_ids[:5])
+
+
+class FakeContext:
+    def __init__(self, athlete_ids, store_dir):
+        self.config = configparser.ConfigParser()
+        for athlete_id in athlete_ids:
+            self.config[f"strava_athlete:{athlete_id}"] = {"refresh_token": ""}
+        self.config["strava_streams_config"] = {"store_dir": store_dir}
+        self.config["aws_boto_credentials"] = {"bucket_name": "bucket"}
+        self.rs_conn = FakeRedshiftConnection()
+        self.local_s3 = LocalS3Client()
+
+    def strava_header(self, athlete=None):
+        return {"Authorization": f"Bearer token-{athlete.athlete_id}"}
+
+    def s3(self):
+        return self.local_s3
+
+    def redshift(self):
+        return self.rs_conn
+
+    def s3_and_iam_details(self):
+        return "", "role"
+
+
+def test_ingest_streams_with_each_athletes_token(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("strava_data")
+    athlete_ids = ["101", "102"]
+    feeds = {
+        f"token-{athlete_id}": list(
+            generate_activity_payloads(
+                3, seed=i, athlete_id=int(athlete_id), first_id=(i + 1) * 10**6
+            )
+        )
+        for i, athlete_id in enumerate(athlete_ids)
+    }
+    athlete_activity_ids = [
+        (athlete_id, str(payload["id"]))
+        for athlete_id in athlete_ids
+        for payload in feeds[f"token-{athlete_id}"]
+    ]
+    clock = VirtualClock()
+    ctx = FakeContext(athlete_ids, str(tmp_path / "streams"))
+    with MockStravaAPI([], clock=clock.time, athlete_activities=feeds) as api:
+        rate_limiter = StravaRateLimiter(
+            clock=clock.time, sleep=clock.sleep, async_sleep=clock.async_sleep
+        )
+        n_activities = ingest_activity_streams(
+            athlete_activity_ids, ctx, rate_limiter, f"{api.base_url}/activities"
+        )
+    assert api.forbidden_count == 0, "Streams should use their athlete's token."
+    assert n_activities == 6, "Every athlete's streams should be ingested."
+    assert rate_limiter.requests_made == 6, "Requests should draw on the app budget."
+    copies = [q for q in ctx.rs_conn.executed if q.startswith("COPY")]
+    assert len(copies) == 3, "Every metrics table should be loaded."
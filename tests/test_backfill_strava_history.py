@@ -0,0 +1,84 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.backfill_strava_history import (
+    BackfillWindow,
+    backfill_strava_history,
+    plan_backfill_windows,
+)
+from src.utilities.strava_api_utils import (
+    StravaRateLimiter,
+    convert_strava_start_date,
+    load_activity_parser,
+)
+
+
+def test_plan_backfill_windows_covers_range():
+    start, end = datetime(2016, 1, 1), datetime(2016, 12, 31)
+    windows = plan_backfill_windows(start, end, timedelta(days=100), ["1", "2"])
+    assert len(windows) == 8, "Every athlete should get every window."
+    assert windows[0] == BackfillWindow("1", start, datetime(2016, 4, 10)), "Bad start."
+    assert windows[3].before == end, "Last window should stop at the end."
+    assert all(
+        a.before == b.after for a, b in zip(windows[:3], windows[1:4])
+    ), "Windows should be consecutive."
+
+
+def read_manifest_rows(s3, manifest_path):
+    manifest_key = manifest_path[len("s3://bucket/") :]
+    manifest = json.loads(
+        s3.get_object(Bucket="bucket", Key=manifest_key)["Body"].read()
+    )
+    rows = []
+    for entry in manifest["entries"]:
+        body = s3.get_object(Bucket="bucket", Key=entry["url"][len("s3://bucket/") :])
+        part = gzip.decompress(body["Body"].read()).decode()
+        rows.extend(csv.reader(io.StringIO(part), delimiter="|"))
+    return rows
+
+
+def test_backfill_windows_in_parallel_under_one_budget(tmp_path, monkeypatch):
+    # the parser reads the table schema relative to the repo root
+    load_activity_parser()
+    monkeypatch.chdir(tmp_path)
+    payloads = list(generate_activity_payloads(600))
+    # an activity starting exactly on a window boundary belongs to one window
+    payloads[300]["start_date"] = "2021-01-01T00:00:00Z"
+    start_dates = [convert_strava_start_date(p["start_date"]) for p in payloads]
+    start = datetime(2020, 1, 1)
+    windows = plan_backfill_windows(start, datetime(2022, 7, 1), timedelta(days=61))
+    clock = VirtualClock()
+    s3 = LocalS3Client()
+    with MockStravaAPI(payloads, short_limit=10, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(10, 1000, clock=clock.time, sleep=clock.sleep)
+        results = backfill_strava_history(
+            windows,
+            {None: {}},
+            rate_limiter,
+            max_workers=4,
+            s3=s3,
+            bucket_name="bucket",
+            n_parts=2,
+            url=api.activities_url,
+        )
+    assert [r.window for r in results] == windows, "Results should follow windows."
+    rows = [
+        row
+        for r in results
+        if r.manifest_path
+        for row in read_manifest_rows(s3, r.manifest_path)
+    ]
+    expected = {str(p["id"]) for p, d in zip(payloads, start_dates) if d >= start}
+    assert len(rows) == len(expected), "No activity should be fetched twice."
+    assert {row[0] for row in rows} == expected, "Every activity should be backfilled."
+    assert api.rate_limited_count == 0, "Windows should share the rate budget."
+    assert clock.slept > 0, "The shared budget should throttle the windows."
+    assert all(
+        f"run={r.window.name}/" in r.manifest_path for r in results if r.manifest_path
+    ), "Each window should be its own partition."
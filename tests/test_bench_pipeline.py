@@ -0,0 +1,30 @@
+import pytest
+
+from benchmarks.bench_pipeline import find_regressions, run_benchmark
+
+
+def test_run_benchmark_covers_every_stage():
+    pytest.importorskip("duckdb")
+    results = run_benchmark(500, api_rows=300)
+    assert list(results) == [
+        "extract",
+        "parse",
+        "export",
+        "load",
+        "promote",
+        "validate",
+        "remerge",
+    ], "Every pipeline stage should be benchmarked."
+    assert results["extract"].rows == 300, "Extraction should be capped at api_rows."
+    assert all(
+        r.rows == 500 for stage, r in results.items() if stage != "extract"
+    ), "Every other stage should process all rows."
+
+
+def test_find_regressions():
+    baseline = {"10000": {"parse": {"rows_per_second": 100000.0}}}
+    current = {"10000": {"parse": {"rows_per_second": 60000.0}}}
+    assert find_regressions(current, baseline, 0.5) == [], "Within tolerance."
+    assert len(find_regressions(current, baseline, 0.3)) == 1, "Missed regression."
+    current["10000"]["load"] = {"rows_per_second": 1.0}
+    assert len(find_regressions(current, baseline, 0.3)) == 1, "No baseline to fail."
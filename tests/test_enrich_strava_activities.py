@@ -0,0 +1,68 @@
+import json
+import os
+import pytest
+import re
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import (
+    generate_activity_payloads,
+    make_activity_detail_payload,
+)
+from src.enrich_strava_activities import (
+    enrich_strava_activities,
+    load_details_to_redshift,
+    parse_activity_details,
+    read_activity_ids,
+    save_details_to_csv,
+)
+from src.extract_strava_data import export_activities_to_s3
+from src.utilities.strava_api_utils import StravaRateLimiter, parse_api_output
+from tests.test_s3_streaming import FakeRedshiftConnection, redshift_copy_rows
+
+
+def test_enrich_strava_activities_shares_rate_limit_budget():
+    payloads = list(generate_activity_payloads(60))
+    activity_ids = [payload["id"] for payload in payloads] + [1]
+    clock = VirtualClock()
+    with MockStravaAPI(payloads, short_limit=25, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(
+            short_limit=25,
+            clock=clock.time,
+            sleep=clock.sleep,
+            async_sleep=clock.async_sleep,
+        )
+        activity_details = enrich_strava_activities(
+            activity_ids, {}, rate_limiter, 8, f"{api.base_url}/activities"
+        )
+    assert len(activity_details) == 60, "Unknown activity ids should be skipped."
+    assert api.rate_limited_count == 0, "Coroutines should never exceed the budget."
+    assert api.request_count == 61, "Each activity should be requested once."
+    assert activity_details[0][1] is not None, "Calories should be extracted."
+
+
+def test_activity_details_json_survives_copy(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("strava_data")
+    payload = make_activity_detail_payload(next(generate_activity_payloads(1)))
+    payload["laps"][0]["name"] = 'Lap "1" | warm up'
+    details_file_path = save_details_to_csv([parse_activity_details(payload)])
+    rs_conn = FakeRedshiftConnection()
+    load_details_to_redshift(rs_conn, f"s3://bucket/{details_file_path}", "role")
+    copy_query = next(q for q in rs_conn.executed if q.startswith("COPY"))
+    copy_options = re.search(r"iam_role '[^']*' (.*);", copy_query).group(1)
+    with open(details_file_path, "r", newline="") as fp:
+        rows = redshift_copy_rows(fp.read(), copy_options)
+    assert len(rows[0]) == 7, "Fields should not split inside the json."
+    assert json.loads(rows[0][5]) == payload["splits_metric"], "Splits corrupted."
+    assert json.loads(rows[0][6]) == payload["laps"], "Laps corrupted."
+
+
+def test_read_activity_ids_from_export_parts(tmp_path, monkeypatch):
+    payloads = list(generate_activity_payloads(25))
+    activities = [parse_api_output(p) for p in payloads]
+    monkeypatch.chdir(tmp_path)
+    s3 = LocalS3Client()
+    manifest_path = export_activities_to_s3(activities, s3, "bucket", n_parts=3)
+    activity_ids = read_activity_ids(manifest_path, s3)
+    assert activity_ids == [str(p["id"]) for p in payloads], "Bad activity ids."
@@ -0,0 +1,211 @@
+import configparser
+import os
+import pytest
+from datetime import datetime, timedelta
+
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.extract_strava_data import (
+    commit_extraction,
+    extract_athletes_activities,
+    extract_strava_activities,
+    filter_changed_activities,
+    load_activity_hashes,
+    load_extraction_checkpoint,
+    save_activity_hashes,
+)
+from src.run_pipeline import extract_step
+from src.utilities.strava_api_utils import StravaRateLimiter, convert_strava_start_date
+
+
+class FakeMySQLConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, args=None):
+        self.executed.append(args)
+
+    def commit(self):
+        pass
+
+
+def test_extraction_resumes_from_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    payloads = list(generate_activity_payloads(450))
+    last_updated_warehouse = convert_strava_start_date(
+        payloads[420]["start_date"]
+    ) - timedelta(seconds=1)
+    clock = VirtualClock()
+
+    def die_while_sleeping(seconds):
+        raise KeyboardInterrupt("killed during a rate limit sleep")
+
+    with MockStravaAPI(payloads, short_limit=2, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=die_while_sleeping)
+        with pytest.raises(KeyboardInterrupt):
+            extract_strava_activities(
+                last_updated_warehouse,
+                {},
+                rate_limiter,
+                api.activities_url,
+                checkpoint_path=checkpoint_path,
+            )
+        checkpoint = load_extraction_checkpoint(checkpoint_path)
+        assert checkpoint["next_page"] == 3, "Both fetched pages should be saved."
+        assert checkpoint["rows"] == 400, "Fetched activities should be spooled."
+
+        pages_fetched = api.request_count - api.rate_limited_count
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+        all_activities = extract_strava_activities(
+            last_updated_warehouse,
+            {},
+            rate_limiter,
+            api.activities_url,
+            checkpoint_path=checkpoint_path,
+        )
+    assert len(all_activities) == 421, "Spooled and new activities should be returned."
+    assert len({a[0] for a in all_activities}) == 421, "No activity should repeat."
+    assert (
+        api.request_count - api.rate_limited_count - pages_fetched == 1
+    ), "Only the missing page should be fetched."
+
+    mysql_conn = FakeMySQLConnection()
+    commit_extraction(checkpoint_path, mysql_conn)
+    newest = convert_strava_start_date(payloads[0]["start_date"])
+    assert mysql_conn.executed == [
+        (newest.strftime("%Y-%m-%d %H:%M:%S"), None)
+    ], "Watermark should be the newest extracted start date."
+    assert not os.path.exists(checkpoint_path), "Checkpoint should be removed."
+    assert not os.path.exists(checkpoint_path + ".spool"), "Spool should be removed."
+
+
+class FakeContext:
+    def __init__(self, checkpoint_path):
+        self.config = configparser.ConfigParser()
+        self.config["strava_api_config"] = {
+            "checkpoint_path": checkpoint_path,
+            "refresh_token": "",
+            "hashes_path": checkpoint_path + ".hashes",
+        }
+        self.config["aws_boto_credentials"] = {"bucket_name": "bucket"}
+        self.config["strava_quality_config"] = {"enabled": "false"}
+        self.mysql_conn = FakeMySQLConnection()
+
+    def mysql(self):
+        return self.mysql_conn
+
+    def strava_header(self, athlete=None):
+        return {}
+
+    def s3(self):
+        return None
+
+    def redshift(self):
+        return None
+
+
+def test_empty_extraction_clears_checkpoint(tmp_path, monkeypatch):
+    import src.extract_strava_data as extract_module
+
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    payloads = list(generate_activity_payloads(50))
+    newest = convert_strava_start_date(payloads[0]["start_date"])
+    clock = VirtualClock()
+    rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+    exported = []
+    monkeypatch.setattr(
+        extract_module,
+        "get_athlete_watermarks",
+        lambda athlete_ids, mysql_conn: {None: newest},
+    )
+    monkeypatch.setattr(
+        extract_module,
+        "export_activities_to_s3",
+        lambda activities, s3, bucket_name, output_format, n_parts: exported.append(
+            activities
+        ),
+    )
+
+    def run_extract_step(api):
+        monkeypatch.setattr(
+            extract_module,
+            "extract_athletes_activities",
+            lambda watermarks, headers, athlete_limits, max_workers, **kwargs: (
+                extract_athletes_activities(
+                    watermarks,
+                    headers,
+                    rate_limiter,
+                    url=api.activities_url,
+                    **kwargs,
+                )
+            ),
+        )
+        state = {"export_format": "csv"}
+        return extract_step(FakeContext(checkpoint_path), state), state
+
+    with MockStravaAPI(payloads, clock=clock.time) as api:
+        has_rows, state = run_extract_step(api)
+    assert not has_rows and state["n_activities"] == 0, "Nothing new to extract."
+    assert not os.path.exists(checkpoint_path), "Checkpoint should be removed."
+
+    # the next run fetches a new activity instead of resuming a stale checkpoint
+    new_activity = dict(payloads[0], id=payloads[0]["id"] + 1)
+    new_activity["start_date"] = (newest + timedelta(hours=1)).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+    with MockStravaAPI([new_activity] + payloads, clock=clock.time) as api:
+        has_rows, state = run_extract_step(api)
+    assert has_rows and state["n_activities"] == 1, "New activity should be found."
+    assert len(exported[-1]) == 1, "New activity should be exported."
+
+
+def test_resync_window_only_stages_changed_activities(tmp_path):
+    hashes_path = str(tmp_path / "hashes.json")
+    payloads = list(generate_activity_payloads(120))
+    resync_window = timedelta(days=14)
+    watermark = convert_strava_start_date(payloads[40]["start_date"])
+    clock = VirtualClock()
+
+    def extract(payloads, watermark):
+        hashes = load_activity_hashes(hashes_path)
+        with MockStravaAPI(payloads, clock=clock.time) as api:
+            rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+            activities = extract_strava_activities(
+                watermark,
+                {},
+                rate_limiter,
+                api.activities_url,
+                per_page=20,
+                resync_window=resync_window,
+            )
+        changed = list(filter_changed_activities(activities, hashes))
+        save_activity_hashes(hashes, hashes_path, watermark - resync_window)
+        return activities, changed
+
+    activities, changed = extract(payloads[10:], watermark)
+    assert len(changed) == len(activities) > 30, "Everything is new the first time."
+    in_window = [
+        a["id"]
+        for a in payloads[10:]
+        if convert_strava_start_date(a["start_date"]) > watermark - resync_window
+    ]
+    assert {a[0] for a in activities} == set(in_window), "Bad re-sync window."
+
+    # later kudos on an activity in the window, and on one outside it
+    payloads[15]["kudos_count"] += 3
+    payloads[100]["kudos_count"] += 3
+    newest = convert_strava_start_date(payloads[10]["start_date"])
+    activities, changed = extract(payloads, newest)
+    assert {a[0] for a in changed} == {
+        a["id"] for a in payloads[:10] + [payloads[15]]
+    }, "Only new and changed activities should be staged."
+    assert len(activities) > len(changed), "Unchanged activities are re-fetched."
+    oldest = min(
+        start_date for _, start_date in load_activity_hashes(hashes_path).values()
+    )
+    assert datetime.strptime(oldest, "%Y-%m-%d %H:%M:%S") > (
+        newest - resync_window
+    ), "Hashes outside the window should be pruned."
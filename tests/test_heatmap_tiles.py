@@ -0,0 +1,95 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from benchmarks.local_warehouse import create_local_warehouse
+from benchmarks.synthetic_activities import ROUTE_TAILS, generate_activity_payloads
+from src.build_heatmap_tiles import (
+    HEATMAP_TILES_TABLE,
+    create_route_staging_tables,
+    find_activities_in_area,
+    find_unindexed_routes,
+    index_routes,
+    merge_route_index,
+    query_heatmap,
+)
+from src.redshift_staging_to_production import redshift_staging_to_production
+from src.utilities.geo_utils import decode_polylines, encode_polyline
+from src.utilities.strava_api_utils import ActivityParser
+
+TABLE_NAME = "public.strava_activity_data"
+
+
+def test_decode_polylines_round_trip():
+    rng = random.Random(0)
+    routes = [
+        [(rng.uniform(-80, 80), rng.uniform(-179, 179)) for _ in range(n)]
+        for n in (0, 1, 2, 50, 7)
+    ]
+    offsets, lat, lng = decode_polylines([encode_polyline(r) for r in routes] + [None])
+    assert list(np.diff(offsets)) == [0, 1, 2, 50, 7, 0], "Bad points per polyline."
+    decoded = np.column_stack((lat, lng))
+    expected = np.array([point for route in routes for point in route])
+    assert np.allclose(decoded, expected, atol=1e-5), "Bad decoded coordinates."
+
+
+def stage_and_promote(conn, parser, payloads):
+    conn.execute(f"CREATE TABLE staging_table AS SELECT * FROM {TABLE_NAME} LIMIT 0")
+    rows = [parser.parse_list(response_json) for response_json in payloads]
+    for row in rows:
+        row[0] = str(row[0])
+    placeholders = ", ".join("?" * len(parser.columns))
+    conn.executemany(f"INSERT INTO staging_table VALUES ({placeholders})", rows)
+    redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+
+
+def index_unindexed_routes(conn):
+    route_rows, cell_rows = index_routes(find_unindexed_routes(TABLE_NAME, conn))
+    create_route_staging_tables(conn)
+    for table_name, rows in (
+        ("route_staging", route_rows),
+        ("route_cells_staging", cell_rows),
+    ):
+        columns = [c[0] for c in conn.execute(f"DESCRIBE {table_name}").fetchall()]
+        staged = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+        conn.register("staged_rows", staged)
+        conn.execute(f"INSERT INTO {table_name} BY NAME SELECT * FROM staged_rows")
+        conn.unregister("staged_rows")
+    return merge_route_index(conn)
+
+
+def test_heatmap_tiles_update_incrementally():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    parser = ActivityParser()
+    payloads = list(generate_activity_payloads(20))
+    stage_and_promote(conn, parser, payloads[:12])
+    assert index_unindexed_routes(conn) == 12, "Every route should be indexed."
+
+    # new activities plus a re-extracted activity that now has another route
+    other_route = ROUTE_TAILS[(payloads[3]["id"] + 1) % len(ROUTE_TAILS)]
+    start = encode_polyline([payloads[3]["start_latlng"]])
+    payloads[3]["map"]["summary_polyline"] = start + other_route
+    stage_and_promote(conn, parser, payloads)
+    assert index_unindexed_routes(conn) == 9, "Only new and changed routes."
+    assert find_unindexed_routes(TABLE_NAME, conn) == [], "Nothing left to index."
+
+    # the incrementally updated tiles match tiles built from every route at once
+    all_routes = conn.execute(
+        f"SELECT id, content_hash, summary_polyline FROM {TABLE_NAME}"
+    ).fetchall()
+    _, cell_rows = index_routes(all_routes)
+    expected = Counter((zoom, x, y) for _, zoom, x, y in cell_rows)
+    tiles = conn.execute(
+        f"SELECT zoom, bin_x, bin_y, activities FROM {HEATMAP_TILES_TABLE}"
+    ).fetchall()
+    assert {(z, x, y): n for z, x, y, n in tiles} == expected, "Tiles out of date."
+
+    lat, lng = payloads[0]["start_latlng"]
+    bins = query_heatmap(conn, 12, lat - 0.01, lng - 0.01, lat + 0.01, lng + 0.01)
+    assert bins and all(abs(b[0] - lat) < 0.05 for b in bins), "Bins off the map."
+    ids = find_activities_in_area(conn, lat - 1e-4, lng - 1e-4, lat + 1e-4, lng + 1e-4)
+    assert str(payloads[0]["id"]) in ids, "Route through the area should be found."
@@ -0,0 +1,68 @@
+import csv
+import pytest
+
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.local_analytics import (
+    ANALYTICS_MODELS,
+    connect_duckdb,
+    load_local_exports,
+    local_table_exists,
+    run_data_model,
+)
+from src.utilities.parquet_utils import write_activities_to_parquet
+from src.utilities.strava_api_utils import parse_api_output
+
+
+def test_load_local_exports(tmp_path):
+    pytest.importorskip("duckdb")
+    payloads = list(generate_activity_payloads(300))
+    activities = [parse_api_output(p) for p in payloads]
+    activities[0][1] = "Hills | Repeats"
+    # an older csv export without the content_hash, summary_polyline and
+    # athlete_id columns
+    with open(tmp_path / "2022_06_18_export_file.csv", "w") as fp:
+        csv.writer(fp, delimiter="|").writerows(a[:-3] for a in activities[:200])
+    # a later parquet export that re-extracted activity 150 with more kudos
+    payloads[150]["kudos_count"] += 5
+    activities[150] = parse_api_output(payloads[150])
+    write_activities_to_parquet(
+        activities[150:], str(tmp_path / "2022_06_19_export_file.parquet")
+    )
+
+    conn = connect_duckdb()
+    assert not local_table_exists(conn), "Table should not exist before loading."
+    assert load_local_exports(conn, str(tmp_path)) == 300, "Bad activity count."
+    assert local_table_exists(conn), "Table should exist after loading."
+    name, kudos = conn.execute(
+        """SELECT name, kudos_count FROM public.strava_activity_data
+        WHERE id = ?""",
+        [str(payloads[150]["id"])],
+    ).fetchone()
+    assert kudos == payloads[150]["kudos_count"], "Latest export should win."
+    assert conn.execute(
+        "SELECT name FROM public.strava_activity_data WHERE id = ?",
+        [str(payloads[0]["id"])],
+    ).fetchone() == ("Hills | Repeats",), "Quoted delimiters should be read."
+
+    for model in ANALYTICS_MODELS:
+        columns, rows = run_data_model(conn, model)
+        assert columns and rows, f"{model} should return results."
+    columns, rows = run_data_model(conn, "yearly_statistics")
+    assert columns[0] == "activity_year", "Bad yearly_statistics columns."
+    # totals computed in python from the loaded activities, not through the rollup
+    yearly_totals = {}
+    for start_date, distance, moving_time, elevation in conn.execute(
+        """SELECT start_date, distance, moving_time, total_elevation_gain
+        FROM public.strava_activity_data WHERE type = 'Run'"""
+    ).fetchall():
+        totals = yearly_totals.setdefault(start_date.year, [0, 0, 0])
+        totals[0] += distance
+        totals[1] += moving_time
+        totals[2] += elevation
+    expected = [
+        (year, round(distance / 1609), round(moving_time / 3600), round(elevation))
+        for year, (distance, moving_time, elevation) in sorted(yearly_totals.items())
+    ]
+    assert [
+        tuple(int(value) for value in row[:4]) for row in rows
+    ] == expected, "yearly_statistics should match the loaded runs."
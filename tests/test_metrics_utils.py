@@ -0,0 +1,55 @@
+import json
+import pytest
+from datetime import timedelta
+
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.extract_strava_data import extract_strava_activities
+from src.utilities.metrics_utils import RunMetrics, start_run_metrics
+from src.utilities.strava_api_utils import StravaRateLimiter, convert_strava_start_date
+
+
+def test_run_metrics_records_stages():
+    clock = VirtualClock(start=0)
+    metrics = RunMetrics("run-1", clock=clock.time)
+    with metrics.stage("copy"):
+        clock.sleep(2)
+        metrics.incr("copy", "rows", 500)
+    with pytest.raises(RuntimeError):
+        with metrics.stage("merge"):
+            raise RuntimeError("boom")
+    metrics.finish("failed")
+    report = metrics.to_dict()
+    assert report["status"] == "failed", "Run status should be reported."
+    assert report["stages"]["copy"]["seconds"] == 2, "Stage should be timed."
+    assert report["stages"]["copy"]["rows_per_second"] == 250, "Bad rows/s."
+    assert report["stages"]["merge"]["failed"], "Failed stage should be flagged."
+    prometheus = metrics.to_prometheus()
+    assert 'strava_pipeline_stage_rows{stage="copy"} 500' in prometheus, "No rows."
+    assert "strava_pipeline_run_success 0" in prometheus, "Run should have failed."
+    assert "copy: 2.00s, rows=500, 250 rows/s" in metrics.format_summary(), "Summary."
+
+
+def test_instrumented_extraction(tmp_path):
+    metrics = start_run_metrics()
+    payloads = list(generate_activity_payloads(450))
+    last_updated_warehouse = convert_strava_start_date(
+        payloads[420]["start_date"]
+    ) - timedelta(seconds=1)
+    clock = VirtualClock()
+    with MockStravaAPI(payloads, short_limit=2, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+        extract_strava_activities(
+            last_updated_warehouse, {}, rate_limiter, api.activities_url
+        )
+    stage = metrics.stages["extract"]
+    assert stage.calls == 1, "Extraction should be timed once."
+    assert stage.counters["rows"] == 421, "Extracted rows should be counted."
+    assert stage.counters["http_requests"] == 3, "HTTP requests should be counted."
+    assert stage.counters["rate_limit_sleep_seconds"] > 0, "Sleeps should be counted."
+
+    metrics.finish()
+    metrics.write_json(str(tmp_path / "metrics" / "run_report.json"))
+    with open(tmp_path / "metrics" / "run_report.json") as fp:
+        report = json.load(fp)
+    assert report["stages"]["extract"]["counters"]["rows"] == 421, "Bad report."
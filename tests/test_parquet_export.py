@@ -0,0 +1,38 @@
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from decimal import Decimal
+
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.utilities.parquet_utils import load_arrow_schema, write_activities_to_parquet
+from src.utilities.schema_utils import load_table_schema
+from src.utilities.strava_api_utils import parse_api_output
+
+
+def test_load_table_schema():
+    schema = load_table_schema()
+    assert schema[0] == ("id", "VARCHAR"), "First column should be the id."
+    assert ("start_date", "TIMESTAMP") in schema, "start_date should be a timestamp."
+    assert len(schema) == len(
+        parse_api_output(next(generate_activity_payloads(1)))
+    ), "Schema and parsed activities should have the same columns."
+
+
+def test_write_activities_to_parquet(tmp_path):
+    activities = [parse_api_output(p) for p in generate_activity_payloads(100)]
+    activities[0][1] = "Hills | Repeats"
+    export_file_path = tmp_path / "export_file.parquet"
+    write_activities_to_parquet(activities, str(export_file_path), 1)
+
+    parquet_file = pq.ParquetFile(export_file_path)
+    months = {(a[20].year, a[20].month) for a in activities}
+    assert (
+        parquet_file.schema_arrow == load_arrow_schema()
+    ), "Schema should match table."
+    assert parquet_file.num_row_groups == len(months), "Row groups split by month."
+    table = parquet_file.read()
+    assert table.num_rows == 100, "All activities should be written."
+    assert "Hills | Repeats" in table.column("name").to_pylist(), "Names keep pipes."
+    assert table.column("max_heartrate").type == pa.int32(), "Integers are typed."
+    assert isinstance(table.column("total_elevation_gain")[0].as_py(), Decimal)
@@ -0,0 +1,70 @@
+import pytest
+import configparser
+import json
+import os
+import requests
+import time
+
+from benchmarks.mock_strava_api import MockStravaAPI
+from src.utilities.pipeline_context import PipelineContext
+from src.utilities.strava_api_utils import get_strava_access_token
+
+
+def test_strava_access_token_is_cached_until_expiry(tmp_path):
+    token_cache_path = str(tmp_path / "token.json")
+    clock = [time.time()]
+    with MockStravaAPI([], clock=lambda: clock[0]) as api:
+        args = (api.auth_url, "client", "secret", "refresh", token_cache_path)
+        first = get_strava_access_token(*args)
+        second = get_strava_access_token(*args)
+        assert first == second, "Cached access token should be reused."
+        assert api.auth_request_count == 1, "Token should only be refreshed once."
+        get_strava_access_token(
+            api.auth_url, "other", "secret", "refresh", token_cache_path
+        )
+        assert api.auth_request_count == 2, "Token cache should be keyed by client."
+        # tokens handed out from now on are already expired
+        clock[0] = 0
+        get_strava_access_token(*args)
+        get_strava_access_token(*args)
+        assert api.auth_request_count == 4, "Expired tokens should be refreshed."
+
+
+class FakeTokenResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+    def json(self):
+        return self.body
+
+
+def test_strava_token_errors_are_not_cached(tmp_path, monkeypatch):
+    token_cache_path = str(tmp_path / "token.json")
+    args = ("auth_url", "client", "secret", "refresh", token_cache_path)
+    error = {"message": "Bad Request", "errors": [{"code": "invalid"}]}
+    responses = [FakeTokenResponse(400, error), FakeTokenResponse(200, error)]
+    monkeypatch.setattr(requests, "post", lambda *a, **kw: responses.pop(0))
+    with pytest.raises(requests.HTTPError):
+        get_strava_access_token(*args)
+    with pytest.raises(ValueError):
+        get_strava_access_token(*args)
+    assert not os.path.exists(token_cache_path), "Error bodies should not be cached."
+
+    # a cache written before the check is a miss, not a KeyError
+    with open(token_cache_path, "w") as fp:
+        json.dump(dict(error, source=["client", "refresh"]), fp)
+    token = {"access_token": "new", "expires_at": time.time() + 60 * 60}
+    responses.append(FakeTokenResponse(200, token))
+    assert get_strava_access_token(*args) == "new", "Bad cache should be refreshed."
+
+
+def test_pipeline_context_reuses_clients():
+    ctx = PipelineContext()
+    assert isinstance(ctx.config, configparser.ConfigParser), "Config not loaded."
+    assert ctx.config is PipelineContext().config, "Config should be parsed once."
+    assert ctx.s3() is ctx.s3(), "S3 client should be reused."
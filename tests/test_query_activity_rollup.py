@@ -0,0 +1,120 @@
+import pytest
+
+from benchmarks.local_warehouse import create_local_warehouse
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.build_data_model import ACTIVITY_ROLLUP_SCRIPT, build_monthly_data_model
+from src.local_analytics import run_data_model
+from src.query_activity_rollup import (
+    query_activity_rollup,
+    summarize_month,
+    summarize_week,
+)
+from src.redshift_staging_to_production import (
+    ACTIVITY_ROLLUP_TABLE,
+    redshift_staging_to_production,
+)
+from src.utilities.strava_api_utils import ActivityParser
+from tests.test_staging_to_production import TABLE_NAME, stage_activities
+
+
+def load_activities(conn, payloads):
+    parser = ActivityParser()
+    stage_activities(conn, parser, payloads[:250])
+    redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    # change an activity's kudos and move another to a different day
+    payloads[10]["kudos_count"] += 7
+    payloads[20]["start_date"] = payloads[200]["start_date"]
+    stage_activities(conn, parser, payloads)
+    redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+
+
+def test_incremental_rollup_matches_full_rebuild():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    load_activities(conn, list(generate_activity_payloads(400)))
+    select_rollup = f"SELECT * FROM {ACTIVITY_ROLLUP_TABLE} ORDER BY ALL"
+    incremental = conn.execute(select_rollup).fetchall()
+    with open(ACTIVITY_ROLLUP_SCRIPT, "r") as sql_file:
+        conn.execute(sql_file.read())
+    rebuilt = conn.execute(select_rollup).fetchall()
+    assert incremental == rebuilt, "Merges should keep the rollup up to date."
+    n_activities = conn.execute(
+        f"SELECT SUM(activity_count) FROM {ACTIVITY_ROLLUP_TABLE}"
+    ).fetchone()[0]
+    assert n_activities == 400, "Rollup should cover every activity once."
+
+
+def test_incremental_model_fills_an_empty_rollup():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    parser = ActivityParser()
+    payloads = list(generate_activity_payloads(400))
+    # a deployment that predates the rollup: a loaded fact table and model
+    stage_activities(conn, parser, payloads[:300])
+    conn.execute(f"INSERT INTO {TABLE_NAME} SELECT * FROM staging_table")
+    conn.execute("DROP TABLE staging_table")
+    build_monthly_data_model(conn, full_rebuild=True)
+    conn.execute(f"DELETE FROM {ACTIVITY_ROLLUP_TABLE}")
+
+    payloads[10]["kudos_count"] += 7
+    stage_activities(conn, parser, payloads[:310])
+    redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    build_monthly_data_model(conn)
+    select_model = "SELECT * FROM activity_summary_monthly ORDER BY ALL"
+    incremental = conn.execute(select_model).fetchall()
+    n_activities = conn.execute(
+        f"SELECT SUM(activity_count) FROM {ACTIVITY_ROLLUP_TABLE}"
+    ).fetchone()[0]
+    assert n_activities == 310, "First merge should fill the whole rollup."
+    build_monthly_data_model(conn, full_rebuild=True)
+    rebuilt = conn.execute(select_model).fetchall()
+    assert incremental == rebuilt, "Incremental build should match a full rebuild."
+
+    # a model build finding the rollup empty rebuilds it rather than the queue
+    conn.execute(f"DELETE FROM {ACTIVITY_ROLLUP_TABLE}")
+    conn.execute("DELETE FROM activity_summary_monthly")
+    build_monthly_data_model(conn)
+    assert conn.execute(select_model).fetchall() == rebuilt, "Rollup not rebuilt."
+
+
+def test_models_from_rollup_match_fact_table():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    load_activities(conn, list(generate_activity_payloads(400)))
+    _, rows = run_data_model(conn, "monthly_statistics")
+    expected = conn.execute(f"""
+        SELECT DATE_TRUNC('month', start_date::date) AS activity_month,
+            ROUND(SUM(distance)/1609), ROUND(SUM(moving_time)/(60*60)),
+            ROUND(SUM(total_elevation_gain)), ROUND(SUM(athlete_count)),
+            ROUND(AVG(athlete_count))
+        FROM {TABLE_NAME} WHERE type='Run'
+        GROUP BY activity_month ORDER BY activity_month""").fetchall()
+    assert rows == expected, "Monthly statistics should match the fact table."
+
+    _, rows = run_data_model(conn, "average_kudos_by_workout")
+    expected = conn.execute(f"""
+        SELECT workout_type, AVG(kudos_count), AVG(average_speed)
+        FROM {TABLE_NAME} WHERE type = 'Run' GROUP BY workout_type""").fetchall()
+    assert sorted(rows) == pytest.approx(sorted(expected)), "Bad kudos by workout."
+
+    months = conn.execute(f"""
+        SELECT DATE_TRUNC('month', start_date::date) AS activity_month,
+            COUNT(*), AVG(kudos_count), STDDEV_SAMP(kudos_count)
+        FROM {TABLE_NAME} WHERE type = 'Run'
+        GROUP BY activity_month ORDER BY activity_month""").fetchall()
+    summaries = query_activity_rollup(conn, "month")
+    assert [s.period for s in summaries] == [m[0] for m in months], "Bad months."
+    for summary, (_, count, avg_kudos, std_kudos) in zip(summaries, months):
+        assert summary.activity_count == count, "Bad monthly activity count."
+        assert summary.avg_kudos == pytest.approx(avg_kudos), "Bad average kudos."
+        assert summary.std_kudos == pytest.approx(std_kudos), "Bad kudos stddev."
+
+    first_month = summaries[0].period
+    month = summarize_month(conn, first_month.year, first_month.month)
+    assert month == summaries[0], "Month summary should match the series."
+    weeks = query_activity_rollup(conn, "week")
+    week = summarize_week(conn, weeks[-1].period.date())
+    assert week == weeks[-1], "Week summary should match the series."
+    assert summarize_month(conn, 1990, 1) is None, "Empty month has no summary."
+    with pytest.raises(ValueError):
+        query_activity_rollup(conn, "hour")
@@ -0,0 +1,95 @@
+import pytest
+import shutil
+from datetime import datetime, timedelta
+
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.extract_strava_data import extract_strava_activities, replay_raw_activities
+from src.utilities.raw_cache_utils import RawResponseCache
+from src.utilities.strava_api_utils import (
+    StravaRateLimiter,
+    convert_strava_start_date,
+    parse_api_output,
+)
+
+
+def extract_into_cache(payloads, watermark, raw_cache):
+    clock = VirtualClock()
+    with MockStravaAPI(payloads, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+        extract_strava_activities(
+            watermark,
+            {},
+            rate_limiter,
+            api.activities_url,
+            per_page=50,
+            raw_cache=raw_cache,
+        )
+    return api.request_count
+
+
+def test_replay_reparses_latest_cached_payloads(tmp_path):
+    raw_cache = RawResponseCache(str(tmp_path / "raw"))
+    payloads = list(generate_activity_payloads(200))
+    watermark = convert_strava_start_date(payloads[-1]["start_date"]) - timedelta(1)
+    extract_into_cache(payloads, watermark, raw_cache)
+    assert raw_cache.pages_written == 4, "Every fetched page should be cached."
+
+    # fetching unchanged pages again stores no new pages, a changed one does
+    payloads[120]["kudos_count"] += 7
+    extract_into_cache(payloads, watermark, raw_cache)
+    assert raw_cache.pages_written == 5, "Pages should be content addressed."
+    assert len(raw_cache.load_index()) == 250, "Only new pages should be indexed."
+
+    def no_http(*args, **kwargs):
+        raise AssertionError("Replay should not make HTTP calls.")
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("requests.Session.request", no_http)
+        replayed = replay_raw_activities(raw_cache)
+    expected = {str(p["id"]): parse_api_output(p) for p in payloads}
+    assert len(replayed) == 200, "Each activity should be replayed once."
+    assert all(
+        row == expected[str(row[0])] for row in replayed
+    ), "Replay should parse the latest payload of every activity."
+
+
+def test_raw_cache_mirrors_pages_and_index_to_s3(tmp_path):
+    from benchmarks.local_s3 import LocalS3Client
+
+    s3 = LocalS3Client()
+    raw_cache = RawResponseCache(str(tmp_path / "raw"), s3, "bucket")
+    page = list(generate_activity_payloads(3))
+    digest = raw_cache.put_page(page, datetime(2022, 6, 18))
+    raw_cache.flush("run1")
+    keys = {key for _, key in s3.objects}
+    assert raw_cache.page_path(digest) in keys, "Page should be mirrored to s3."
+    assert f"{raw_cache.root}/index/run1.csv" in keys, "Index should be mirrored."
+    assert raw_cache.load_page(digest) == page, "Page should round trip."
+
+
+def test_replay_reads_index_and_pages_from_s3_mirror(tmp_path):
+    from benchmarks.local_s3 import LocalS3Client
+
+    s3 = LocalS3Client()
+    root = str(tmp_path / "raw")
+    raw_cache = RawResponseCache(root, s3, "bucket")
+    payloads = list(generate_activity_payloads(120))
+    watermark = convert_strava_start_date(payloads[-1]["start_date"]) - timedelta(1)
+    extract_into_cache(payloads, watermark, raw_cache)
+    raw_cache.flush("run1")
+    payloads[30]["kudos_count"] += 2
+    extract_into_cache(payloads, watermark, raw_cache)
+    raw_cache.flush("run2")
+
+    # replay on a machine without the local cache
+    shutil.rmtree(root)
+    replayed = replay_raw_activities(RawResponseCache(root, s3, "bucket"))
+    expected = {str(p["id"]): parse_api_output(p) for p in payloads}
+    assert len(replayed) == 120, "Each activity should be replayed once."
+    assert all(
+        row == expected[str(row[0])] for row in replayed
+    ), "Replay should parse the latest mirrored payload of every activity."
+
+    with pytest.raises(ValueError):
+        replay_raw_activities(RawResponseCache(str(tmp_path / "empty")))
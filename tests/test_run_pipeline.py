@@ -0,0 +1,84 @@
+import configparser
+import os
+import pytest
+
+import src.run_pipeline as run_pipeline_module
+from src.run_pipeline import ValidationError, run_pipeline
+from src.utilities.pipeline_context import PipelineContext
+
+
+def test_run_pipeline_skips_downstream_steps(monkeypatch):
+    calls = []
+
+    def make_step(name, result=None):
+        def step(ctx, state):
+            calls.append(name)
+            return result
+
+        return step
+
+    monkeypatch.setattr(
+        run_pipeline_module,
+        "PIPELINE_STEPS",
+        {
+            "extract": (make_step("extract", False), ()),
+            "stage": (make_step("stage"), ("extract",)),
+            "model": (make_step("model"), ("stage",)),
+        },
+    )
+    timings = run_pipeline(ctx=PipelineContext())
+    assert calls == ["extract"], "Steps after an empty extract should be skipped."
+    assert list(timings) == ["extract"], "Only steps that ran should be timed."
+
+
+class FakeContext:
+    def __init__(self, run_state_path):
+        self.config = configparser.ConfigParser()
+        self.config["aws_redshift_creds"] = {"table_name": "public.activities"}
+        self.config["pipeline_config"] = {"run_state_path": run_state_path}
+
+
+def test_failed_run_resumes_its_batch(tmp_path, monkeypatch):
+    run_state_path = str(tmp_path / "run.json")
+    calls = []
+    batches = iter(range(3))
+    failures = {"promote": [RuntimeError("connection reset")]}
+
+    def make_step(name):
+        def step(ctx, state):
+            if name == "extract":
+                state["manifest_path"] = f"s3://bucket/{next(batches)}/manifest.json"
+            calls.append((name, state["staging_table"], state["manifest_path"]))
+            if failures.get(name):
+                raise failures[name].pop()
+
+        return step
+
+    monkeypatch.setattr(
+        run_pipeline_module,
+        "PIPELINE_STEPS",
+        {
+            "extract": (make_step("extract"), ()),
+            "stage": (make_step("stage"), ("extract",)),
+            "validate": (make_step("validate"), ("stage",)),
+            "promote": (make_step("promote"), ("validate",)),
+            "model": (make_step("model"), ("promote",)),
+        },
+    )
+    with pytest.raises(RuntimeError):
+        run_pipeline(ctx=FakeContext(run_state_path))
+    assert os.path.exists(run_state_path), "Unfinished run should save its state."
+    _, staging_table, manifest_path = calls[0]
+    calls.clear()
+    run_pipeline(ctx=FakeContext(run_state_path))
+    assert calls == [
+        ("promote", staging_table, manifest_path),
+        ("model", staging_table, manifest_path),
+    ], "Retry should resume the batch from the failed step."
+    assert not os.path.exists(run_state_path), "Finished run should clear its state."
+
+    # a batch halted by validation is left for review rather than resumed
+    failures["validate"] = [ValidationError("halt")]
+    with pytest.raises(ValidationError):
+        run_pipeline(ctx=FakeContext(run_state_path))
+    assert not os.path.exists(run_state_path), "Halted batch should not be resumed."
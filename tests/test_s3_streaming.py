@@ -0,0 +1,165 @@
+import configparser
+import csv
+import gzip
+import io
+import json
+import os
+import pytest
+import re
+from datetime import datetime
+from types import SimpleNamespace
+
+from benchmarks.local_s3 import LocalS3Client
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.copy_to_redshift_staging import COPY_OPTIONS, copy_to_redshift_staging
+from src.extract_strava_data import (
+    export_activities_to_s3,
+    save_data_to_csv,
+    stream_activities_to_s3,
+)
+from src.utilities.strava_api_utils import parse_api_output
+
+
+def test_stream_activities_to_s3_uploads_gzip_parts():
+    s3 = LocalS3Client(min_part_size=16 * 1024)
+    activities = (parse_api_output(p) for p in generate_activity_payloads(3000))
+    n_activities = stream_activities_to_s3(
+        activities, s3, "bucket", "export.csv.gz", part_size=16 * 1024
+    )
+    assert n_activities == 3000, "All activities should be streamed."
+    assert s3.uploaded_parts > 1, "Export should be uploaded in multiple parts."
+    body = gzip.decompress(
+        s3.get_object(Bucket="bucket", Key="export.csv.gz")["Body"].read()
+    )
+    rows = list(csv.reader(io.StringIO(body.decode()), delimiter="|"))
+    assert len(rows) == 3000, "Uploaded object should contain every activity."
+
+
+def test_stream_activities_to_s3_skips_empty_extracts():
+    s3 = LocalS3Client()
+    n_activities = stream_activities_to_s3(iter([]), s3, "bucket", "export.csv.gz")
+    assert n_activities == 0, "No activities should be streamed."
+    assert not s3.objects, "No object should be created for an empty extract."
+
+
+def test_stream_activities_to_s3_defaults_to_configured_bucket(monkeypatch):
+    config = configparser.ConfigParser()
+    config["aws_boto_credentials"] = {"bucket_name": "configured-bucket"}
+    monkeypatch.setattr(
+        "src.extract_strava_data.get_pipeline_context",
+        lambda: SimpleNamespace(config=config),
+    )
+    s3 = LocalS3Client()
+    activities = (parse_api_output(p) for p in generate_activity_payloads(10))
+    stream_activities_to_s3(activities, s3, export_file_path="export.csv.gz")
+    assert list(s3.objects) == [
+        ("configured-bucket", "export.csv.gz")
+    ], "Export should go to the bucket in pipeline.conf."
+
+
+class FakeRedshiftConnection:
+    def __init__(self):
+        self.executed = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        self.executed.append(query)
+
+    def fetchone(self):
+        return (0,)
+
+    def commit(self):
+        pass
+
+
+def test_export_activities_to_s3_writes_parts_and_manifest(tmp_path, monkeypatch):
+    repo_dir = os.getcwd()
+    monkeypatch.chdir(tmp_path)
+    s3 = LocalS3Client()
+    activities = [parse_api_output(p) for p in generate_activity_payloads(1001)]
+    manifest_path = export_activities_to_s3(
+        activities, s3, "bucket", n_parts=4, run_date=datetime(2022, 6, 18), run_id="r1"
+    )
+    prefix = "strava_data/date=2022-06-18/run=r1"
+    assert manifest_path == f"s3://bucket/{prefix}/manifest.json", "Bad manifest."
+    manifest = json.loads(
+        s3.get_object(Bucket="bucket", Key=f"{prefix}/manifest.json")["Body"].read()
+    )
+    entries = manifest["entries"]
+    assert len(entries) == 4 and all(e["mandatory"] for e in entries), "Bad parts."
+    rows = []
+    for entry in entries:
+        key = entry["url"][len("s3://bucket/") :]
+        assert key.startswith(prefix), "Parts should be under the run's prefix."
+        body = s3.get_object(Bucket="bucket", Key=key)["Body"].read()
+        assert entry["meta"]["content_length"] == len(body), "Bad content_length."
+        part = gzip.decompress(body).decode()
+        rows.extend(csv.reader(io.StringIO(part), delimiter="|"))
+    assert [r[0] for r in rows] == [str(a[0]) for a in activities], "Rows lost."
+
+    rs_conn = FakeRedshiftConnection()
+    copy_to_redshift_staging(
+        "public.strava_activity_data",
+        rs_conn,
+        manifest_path,
+        "role",
+        COPY_OPTIONS["csv.gz"],
+        manifest=True,
+    )
+    assert f"FROM '{manifest_path}'" in rs_conn.executed[1], "COPY the manifest."
+    assert "MANIFEST CSV" in rs_conn.executed[1], "COPY should use the manifest."
+
+    # local analytics reads the parts like any other export
+    duckdb = pytest.importorskip("duckdb")
+    from src.local_analytics import load_local_exports
+
+    monkeypatch.chdir(repo_dir)
+    conn = duckdb.connect()
+    data_dir = str(tmp_path / "strava_data")
+    assert load_local_exports(conn, data_dir) == 1001, "Parts not loaded."
+
+
+def redshift_copy_rows(body: str, copy_options: str) -> list:
+    """Split an export into fields the way Redshift's COPY does."""
+    match = re.search(r"DELIMITER '(.)'", copy_options)
+    delimiter = match.group(1) if match else "|"
+    if re.search(r"\bCSV\b", copy_options):
+        return list(csv.reader(io.StringIO(body), delimiter=delimiter))
+    # plain text COPY splits on every delimiter, quotes are just characters
+    return [line.split(delimiter) for line in body.splitlines()]
+
+
+def test_copy_options_load_polylines_containing_the_delimiter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    payloads = list(generate_activity_payloads(3))
+    polyline = "_p~iF~ps|U_ulLnnqC_mqNvxq`@|"
+    payloads[1]["map"]["summary_polyline"] = polyline
+    activities = [parse_api_output(p) for p in payloads]
+    n_columns = len(activities[0])
+    s3 = LocalS3Client()
+    manifest_path = export_activities_to_s3(activities, s3, "bucket", n_parts=1)
+    manifest = json.loads(
+        s3.get_object(Bucket="bucket", Key=manifest_path[len("s3://bucket/") :])[
+            "Body"
+        ].read()
+    )
+    key = manifest["entries"][0]["url"][len("s3://bucket/") :]
+    body = gzip.decompress(s3.get_object(Bucket="bucket", Key=key)["Body"].read())
+    rows = redshift_copy_rows(body.decode(), COPY_OPTIONS["csv.gz"])
+    assert all(len(row) == n_columns for row in rows), "Fields split on the pipe."
+    assert rows[1][25] == polyline, "Polyline should be loaded unchanged."
+
+    export_file_path = save_data_to_csv(activities)
+    with open(export_file_path, "r") as fp:
+        rows = redshift_copy_rows(fp.read(), COPY_OPTIONS["csv"])
+    assert all(len(row) == n_columns for row in rows), "Fields split on the pipe."
+    assert rows[1][25] == polyline, "Polyline should be loaded unchanged."
+
+
+def test_export_activities_to_s3_skips_empty_extracts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    s3 = LocalS3Client()
+    assert export_activities_to_s3([], s3, "bucket") is None, "Nothing to export."
+    assert not s3.objects, "No parts or manifest for an empty extract."
@@ -0,0 +1,95 @@
+import pytest
+
+from datetime import datetime, timedelta
+
+from benchmarks.local_warehouse import create_local_warehouse
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.copy_to_redshift_staging import drop_stale_staging_tables, staging_table_name
+from src.redshift_staging_to_production import redshift_staging_to_production
+from src.utilities.strava_api_utils import ActivityParser
+
+TABLE_NAME = "public.strava_activity_data"
+
+
+def stage_activities(conn, parser, payloads, staging_table="staging_table"):
+    conn.execute(f"CREATE TABLE {staging_table} AS SELECT * FROM {TABLE_NAME} LIMIT 0")
+    rows = [parser.parse_list(response_json) for response_json in payloads]
+    for row in rows:
+        row[0] = str(row[0])
+    placeholders = ", ".join("?" * len(parser.columns))
+    conn.executemany(f"INSERT INTO {staging_table} VALUES ({placeholders})", rows)
+
+
+def test_merge_only_writes_changed_rows():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    parser = ActivityParser()
+    payloads = list(generate_activity_payloads(300))
+    stage_activities(conn, parser, payloads[:200])
+    counts = redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    assert counts == (200, 0, 0), "First load should insert every activity."
+
+    payloads[5]["kudos_count"] += 3
+    stage_activities(conn, parser, payloads[:250])
+    counts = redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    assert counts == (50, 1, 199), "Only new and changed activities should be written."
+    kudos = conn.execute(
+        f"SELECT kudos_count FROM {TABLE_NAME} WHERE id = ?", [str(payloads[5]["id"])]
+    ).fetchone()[0]
+    assert kudos == payloads[5]["kudos_count"], "Changed activity should be updated."
+    n_activities = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+    assert n_activities == 250, "Activities should not be duplicated."
+    weekly_total = conn.execute(
+        "SELECT SUM(activity_count) FROM public.strava_weekly_stats"
+    ).fetchone()[0]
+    assert weekly_total == 250, "Weekly stats should cover every activity."
+
+    stage_activities(conn, parser, payloads[:250])
+    counts = redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    assert counts == (0, 0, 250), "Reloading a batch should change nothing."
+
+
+def test_runs_stage_into_their_own_tables():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    parser = ActivityParser()
+    payloads = list(generate_activity_payloads(300))
+    now = datetime(2022, 6, 20, 12)
+    run_a = staging_table_name("run_a", now)
+    run_b = staging_table_name("run_b", now)
+    stale = staging_table_name("crashed", now - timedelta(days=2))
+    # both runs are staged before either is promoted
+    stage_activities(conn, parser, payloads[:200], run_a)
+    stage_activities(conn, parser, payloads[100:], run_b)
+    stage_activities(conn, parser, payloads[:10], stale)
+    counts_a = redshift_staging_to_production(
+        TABLE_NAME, conn, staging_table=run_a, lock_tables=False
+    )
+    counts_b = redshift_staging_to_production(
+        TABLE_NAME, conn, staging_table=run_b, lock_tables=False
+    )
+    assert counts_a == (200, 0, 0), "First run should insert its activities."
+    assert counts_b == (100, 0, 100), "Second run should only add its new ones."
+
+    assert drop_stale_staging_tables(conn, now=now) == [stale], "Bad stale tables."
+    staging_tables = conn.execute("""SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_name LIKE 'staging_strava_%'""").fetchone()[0]
+    assert staging_tables == 0, "Promoted and stale staging tables should be gone."
+
+
+def test_merge_fills_empty_weekly_stats():
+    pytest.importorskip("duckdb")
+    conn = create_local_warehouse()
+    parser = ActivityParser()
+    payloads = list(generate_activity_payloads(300))
+    # production loaded before the weekly stats table existed
+    stage_activities(conn, parser, payloads[10:])
+    conn.execute(f"INSERT INTO {TABLE_NAME} SELECT * FROM staging_table")
+    conn.execute("DROP TABLE staging_table")
+    stage_activities(conn, parser, payloads[:10])
+    counts = redshift_staging_to_production(TABLE_NAME, conn, lock_tables=False)
+    assert counts == (10, 0, 0), "New activities should be inserted."
+    weekly_total = conn.execute(
+        "SELECT SUM(activity_count) FROM public.strava_weekly_stats"
+    ).fetchone()[0]
+    assert weekly_total == 300, "Weekly stats should cover the whole history."
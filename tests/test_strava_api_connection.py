@@ -19,7 +19,9 @@ def test_connect_strava():
 @pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
 def test_make_strava_api_request():
     header = connect_strava()
-    response_json = make_strava_api_request(header=header, activity_num=1)
-    assert isinstance(response_json, dict), "API should respond with a dictionary."
+    activities = make_strava_api_request(header=header, page=1, per_page=1)
+    assert isinstance(activities, list), "API should respond with a list."
+    response_json = activities[0]
+    assert isinstance(response_json, dict), "Activities should be dictionaries."
     assert "id" in response_json.keys(), "Response dictionary does not contain id key."
     assert isinstance(response_json["id"], int), "Activity ID should be an integer."
@@ -0,0 +1,137 @@
+import asyncio
+import pytest
+from datetime import timedelta
+
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.extract_strava_data import (
+    FIRST_EXTRACTION_DATE,
+    extract_athletes_activities,
+    extract_strava_activities,
+)
+from src.utilities.strava_api_utils import (
+    StravaRateLimiter,
+    convert_strava_start_date,
+)
+
+
+def test_rate_limiter_only_sleeps_when_budget_is_spent():
+    clock = VirtualClock(start=0)
+    rate_limiter = StravaRateLimiter(
+        short_limit=3, daily_limit=100, clock=clock.time, sleep=clock.sleep
+    )
+    for _ in range(3):
+        rate_limiter.wait()
+    assert clock.slept == 0, "Limiter should not sleep while budget remains."
+    rate_limiter.wait()
+    assert clock.slept == 15 * 60, "Limiter should sleep until the window resets."
+    assert rate_limiter.requests_made == 4, "All requests should be counted."
+
+
+def test_rate_limiter_syncs_with_response_headers():
+    clock = VirtualClock(start=60)
+    rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+    rate_limiter.update(
+        {"X-RateLimit-Limit": "200,2000", "X-RateLimit-Usage": "200,450"}
+    )
+    assert rate_limiter.short_limit == 200, "Limit should come from headers."
+    assert rate_limiter.daily_usage == 450, "Daily usage should come from headers."
+    rate_limiter.wait()
+    assert clock.slept == 15 * 60 - 60, "Limiter should only sleep to window end."
+    rate_limiter.update(
+        {
+            "X-RateLimit-Limit": "600,6000",
+            "X-RateLimit-Usage": "1,451",
+            "X-ReadRateLimit-Limit": "300,3000",
+            "X-ReadRateLimit-Usage": "1,451",
+        }
+    )
+    assert rate_limiter.short_limit == 300, "Stricter read limit should be kept."
+    assert rate_limiter.daily_limit == 3000, "Raised limits should be picked up."
+
+
+def test_rate_limiter_counts_in_flight_requests_in_next_window():
+    clock = VirtualClock(start=0)
+    rate_limiter = StravaRateLimiter(
+        short_limit=3,
+        daily_limit=100,
+        clock=clock.time,
+        sleep=clock.sleep,
+        async_sleep=clock.async_sleep,
+    )
+
+    async def start_requests(n):
+        for _ in range(n):
+            await rate_limiter.wait_async()
+
+    asyncio.run(start_requests(2))
+    assert rate_limiter.in_flight == 2, "Unanswered requests should be in flight."
+    clock.sleep(15 * 60)
+    assert rate_limiter.reserve() == 0, "New window should have room left."
+    assert rate_limiter.reserve() > 0, "In-flight requests should use its budget."
+    for _ in range(2):
+        rate_limiter.update({})
+    assert rate_limiter.in_flight == 0, "Answered requests should leave flight."
+
+
+def test_athlete_rate_limiter_draws_on_application_budget():
+    clock = VirtualClock(start=0)
+    app = StravaRateLimiter(3, 100, clock=clock.time, sleep=clock.sleep)
+    athletes = [
+        StravaRateLimiter(2, 100, clock=clock.time, sleep=clock.sleep, parent=app)
+        for _ in range(2)
+    ]
+    assert [athletes[0].reserve(), athletes[0].reserve()] == [0, 0], "Within budget."
+    assert athletes[0].reserve() > 0, "Athlete budget should be spent."
+    assert athletes[1].reserve() == 0, "Other athletes keep their own budget."
+    assert athletes[1].reserve() > 0, "Application budget should be spent."
+    assert app.requests_made == 3, "Only granted requests should be counted."
+    athletes[1].update({"X-RateLimit-Limit": "2,100", "X-RateLimit-Usage": "2,3"})
+    assert app.short_limit == 2, "Headers should sync the application budget."
+
+
+def test_extract_athletes_activities_concurrently():
+    athlete_ids = ["101", "102", "103"]
+    feeds = {
+        f"token-{athlete_id}": list(
+            generate_activity_payloads(
+                250, seed=i, athlete_id=int(athlete_id), first_id=(i + 1) * 10**6
+            )
+        )
+        for i, athlete_id in enumerate(athlete_ids)
+    }
+    clock = VirtualClock(start=0)
+    with MockStravaAPI(
+        [], short_limit=4, clock=clock.time, athlete_activities=feeds
+    ) as api:
+        rate_limiter = StravaRateLimiter(4, 1000, clock=clock.time, sleep=clock.sleep)
+        results = extract_athletes_activities(
+            {athlete_id: FIRST_EXTRACTION_DATE for athlete_id in athlete_ids},
+            {a: {"Authorization": f"Bearer token-{a}"} for a in athlete_ids},
+            rate_limiter,
+            athlete_limits=(2, 1000),
+            url=api.activities_url,
+        )
+    assert list(results) == athlete_ids, "Every athlete should be extracted."
+    for athlete_id, activities in results.items():
+        assert len(activities) == 250, "All of an athlete's activities are extracted."
+        assert {a[26] for a in activities} == {athlete_id}, "Rows need athlete_id."
+    assert api.rate_limited_count == 0, "Shared budget should avoid 429s."
+    assert rate_limiter.requests_made == api.request_count == 6, "Bad request count."
+    assert clock.slept > 0, "Requests should wait for the shared budget."
+
+
+def test_extract_strava_activities_pages_after_watermark():
+    payloads = list(generate_activity_payloads(450))
+    last_updated_warehouse = convert_strava_start_date(
+        payloads[420]["start_date"]
+    ) - timedelta(seconds=1)
+    clock = VirtualClock()
+    with MockStravaAPI(payloads, short_limit=2, clock=clock.time) as api:
+        rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+        all_activities = extract_strava_activities(
+            last_updated_warehouse, {}, rate_limiter, api.activities_url
+        )
+    assert len(all_activities) == 421, "All new activities should be extracted."
+    assert api.request_count == 3, "Activities should be fetched in full pages."
+    assert api.rate_limited_count == 0, "Limiter should avoid 429 responses."
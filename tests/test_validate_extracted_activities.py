@@ -0,0 +1,204 @@
+import configparser
+import csv
+import os
+import pytest
+from datetime import timedelta
+
+from benchmarks.mock_strava_api import MockStravaAPI, VirtualClock
+from benchmarks.synthetic_activities import generate_activity_payloads
+from src.extract_strava_data import extract_athletes_activities
+from src.run_pipeline import extract_step
+from src.utilities.strava_api_utils import (
+    StravaRateLimiter,
+    convert_strava_start_date,
+    parse_api_output,
+)
+from src.validate_extracted_activities import (
+    ActivityBatchValidator,
+    WeeklyHistory,
+    load_batch_validator,
+    load_weekly_history,
+    report_batch_quality,
+)
+from src.validator import suite_should_halt
+from tests.test_extraction_checkpoint import FakeContext
+
+
+def parse_activities(n):
+    return [parse_api_output(p) for p in generate_activity_payloads(n)]
+
+
+def test_clean_batch_passes():
+    activities = parse_activities(200)
+    validator = ActivityBatchValidator(history=WeeklyHistory(180.0, 40.0, 5.0, 2.0))
+    checked = list(validator.check(activities))
+    assert checked == activities, "Activities should stream through unchanged."
+    results = {r.name: r for r in validator.results()}
+    assert set(results) == {
+        "duplicate_ids",
+        "invalid_rows",
+        "batch_activity_count_zscore",
+        "batch_kudos_avg_zscore",
+    }, "Bad set of checks."
+    assert results["duplicate_ids"].passed, "Batch has no duplicates."
+    assert results["invalid_rows"].passed, "Batch has no invalid rows."
+    assert results["batch_activity_count_zscore"].result_1 == 0.5, "Bad z-score."
+    assert not suite_should_halt(list(results.values())), "Batch should be accepted."
+
+
+def test_bad_batch_is_rejected():
+    activities = parse_activities(50)
+    columns = ActivityBatchValidator().columns
+    activities.append(list(activities[3]))
+    activities[0][0] = None
+    activities[1][columns.index("kudos_count")] = -1
+    activities[2][columns.index("lat")] = 120.0
+    activities[4][columns.index("timezone")] = "x" * 300
+    activities[5][columns.index("start_date")] = "16/06/2022"
+    validator = ActivityBatchValidator(seen_ids=[activities[10][0]])
+    list(validator.check(activities))
+    results = {r.name: r for r in validator.results()}
+    assert results["duplicate_ids"].result_1 == 2, "Both duplicates should count."
+    assert results["invalid_rows"].result_1 == 5, "Bad invalid row count."
+    for column in ("id", "kudos_count", "lat", "timezone", "start_date"):
+        assert not results[f"invalid_{column}"].passed, f"{column} should fail."
+    assert "batch_kudos_avg_zscore" not in results, "No history, no z-scores."
+    assert suite_should_halt(list(results.values())), "Batch should be rejected."
+
+    validator = ActivityBatchValidator(max_invalid_fraction=0.1)
+    list(validator.check(activities[:-1]))
+    assert not suite_should_halt(validator.results()), "5 of 51 rows are tolerated."
+
+
+def test_bad_rows_are_quarantined(tmp_path):
+    activities = parse_activities(50)
+    columns = ActivityBatchValidator().columns
+    activities.append(list(activities[3]))
+    activities[1][columns.index("kudos_count")] = -1
+    rejects_path = str(tmp_path / "rejects" / "run.csv")
+    validator = ActivityBatchValidator(rejects_path=rejects_path)
+    checked = list(validator.check(activities))
+    assert checked == activities[:1] + activities[2:50], "Bad rows should be dropped."
+    with open(rejects_path, "r", newline="") as fp:
+        rejects = list(csv.reader(fp, delimiter="|"))
+    assert [(row[0], row[-1]) for row in rejects] == [
+        (str(activities[1][0]), "invalid_kudos_count"),
+        (str(activities[3][0]), "duplicate_ids"),
+    ], "Bad rows should be quarantined with the checks they failed."
+    results = validator.results()
+    assert not suite_should_halt(results), "Quarantined rows should only warn."
+    assert not all(r.passed for r in results), "Quarantined rows should be reported."
+
+
+def test_quarantined_batch_does_not_block_later_runs(tmp_path, monkeypatch):
+    import src.extract_strava_data as extract_module
+
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    rejects_dir = str(tmp_path / "rejects")
+    payloads = list(generate_activity_payloads(50))
+    payloads[3]["kudos_count"] = -1
+    watermarks = [convert_strava_start_date(payloads[-1]["start_date"]) - timedelta(1)]
+    clock = VirtualClock()
+    rate_limiter = StravaRateLimiter(clock=clock.time, sleep=clock.sleep)
+    exported = []
+    monkeypatch.setattr(
+        "src.validate_extracted_activities.post_slack_message", lambda url, msg: True
+    )
+    monkeypatch.setattr(
+        extract_module,
+        "get_athlete_watermarks",
+        lambda athlete_ids, mysql_conn: {None: watermarks[-1]},
+    )
+    monkeypatch.setattr(
+        extract_module,
+        "export_activities_to_s3",
+        lambda activities, s3, bucket_name, output_format, n_parts: exported.append(
+            activities
+        ),
+    )
+
+    def run_extract_step(api_payloads):
+        ctx = FakeContext(checkpoint_path)
+        ctx.config["strava_quality_config"] = {"rejects_dir": rejects_dir}
+        ctx.config["slack_config"] = {"webhook_url": "https://hooks.slack.test"}
+        with MockStravaAPI(api_payloads, clock=clock.time) as api:
+            monkeypatch.setattr(
+                extract_module,
+                "extract_athletes_activities",
+                lambda watermarks, headers, athlete_limits, max_workers, **kwargs: (
+                    extract_athletes_activities(
+                        watermarks,
+                        headers,
+                        rate_limiter,
+                        url=api.activities_url,
+                        **kwargs,
+                    )
+                ),
+            )
+            state = {"export_format": "csv"}
+            return extract_step(ctx, state), state
+
+    has_rows, state = run_extract_step(payloads)
+    assert has_rows and state["n_activities"] == 49, "Only the bad row is held back."
+    assert len(os.listdir(rejects_dir)) == 1, "Bad row should be quarantined."
+    assert not os.path.exists(checkpoint_path), "Checkpoint should be cleared."
+
+    # the next run loads new activities instead of retrying the bad batch
+    watermarks.append(convert_strava_start_date(payloads[0]["start_date"]))
+    new_activity = dict(payloads[0], id=payloads[0]["id"] + 1)
+    new_activity["start_date"] = (watermarks[-1] + timedelta(hours=1)).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+    has_rows, state = run_extract_step([new_activity] + payloads)
+    assert has_rows and state["n_activities"] == 1, "New activity should be found."
+    assert exported[-1][0][0] == new_activity["id"], "New activity should be loaded."
+
+
+def test_batch_validator_accepts_loaded_activities_again(tmp_path):
+    pytest.importorskip("duckdb")
+    from benchmarks.local_warehouse import create_local_warehouse
+    from src.utilities.strava_api_utils import ActivityParser
+    from tests.test_staging_to_production import TABLE_NAME, stage_activities
+
+    conn = create_local_warehouse()
+    payloads = list(generate_activity_payloads(100))
+    stage_activities(conn, ActivityParser(), payloads)
+    conn.execute(f"INSERT INTO {TABLE_NAME} SELECT * FROM staging_table")
+    config = configparser.ConfigParser()
+    config["strava_quality_config"] = {"rejects_dir": str(tmp_path)}
+    validator = load_batch_validator(config, conn)
+    # a re-sync returns loaded activities, overlapping pages repeat some of them
+    activities = [parse_api_output(p) for p in payloads[:40] + payloads[35:40]]
+    checked = list(validator.check(activities))
+    assert len(checked) == 40, "Re-synced activities are not duplicates."
+    assert validator.duplicate_ids == [
+        str(p["id"]) for p in payloads[35:40]
+    ], "Ids repeated within the batch should be duplicates."
+
+
+def test_report_batch_quality_posts_digest(monkeypatch):
+    messages = []
+    monkeypatch.setattr(
+        "src.validate_extracted_activities.post_slack_message",
+        lambda url, message: messages.append(message),
+    )
+    activities = parse_activities(20)
+    activities.append(activities[0])
+    validator = ActivityBatchValidator()
+    list(validator.check(activities))
+    report_batch_quality(validator, "https://hooks.slack.test")
+    assert messages[0].startswith("In-stream checks of 21 rows: 1/2"), messages[0]
+    assert "FAILED [halt] duplicate_ids" in messages[0], "Failure should be listed."
+
+
+def test_load_weekly_history():
+    pytest.importorskip("duckdb")
+    from benchmarks.local_warehouse import create_local_warehouse
+
+    conn = create_local_warehouse()
+    conn.execute("""INSERT INTO public.strava_weekly_stats VALUES
+        ('2022-06-06', 4, 4, 20), ('2022-06-13', 6, 6, 60)""")
+    history = load_weekly_history(conn, "public.strava_weekly_stats")
+    assert history.avg_count == 5.0, "Bad average weekly count."
+    assert history.avg_kudos == 7.5, "Bad average weekly kudos."
+    assert history.std_kudos == pytest.approx(3.5355, abs=1e-4), "Bad kudos stddev."
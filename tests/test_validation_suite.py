@@ -0,0 +1,101 @@
+import pytest
+import json
+import sqlite3
+from decimal import Decimal
+
+from src.validator import (
+    evaluate_constant_script,
+    format_suite_digest,
+    run_validation_suite,
+    suite_should_halt,
+)
+
+
+@pytest.fixture
+def suite(tmp_path):
+    db_path = str(tmp_path / "warehouse.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE staging_table (id INTEGER, kudos_count INTEGER)")
+    conn.executemany("INSERT INTO staging_table VALUES (?, ?)", [(1, 10), (1, 20)])
+    conn.commit()
+    conn.close()
+    scripts = {
+        "dup.sql": "SELECT COUNT(*) - COUNT(DISTINCT id) FROM staging_table;",
+        "avg_kudos.sql": "SELECT AVG(kudos_count) FROM staging_table;",
+        "zero.sql": "SELECT 0;",
+        "threshold.sql": "SELECT 1.645;",
+    }
+    for name, sql in scripts.items():
+        (tmp_path / name).write_text(sql)
+    checks = [
+        ("dup", "dup.sql", "zero.sql", "equals", "halt"),
+        ("kudos", "avg_kudos.sql", "threshold.sql", "greater_equals", "warn"),
+    ]
+    manifest = {
+        "checks": [
+            {
+                "name": name,
+                "script_1": str(tmp_path / script_1),
+                "script_2": str(tmp_path / script_2),
+                "comparison": comparison,
+                "severity": severity,
+            }
+            for name, script_1, script_2, comparison, severity in checks
+        ]
+    }
+    manifest_path = tmp_path / "suite.json"
+    manifest_path.write_text(json.dumps(manifest))
+    return db_path, str(manifest_path)
+
+
+def test_evaluate_constant_script(tmp_path):
+    script = tmp_path / "constant.sql"
+    script.write_text("SELECT 1.645;")
+    assert evaluate_constant_script(str(script)) == Decimal("1.645")
+    script.write_text("SELECT COUNT(*) FROM staging_table;")
+    assert evaluate_constant_script(str(script)) is None
+
+
+def test_run_validation_suite(suite):
+    db_path, manifest_path = suite
+    executed = []
+
+    def connect():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.set_trace_callback(executed.append)
+        return conn
+
+    check_results = run_validation_suite(connect, manifest_path)
+    assert [r.passed for r in check_results] == [False, True], "Bad check results."
+    assert len(executed) == 2, "Only non-constant scripts should hit the warehouse."
+    assert suite_should_halt(check_results), "Failed halt check should halt."
+    digest = format_suite_digest(check_results, 0.5)
+    assert digest.startswith("Validation suite: 1/2 checks passed"), "Bad digest."
+
+
+def test_run_validation_suite_on_named_staging_table(tmp_path):
+    db_path = str(tmp_path / "warehouse.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE staging_strava_run_a (id INTEGER)")
+    conn.executemany("INSERT INTO staging_strava_run_a VALUES (?)", [(1,), (2,)])
+    conn.commit()
+    conn.close()
+    (tmp_path / "count.sql").write_text("SELECT COUNT(*) FROM {staging_table};")
+    (tmp_path / "two.sql").write_text("SELECT 2;")
+    manifest = {
+        "checks": [
+            {
+                "script_1": str(tmp_path / "count.sql"),
+                "script_2": str(tmp_path / "two.sql"),
+                "comparison": "equals",
+            }
+        ]
+    }
+    manifest_path = tmp_path / "suite.json"
+    manifest_path.write_text(json.dumps(manifest))
+    check_results = run_validation_suite(
+        lambda: sqlite3.connect(db_path, check_same_thread=False),
+        str(manifest_path),
+        staging_table="staging_strava_run_a",
+    )
+    assert check_results[0].result_1 == 2, "Check should run on the named table."